@@ -0,0 +1,293 @@
+"""Drive simulated players through the message handlers of the bot and report throughput and latency
+
+Handlers run the same path as in server.py: chat lane, session lock, `Game.factory_game`, session load and save.
+Game API is served by local simulator, VK by fake transport that answers instantly, DB is in-memory fake
+unless --redis is given.
+
+Usage: python -m benchmarks.game_loop [--players 1000] [--messages 20] [--output results.json]
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import os
+import random
+import resource
+import subprocess
+import time
+import typing
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=1000, help="Amount of concurrent players")
+    parser.add_argument("--messages", type=int, default=20, help="Messages sent by every player")
+    parser.add_argument("--back-rate", type=float, default=0.1, help="Probability of `back` instead of answer")
+    parser.add_argument("--port", type=int, default=8500, help="Port of game API simulator")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every game API response")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Maximal random seconds added to latency")
+    parser.add_argument("--error-rate", type=float, default=0, help="Probability of injected game API error")
+    parser.add_argument("--curve", default="logistic", help="Progression curve of simulator")
+    parser.add_argument("--vk-rate", type=float, default=1000, help="Requests per second allowed by fake VK")
+    parser.add_argument("--redis", help="URL of real Redis, e.g. redis://127.0.0.1. In-memory fake by default")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+
+    return parser.parse_args()
+
+
+class FakeAPI:
+    """VK API that answers instantly. Counts calls and keeps the last text sent to every peer
+
+    :param upload_url: URL that photos are uploaded to
+    :type upload_url: str
+    """
+
+    def __init__(self, upload_url: str):
+        self.upload_url = upload_url
+        self.calls = collections.Counter()
+        self.messages = 0
+        self.last_text = {}
+
+        self._decoder = json.JSONDecoder()
+
+    async def request(self, method: str, params: dict) -> typing.Any:
+        self.calls[method] += 1
+
+        if method == "messages.send":
+            return self._send(params)
+
+        if method == "execute":
+            return [self._send(call) for call in self._parse_execute(params["code"])]
+
+        if method == "photos.getMessagesUploadServer":
+            return {"upload_url": self.upload_url}
+
+        if method == "photos.saveMessagesPhoto":
+            return [{"owner_id": -1, "id": self.calls[method]}]
+
+        raise ValueError(f"Method {method} is not faked")
+
+    def _send(self, params: dict) -> int:
+        self.messages += 1
+        if params.get("message"):
+            self.last_text[params["peer_id"]] = params["message"]
+
+        return self.messages
+
+    def _parse_execute(self, code: str) -> typing.Iterator[dict]:
+        """Params of every `messages.send` call in VKScript code of outbox"""
+        prefix = "API.messages.send("
+        position = code.find(prefix)
+        while position != -1:
+            params, position = self._decoder.raw_decode(code, position + len(prefix))
+            yield params
+            position = code.find(prefix, position)
+
+
+class FakeMessage:
+    """Users message with the attributes that handlers use"""
+
+    def __init__(self, api: FakeAPI, peer_id: int, text: str):
+        self.api = api
+        self.peer_id = peer_id
+        self.chat_id = peer_id
+        self.from_id = peer_id
+        self.text = text
+
+    async def __call__(self, message: str = "", **params):
+        return await self.api.request("messages.send", {"peer_id": self.peer_id, "message": message, **params})
+
+
+class FakeBot:
+    def __init__(self, api: FakeAPI):
+        self.api = api
+        self.group_id = 1
+        self.outbox = None
+
+
+def percentile(values: typing.List[float], q: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0
+
+
+def git_commit() -> typing.Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def count_redis_commands(redis) -> int:
+    """Commands processed by DB so far"""
+    if hasattr(redis, "total_commands"):
+        return redis.total_commands
+
+    info = await redis.info("stats")
+
+    return int(info["stats"]["total_commands_processed"])
+
+
+async def run(args: argparse.Namespace) -> dict:
+    # Imported after environment is set, because config reads it on import
+    import aioredis
+    from aiohttp import web
+
+    from jinbot import config, handlers
+    from jinbot.akinator import session_info
+    from jinbot.client import init_client, close_client
+    from jinbot.images import image_cache, image_workers
+    from jinbot.pool import session_pool
+    from jinbot.region import region_resolver
+    from jinbot.utils import session_cache
+    from simulator import FakeRedis, Settings, make_app
+    from vkapi.outbox import Outbox, TokenBucket
+
+    answers = [
+        config.ANSWER_YES_NUM,
+        config.ANSWER_NO_NUM,
+        config.ANSWER_DONT_KNOW_NUM,
+        config.ANSWER_PROBABLY_YES_NUM,
+        config.ANSWER_PROBABLY_NO_NUM,
+    ]
+    victory = config.TEXT_VICTORY.split("\n")[0]
+    defeat = config.TEXT_DEFEATED.split("\n")[0]
+
+    def choose_handler(text: str) -> typing.Callable:
+        """Same routing as message handlers of server.py"""
+        if text in config.ANSWER_BACK:
+            return handlers.handle_back
+
+        if text in config.ANSWER_CONTINUE:
+            return handlers.handle_continue
+
+        if text in config.ANSWER_RESTART:
+            return handlers.handle_restart
+
+        return handlers.handle_answer
+
+    def next_text(reply: str, rng: random.Random) -> str:
+        """What player answers to the last reply of bot"""
+        if reply.startswith(victory):
+            return rng.choice([config.ANSWER_RESTART_TEXT, config.ANSWER_CONTINUE_TEXT, config.ANSWER_BACK_TEXT])
+
+        if reply.startswith(defeat):
+            return config.ANSWER_RESTART_TEXT
+
+        if rng.random() < args.back_rate:
+            return config.ANSWER_BACK_TEXT
+
+        return rng.choice(answers)
+
+    async def play(peer_id: int):
+        rng = random.Random(f"{args.seed}:{peer_id}")
+        text = config.ANSWER_START_TEXT
+
+        for _ in range(args.messages):
+            msg = FakeMessage(api=api, peer_id=peer_id, text=text)
+            started = time.perf_counter()
+            await handlers.serialized(bot=bot, redis=redis, msg=msg, handler=choose_handler(text))
+            latencies.append(time.perf_counter() - started)
+
+            text = next_text(api.last_text.get(peer_id, ""), rng)
+
+    async def handle_upload(request: web.Request) -> web.Response:
+        await request.read()
+
+        return web.json_response({"server": 1, "photo": "[]", "hash": "simulator"})
+
+    app = make_app(
+        Settings(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, curve=args.curve, seed=args.seed)
+    )
+    app.router.add_post("/upload", handle_upload)
+    simulator = app["simulator"]
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+
+    redis = await aioredis.create_redis_pool(args.redis) if args.redis else FakeRedis()
+    api = FakeAPI(upload_url=f"http://127.0.0.1:{args.port}/upload")
+    bot = FakeBot(api)
+    bot.outbox = Outbox(api=api, bucket=TokenBucket(rate=args.vk_rate, capacity=args.vk_rate))
+    latencies = []
+
+    await init_client()
+    await region_resolver.refresh(force=True)
+    session_info.start()
+    session_pool.start()
+    session_cache.start(redis=redis)
+    image_cache.start(redis=redis)
+    image_workers.start()
+    bot.outbox.start()
+
+    redis_before = await count_redis_commands(redis)
+    http_before = sum(simulator.requests.values())
+    started = time.perf_counter()
+
+    await asyncio.gather(*(play(peer_id) for peer_id in range(1, args.players + 1)))
+
+    elapsed = time.perf_counter() - started
+    # Write-behind and background sends are part of the load
+    await session_cache.stop()
+    await image_workers.stop()
+    await bot.outbox.stop()
+    redis_commands = await count_redis_commands(redis) - redis_before
+    http_calls = sum(simulator.requests.values()) - http_before
+
+    await session_pool.stop()
+    await session_info.stop()
+    await close_client()
+    redis.close()
+    await redis.wait_closed()
+    await runner.cleanup()
+
+    latencies.sort()
+    messages = len(latencies)
+
+    return {
+        "messages": messages,
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(messages / elapsed, 1),
+        "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "latency_p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "redis_commands_per_message": round(redis_commands / messages, 3),
+        "redis_round_trips_per_message": round(redis.round_trips / messages, 3) if args.redis is None else None,
+        "game_api_calls_per_message": round(http_calls / messages, 3),
+        "vk_calls_per_message": round(sum(api.calls.values()) / messages, 3),
+        "vk_messages_per_message": round(api.messages / messages, 3),
+        "injected_errors": sum(simulator.injected.values()),
+        # Kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    args = parse_args()
+    os.environ["AKINATOR_SCHEME"] = "http"
+    os.environ["AKINATOR_URI"] = f"127.0.0.1:{args.port}"
+    os.environ.pop("AKINATOR_GAME_URL", None)
+
+    results = asyncio.get_event_loop().run_until_complete(run(args))
+
+    for name, value in results.items():
+        print(f"{name:<32} {str(value):>12}")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "params": vars(args),
+                    "results": results,
+                },
+                output,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""Micro-benchmarks of CPU work that runs for every message, with alternative implementations side by side
+
+Usage: python -m benchmarks.micro [--number 100000] [--group parse_answer]
+"""
+import argparse
+import json
+import string
+import timeit
+import typing
+
+from jinbot import config
+from jinbot.akinator import Akinator, slim_response
+from jinbot.managers import VKStrategy
+from jinbot.utils import get_object_key
+from benchmarks.session_encoding import make_session, dump_json_session
+
+try:
+    import ujson
+except ImportError:
+    # Alternatives that use ujson are skipped without it
+    ujson = None
+
+CALLBACK = "jQuery331023608747682107778_1600000000.123456"
+
+
+def make_answer_response() -> str:
+    """JSONP response of `answer_api` with question that contains parentheses"""
+    return CALLBACK + "(" + json.dumps(
+        {
+            "completion": "OK",
+            "parameters": {
+                "question": "Ваш персонаж связан с франшизой (фильмы, книги, игры)?",
+                "answers": [{"answer": text} for text in ("Да", "Нет", "Я не знаю", "Возможно, частично", "Скорее нет")],
+                "step": "24",
+                "progression": "87.53482",
+                "questionid": "3187",
+                "infogain": "0.5612",
+            },
+        },
+        ensure_ascii=False,
+    ) + ")"
+
+
+def make_list_response() -> str:
+    """JSONP response of `list` with several guesses and large descriptions"""
+    guess = make_session().first_guess
+
+    return CALLBACK + "(" + json.dumps(
+        {
+            "completion": "OK",
+            "parameters": {
+                "elements": [
+                    {
+                        "element": {
+                            "id": str(index),
+                            "name": guess["name"],
+                            "description": guess["description"] + " (Гарри Поттер)",
+                            "absolute_picture_path": guess["absolute_picture_path"],
+                            "proba": "0.93",
+                        }
+                    }
+                    for index in range(5)
+                ],
+                "NbObjetsPertinents": "5",
+            },
+        },
+        ensure_ascii=False,
+    ) + ")"
+
+
+def parse_split(response: str) -> dict:
+    """Split on `(` and rejoin with `,`, as `Akinator._parse_response` of previous versions"""
+    return json.loads(",".join(response.split("(")[1::])[:-1])
+
+
+def parse_slice(response: str, loads: typing.Callable = json.loads) -> dict:
+    """Slice between the first `(` and the last `)`"""
+    return loads(response[response.index("(") + 1 : response.rindex(")")])
+
+
+def parse_bytes_slice(response: bytes, loads: typing.Callable = json.loads) -> dict:
+    """Slice raw bytes between the first `(` and the last `)` without decoding the whole response to text"""
+    return loads(memoryview(response)[response.index(b"(") + 1 : response.rindex(b")")].tobytes())
+
+
+def compile_template(template: str) -> typing.Callable[..., str]:
+    """Split template once into literals and fields, so rendering is a join of parts"""
+    parts = list(string.Formatter().parse(template))
+
+    def render(**values) -> str:
+        return "".join(literal + (str(values[field]) if field is not None else "") for literal, field, _, _ in parts)
+
+    return render
+
+
+def question_fstring(step: int, progression: float, question: str) -> str:
+    return (
+        f"Вопрос №{step}\n"
+        f"Прогресс: {progression}\n"
+        f"➖➖➖➖➖\n"
+        f"{question}\n"
+        f"➖➖➖➖➖\n"
+    ) + config.MESSAGE_INTERFACE
+
+
+def make_cases() -> typing.Dict[str, typing.Dict[str, typing.Callable[[], typing.Any]]]:
+    """Group of benchmarks: name of implementation: function without arguments"""
+    session = make_session()
+    parser = Akinator()
+    hash_fields = session.dump_fields(dirty_only=False)
+    hash_values = {tag: value.encode("utf-8") for tag, value in hash_fields.items()}
+    json_dump = dump_json_session(session)
+    answer_response = make_answer_response()
+    answer_bytes = answer_response.encode("utf-8")
+    list_response = make_list_response()
+    list_bytes = list_response.encode("utf-8")
+    question = {"step": session.step, "progression": session.progression, "question": session.question}
+    render_question = compile_template(config.TEXT_QUESTION)
+    answers_lower = {key.lower(): value for key, value in config.ANSWERS.items()}
+    restart_set = frozenset(config.ANSWER_RESTART)
+
+    cases = {
+        "dump_session": {
+            "hash": lambda: session.dump_fields(dirty_only=False),
+            "json": lambda: dump_json_session(session),
+        },
+        "load_session": {
+            "hash": lambda: Akinator().load_fields(hash_values),
+            "json": lambda: Akinator().load_session(json_dump),
+        },
+        "parse_answer": {
+            "current": lambda: parser._parse_response(answer_bytes),
+            "split": lambda: parse_split(answer_response),
+            "slice": lambda: parse_slice(answer_response),
+            "bytes_slice": lambda: parse_bytes_slice(answer_bytes),
+        },
+        "parse_list": {
+            "current": lambda: parser._parse_response(list_bytes),
+            "split": lambda: parse_split(list_response),
+            "slice": lambda: parse_slice(list_response),
+            "bytes_slice": lambda: parse_bytes_slice(list_bytes),
+        },
+        "object_key": {
+            "get_object_key": lambda: get_object_key(VKStrategy, "session", "2000000001"),
+            "fstring": lambda: f"{VKStrategy.prefix}||session||2000000001",
+        },
+        "answer_lookup": {
+            "dict": lambda: config.ANSWERS.get("Возможно, частично"),
+            "dict_lower": lambda: answers_lower.get("Возможно, частично".lower()),
+            "restart_list": lambda: "Поехали" in config.ANSWER_RESTART,
+            "restart_frozenset": lambda: "Поехали" in restart_set,
+        },
+        "question_text": {
+            "format": lambda: config.TEXT_QUESTION.format(**question),
+            "compiled": lambda: render_question(**question),
+            "fstring": lambda: question_fstring(**question),
+        },
+    }
+
+    if ujson is not None:
+        cases["dump_session"]["ujson"] = lambda: dump_json_session(session, dumps=ujson.dumps)
+        cases["load_session"]["ujson"] = lambda: Akinator()._load_json_session(ujson.loads(json_dump))
+        cases["parse_answer"]["slice_ujson"] = lambda: parse_slice(answer_response, ujson.loads)
+        cases["parse_answer"]["bytes_slice_ujson"] = lambda: parse_bytes_slice(answer_bytes, ujson.loads)
+        cases["parse_list"]["slice_ujson"] = lambda: parse_slice(list_response, ujson.loads)
+        cases["parse_list"]["bytes_slice_ujson"] = lambda: parse_bytes_slice(list_bytes, ujson.loads)
+
+    return cases
+
+
+def check_cases(cases: typing.Dict[str, typing.Dict[str, typing.Callable[[], typing.Any]]]):
+    """Alternatives of parsing and rendering should give the same result as the reference implementation"""
+    for group, reference in (("parse_answer", "slice"), ("parse_list", "slice"), ("question_text", "format")):
+        implementations = cases[group]
+        expected = implementations[reference]()
+        for name, implementation in implementations.items():
+            # Current parser keeps only fields that session uses
+            if implementation() != (slim_response(expected) if name == "current" and group != "question_text" else expected):
+                print(f"{group}: {name} result differs from {reference}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=100000, help="Amount of iterations")
+    parser.add_argument("--group", action="append", help="Run only these groups")
+    args = parser.parse_args()
+
+    cases = make_cases()
+    check_cases(cases)
+
+    print(f"{'group':<14} {'implementation':<18} {'us':>8} {'relative':>9}")
+    for group, implementations in cases.items():
+        if args.group and group not in args.group:
+            continue
+
+        baseline = None
+        for name, implementation in implementations.items():
+            took = timeit.timeit(implementation, number=args.number) / args.number
+            baseline = baseline or took
+
+            print(f"{group:<14} {name:<18} {took * 1e6:>8.2f} {took / baseline:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
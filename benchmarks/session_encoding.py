@@ -0,0 +1,161 @@
+"""Compare session stored as DB hash with JSON dump of previous versions: size, encode/decode time and memory
+
+Hash values longer than `--max-value` bytes switch hash of Redis from compact listpack encoding to hashtable,
+that takes several times more memory. With --redis, memory of both formats is measured by `MEMORY USAGE`.
+
+Usage: python -m benchmarks.session_encoding [--number 100000] [--redis redis://127.0.0.1]
+"""
+import argparse
+import asyncio
+import json
+import timeit
+import typing
+
+from jinbot.akinator import Akinator, session_fields, SESSION_VERSION_TAG
+from jinbot.core import Game
+
+
+def make_session() -> Akinator:
+    """Session in the middle of the game with realistic first guess"""
+    session = Akinator(is_ended=0, last_guess="Гарри Поттер")
+    session.timestamp = 1600000000.123456
+    session.server = "https://srv12.akinator.com:9398/ws"
+    session.session = 387
+    session.signature = 1793617263
+    session.step = 24
+    session.frontaddr = "NDYuMTA1LjExMC40NQ=="
+    session.progression = 87.53482
+    session.question = "Ваш персонаж носит очки?"
+    session.first_guess = {
+        "name": "Гермиона Грейнджер",
+        "description": "Персонаж из серии романов о Гарри Поттере, лучшая ученица Хогвартса " * 4,
+        "absolute_picture_path": "https://photos.clarinea.fr/BL_25_ru/600/partenaire/h/12345678_1234567890.jpg",
+    }
+
+    return session
+
+
+def dump_json_session(session: Akinator, dumps: typing.Callable[[dict], str] = json.dumps) -> str:
+    """JSON dump format of previous versions"""
+    return dumps(
+        {
+            "timestamp": session.timestamp,
+            "session": session.session,
+            "signature": session.signature,
+            "step": session.step,
+            "frontaddr": session.frontaddr,
+            "progression": session.progression,
+            "question": session.question,
+            "is_ended": session.is_ended,
+            "last_guess": session.last_guess,
+            "first_guess_name": session.first_guess["name"],
+            "first_guess_description": session.first_guess["description"],
+            "first_guess_absolute_picture_path": session.first_guess["absolute_picture_path"],
+        }
+    )
+
+
+def hash_size(fields: dict) -> int:
+    """Bytes of field names and values sent by HSET"""
+    return sum(len(field.encode("utf-8")) + len(value.encode("utf-8")) for field, value in fields.items())
+
+
+def answered_fields(session: Akinator) -> dict:
+    """Fields written after answer: step, progression and question are changed"""
+    session.clean()
+    session.step += 1
+    session.progression = 91.2271
+    session.question = "Ваш персонаж связан с франшизой (фильмы, книги, игры)?"
+    fields = session.dump_fields()
+    session.step -= 1
+
+    return fields
+
+
+async def measure_memory(url: str, session: Akinator, json_dump: str) -> typing.Dict[str, int]:
+    """Memory of both formats in Redis by `MEMORY USAGE`"""
+    import aioredis
+
+    redis = await aioredis.create_redis(url)
+    try:
+        key = "benchmark||session"
+        await redis.delete(key)
+        await redis.hmset_dict(key, {**session.dump_fields(dirty_only=False), SESSION_VERSION_TAG: "1"})
+        memory = {"hash": await redis.execute(b"MEMORY", b"USAGE", key)}
+        encoding = await redis.object_encoding(key)
+
+        await redis.delete(key)
+        await redis.set(key, json_dump)
+        memory["json"] = await redis.execute(b"MEMORY", b"USAGE", key)
+        await redis.delete(key)
+
+    finally:
+        redis.close()
+        await redis.wait_closed()
+
+    print(f"hash encoding in DB: {encoding.decode() if isinstance(encoding, bytes) else encoding}")
+
+    return memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=100000, help="Amount of iterations")
+    parser.add_argument("--max-value", type=int, default=64, help="`hash-max-listpack-value` of Redis")
+    parser.add_argument("--redis", help="URL of real Redis to measure memory, e.g. redis://127.0.0.1")
+    args = parser.parse_args()
+
+    session = make_session()
+    json_dump = dump_json_session(session)
+    fields = session.dump_fields(dirty_only=False)
+    values = {tag: value.encode("utf-8") for tag, value in fields.items()}
+    values[SESSION_VERSION_TAG] = b"1"
+    # `handle_continue` loads only a few fields and flips `is_ended`
+    loaded = {session_fields[field][0]: values[session_fields[field][0]] for field in Game.CONTINUE_FIELDS}
+    continued = make_session()
+    continued.clean()
+    continued.is_ended = 1
+
+    formats = {
+        "json": (
+            len(json_dump.encode("utf-8")),
+            lambda: dump_json_session(session),
+            lambda: Akinator().load_session(json_dump),
+        ),
+        "hash": (
+            hash_size(fields),
+            lambda: session.dump_fields(dirty_only=False),
+            lambda: Akinator().load_fields(values),
+        ),
+        "hash_partial": (
+            hash_size(continued.dump_fields()),
+            continued.dump_fields,
+            lambda: Akinator().load_fields(loaded),
+        ),
+    }
+
+    print(f"{'format':<13} {'bytes':>7} {'encode, us':>11} {'decode, us':>11}")
+    for name, (size, encode, decode) in formats.items():
+        encode_time = timeit.timeit(encode, number=args.number) / args.number
+        decode_time = timeit.timeit(decode, number=args.number) / args.number
+
+        print(f"{name:<13} {size:>7} {encode_time * 1e6:>11.2f} {decode_time * 1e6:>11.2f}")
+
+    answered = answered_fields(session)
+    print(f"fields written after answer: {hash_size(answered)} bytes")
+
+    for name, dump in (("stored", fields), ("after answer", answered)):
+        longest = max(dump, key=lambda field: len(dump[field].encode("utf-8")))
+        print(
+            f"longest value {name}: {longest}={len(dump[longest].encode('utf-8'))} bytes, "
+            f"compact encoding up to {args.max_value}"
+        )
+
+    if args.redis:
+        memory = asyncio.get_event_loop().run_until_complete(measure_memory(args.redis, session, json_dump))
+        for name, used in memory.items():
+            print(f"memory of {name}: {used} bytes")
+
+
+if __name__ == "__main__":
+    main()
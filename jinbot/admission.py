@@ -0,0 +1,89 @@
+import asyncio
+
+from jinbot import config
+
+
+class Overloaded(Exception):
+    """Too many games are in progress, update is shed"""
+
+
+class AdmissionControl:
+    """Bounded amount of games that are handled simultaneously
+
+    | Update that finds no free slot waits in bounded queue. When queue is full or wait is too long,
+      update is shed, so latency of admitted games degrades gracefully instead of collapsing.
+
+    :param max_in_flight: Games that are handled simultaneously
+    :type max_in_flight: int, optional
+    :param max_waiting: Updates that could wait for a free slot
+    :type max_waiting: int, optional
+    :param max_wait: Seconds that update waits for a free slot
+    :type max_wait: float, optional
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = config.ADMISSION_MAX_IN_FLIGHT,
+        max_waiting: int = config.ADMISSION_MAX_WAITING,
+        max_wait: float = config.ADMISSION_MAX_WAIT,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_wait_timeout = 0
+
+        self._semaphore = None
+
+    async def __aenter__(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        if self._semaphore.locked():
+            if self.waiting >= self.max_waiting:
+                self.shed_queue_full += 1
+                raise Overloaded("Admission queue is full")
+
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.max_wait)
+
+            except asyncio.TimeoutError:
+                self.shed_wait_timeout += 1
+                raise Overloaded("No free slot within wait time")
+
+            finally:
+                self.waiting -= 1
+
+        else:
+            await self._semaphore.acquire()
+
+        self.in_flight += 1
+        self.admitted += 1
+
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self) -> dict:
+        """Limits and counters of admission"""
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_waiting": self.max_waiting,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_wait_timeout": self.shed_wait_timeout,
+        }
+
+
+# *** Globals
+admission_control = AdmissionControl()
+# Globals ***
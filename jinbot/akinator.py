@@ -1,17 +1,127 @@
+import asyncio
 import json
 import time
 import re
+import traceback
+import typing
 
-import aiohttp
+from aiohttp import ClientTimeout
 from akinator.async_aki import Akinator as AsyncAkinator
 
+try:
+    import ujson as fast_json
+except ImportError:
+    # ujson is optional. Responses are decoded by standard json without it
+    fast_json = json
+
 from jinbot import config
+from jinbot.client import get_client
+from jinbot.metrics import akinator_request_seconds, akinator_responses
+from jinbot.region import endpoint_pool
+from jinbot.resilience import adaptive_timeouts, game_api_breaker, hedged
+from jinbot.tracing import annotate, traced
 
 
 info_regex = re.compile("var uid_ext_session = '(.*)'\\;\\n.*var frontaddr = '(.*)'\\;")
 soft_constraint = "ETAT%3D%27EN%27" if config.AKINATOR_CHILD_MODE == "true" else ""
 question_filter = "cat%3D1" if config.AKINATOR_CHILD_MODE == "false" else ""
 
+# Session stored as DB hash. Attribute: (hash field, type)
+# First guess is not stored, because it's requested again by `win` or prefetched before it's used.
+# Values are kept short, so most hashes stay in compact encoding of DB
+session_fields = {
+    "timestamp": ("t", float),
+    "server": ("w", str),
+    "session": ("s", int),
+    "signature": ("g", int),
+    "step": ("n", int),
+    "frontaddr": ("f", str),
+    "progression": ("p", float),
+    "question": ("q", str),
+    "is_ended": ("e", int),
+    "last_guess": ("l", str),
+}
+# Hash field that is incremented by every write, so conflicting writes of replicas are detected
+SESSION_VERSION_TAG = "v"
+
+
+class SessionConflict(Exception):
+    """Session was written by another holder after it was loaded, so its changes are dropped"""
+
+
+def get_session_tags(fields: typing.Optional[typing.Iterable[str]] = None) -> typing.List[str]:
+    """Return hash fields of given session attributes
+
+    :param fields: Session attributes, all attributes if None
+    :type fields: list, optional
+    :return: Hash fields. `step` is always included, because it marks existing session, and version of hash
+    :rtype: list
+    """
+    fields = set(fields) | {"step"} if fields is not None else set(session_fields)
+
+    tags = [session_fields[field][0] for field in session_fields if field in fields]
+    tags.append(SESSION_VERSION_TAG)
+
+    return tags
+
+
+# Fields of step information that are used by `_update`
+step_fields = ("question", "progression", "step")
+
+
+def slim_response(resp: dict) -> dict:
+    """Keep only fields of game API response that session uses
+
+    :param resp: Decoded response
+    :type resp: dict
+    :return: Response with completion and used parameters: identification and step information of new session,
+        step information of answer and back, first guess of win. Response with error is returned as is
+    :rtype: dict
+    """
+    if resp.get("completion") != "OK":
+        # `KO - ...` and `WARN - ...` responses are handled by completion, their payload is kept untouched
+        return resp
+
+    parameters = resp.get("parameters")
+    if not isinstance(parameters, dict):
+        return {"completion": resp["completion"]}
+
+    if "elements" in parameters:
+        slim = {"elements": parameters["elements"][:1]}
+
+    elif "identification" in parameters:
+        identification = parameters["identification"]
+        step_information = parameters["step_information"]
+        slim = {
+            "identification": {"session": identification["session"], "signature": identification["signature"]},
+            "step_information": {field: step_information[field] for field in step_fields},
+        }
+
+    else:
+        slim = {field: parameters[field] for field in step_fields}
+
+    return {"completion": resp["completion"], "parameters": slim}
+
+
+def parse_jsonp(response: bytes) -> dict:
+    """Decode JSON between the first `(` and the last `)` of JSONP response
+
+    | Wrapper is found on raw bytes, so response is not decoded to text as a whole,
+      and parentheses inside of payload are kept as is
+
+    :param response: Body of response
+    :type response: bytes
+    :raises ValueError: if response is not JSONP or JSON is malformed
+    :return: Decoded JSON
+    :rtype: dict
+    """
+    start = response.find(b"(")
+    end = response.rfind(b")")
+    if start == -1 or end < start:
+        raise ValueError("Response is not JSONP")
+
+    return fast_json.loads(response[start + 1:end])
+
 
 def raise_connection_error(response):
     """Match game API status codes to local status codes"""
@@ -27,6 +137,128 @@ def raise_connection_error(response):
     return "AkiConnectionFailure"
 
 
+def get_endpoint_name(url: str) -> str:
+    """Last part of URL path, e.g. `answer_api`, used as label of metrics"""
+    return url.split("?", 1)[0].rstrip("/").rsplit("/", 1)[-1]
+
+
+class SessionInfoCache:
+    """TTL cache of `uid` and `frontaddr` pair that is shared by all new sessions
+
+    | Concurrent refreshes are coalesced into one request to akinator.com/game
+
+    :param ttl: Seconds while cached pair is considered valid
+    :type ttl: int, optional
+    """
+
+    def __init__(self, ttl: int = config.SESSION_INFO_TTL):
+        self.ttl = ttl
+
+        self._info = None
+        self._expires = 0
+        self._fetching = None
+        self._task = None
+
+    async def get(self) -> typing.Tuple[str, str]:
+        """Return cached pair, fetch it if it's expired
+
+        :return: `uid` and `frontaddr`
+        :rtype: tuple(str, str)
+        """
+        if self._info and time.time() < self._expires:
+            return self._info
+
+        return await self.refresh()
+
+    async def refresh(self) -> typing.Tuple[str, str]:
+        """Fetch new pair or join already running fetch
+
+        :return: `uid` and `frontaddr`
+        :rtype: tuple(str, str)
+        """
+        if self._fetching is None:
+            self._fetching = asyncio.ensure_future(self._fetch())
+            self._fetching.add_done_callback(self._fetched)
+
+        return await asyncio.shield(self._fetching)
+
+    def invalidate(self):
+        """Drop cached pair, so next session fetches new one"""
+        self._info = None
+        self._expires = 0
+
+    def start(self):
+        """Start background refresh, so sessions don't wait for the fetch"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._refresh_forever())
+
+    async def stop(self):
+        """Stop background refresh"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+        self._task = None
+
+    def _fetched(self, _):
+        self._fetching = None
+
+    async def _fetch(self) -> typing.Tuple[str, str]:
+        """Get uid and frontaddr from akinator.com/game. Slow request is hedged, because page is static"""
+        timeout = ClientTimeout(total=adaptive_timeouts.timeout("game"), connect=config.HTTP_TIMEOUT_CONNECT)
+
+        async def fetch_page() -> str:
+            client = await get_client()
+            async with client.get(config.GAME_URL, timeout=timeout) as w:
+                return await w.text()
+
+        started = time.monotonic()
+        try:
+            if config.AKINATOR_HEDGE_ENABLED:
+                page = await hedged(fetch_page, adaptive_timeouts.hedge_delay("game"))
+
+            else:
+                page = await fetch_page()
+
+        except asyncio.TimeoutError:
+            adaptive_timeouts.record("game", timeout.total)
+            raise
+
+        adaptive_timeouts.record("game", time.monotonic() - started)
+        match = info_regex.search(page)
+
+        if not match:
+            self.invalidate()
+            raise ValueError("Session info is not found on the game page")
+
+        self._info = match.groups()[0], match.groups()[1]
+        self._expires = time.time() + self.ttl
+
+        return self._info
+
+    async def _refresh_forever(self):
+        """Refresh pair before it's expired"""
+        while True:
+            try:
+                await self.refresh()
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception:
+                traceback.print_exc()
+
+            await asyncio.sleep(config.SESSION_INFO_REFRESH_INTERVAL)
+
+
+# *** Globals
+session_info = SessionInfoCache()
+# Globals ***
+
+
 class Akinator(AsyncAkinator):
     """Custom Akinator class that was changed for performance needs
 
@@ -39,69 +271,232 @@ class Akinator(AsyncAkinator):
         super().__init__()
         self.is_ended = is_ended
         self.last_guess = last_guess
+        # True if session is stored in DB as hash, so only changed fields could be written
+        self.stored = False
+        # True if only some attributes were loaded from DB
+        self.partial = False
+        # Version of hash that session was loaded from or written to. None if session is new
+        self.version = None
+        # Attributes as they were loaded from or written to DB
+        self._saved = {}
+
+    @property
+    def dirty(self) -> typing.List[str]:
+        """Attributes that were changed after session was loaded or saved
+
+        | Attributes are compared with their saved values once per write,
+          so setting attributes during the game costs nothing
+        """
+        saved = self._saved
+
+        return [field for field in session_fields if field not in saved or getattr(self, field) != saved[field]]
+
+    def clean(self) -> dict:
+        """Remember current attributes as saved, e.g. after session was loaded or written
+
+        :return: Previously saved attributes, so they could be restored by `restore_saved` if write failed
+        :rtype: dict
+        """
+        saved, self._saved = self._saved, {field: getattr(self, field) for field in session_fields}
+
+        return saved
+
+    def restore_saved(self, saved: dict):
+        """Restore saved attributes returned by `clean`, so changes are written again"""
+        self._saved = saved
+
+    def dump_fields(self, dirty_only: bool = True) -> dict:
+        """Serialize session attributes to hash fields
+
+        :param dirty_only: if True, then only changed attributes are serialized, all attributes otherwise
+        :type dirty_only: bool, optional
+        :return: Hash fields and their values
+        :rtype: dict
+        """
+        dump = {}
+        for field in self.dirty if dirty_only else session_fields:
+            value = getattr(self, field)
+            dump[session_fields[field][0]] = "" if value is None else str(value)
+
+        return dump
+
+    def load_fields(self, values: dict):
+        """Load session attributes from hash fields. Attributes without fields are left untouched
+
+        :param values: Hash fields and their values
+        :type values: dict
+        """
+        for field, (tag, cast) in session_fields.items():
+            value = values.get(tag)
+            if value is not None:
+                setattr(self, field, cast(value.decode("utf-8")) if value else cast())
+
+        # Sessions that were saved before servers were recorded belong to default server
+        if "w" in values and not self.server:
+            self.server = config.server
+
+        # Hashes that were written before versions were recorded have empty version
+        self.version = (values.get(SESSION_VERSION_TAG) or b"").decode("utf-8")
+        self.stored = True
+        self.clean()
+
+    def _update(self, resp, *args, **kwargs):
+        """Update step information from response of game API and mark current trace with new step"""
+        super()._update(resp, *args, **kwargs)
+        annotate(step=self.step)
+
+    async def _request(self, url: str, hedge: bool = False) -> dict:
+        """Make request to game API using shared HTTP client
+
+        | Request is abandoned after timeout adapted to recent latencies of endpoint.
+        | While game API is considered down, request is not sent and `KO - SERVER DOWN` is returned at once,
+          except for probe request, that is sent with the maximal timeout
+
+        :param url: Formatted URL of game API endpoint
+        :type url: str
+        :param hedge: if True, then request is idempotent and slow one is raced with the second one
+        :type hedge: bool, optional
+        :return: Parsed response
+        :rtype: dict
+        """
+        endpoint = get_endpoint_name(url)
+        if not game_api_breaker.allow():
+            akinator_responses.inc(endpoint=endpoint, status="CircuitOpen")
+
+            return {"completion": "KO - SERVER DOWN"}
+
+        if game_api_breaker.probing:
+            total = config.AKINATOR_TIMEOUT_MAX
+
+        else:
+            total = adaptive_timeouts.timeout(endpoint)
+
+        timeout = ClientTimeout(total=total, connect=config.HTTP_TIMEOUT_CONNECT)
+
+        async def fetch() -> dict:
+            client = await get_client()
+            async with client.get(url, headers=config.HEADERS, timeout=timeout) as w:
+                return self._parse_response(await w.read())
+
+        started = time.monotonic()
+        try:
+            if hedge and config.AKINATOR_HEDGE_ENABLED:
+                resp = await hedged(fetch, adaptive_timeouts.hedge_delay(endpoint))
+
+            else:
+                resp = await fetch()
+
+        except Exception as exc:
+            took = time.monotonic() - started
+            if isinstance(exc, asyncio.TimeoutError):
+                # Latency is at least the timeout. Without it timeout never rises after endpoint slows down
+                adaptive_timeouts.record(endpoint, total)
+
+            # Failure costs at least the timeout, otherwise server that fails fast looks healthy
+            endpoint_pool.record(self.server, max(took, total), failed=True)
+            game_api_breaker.record(failed=True)
+            akinator_request_seconds.observe(took, endpoint=endpoint)
+            akinator_responses.inc(endpoint=endpoint, status="RequestFailed")
+            raise
+
+        took = time.monotonic() - started
+        status = "OK" if resp["completion"] == "OK" else raise_connection_error(resp["completion"])
+        failed = status in ("AkiServerDown", "AkiConnectionFailure")
+        endpoint_pool.record(self.server, max(took, total) if failed else took, failed=failed)
+        game_api_breaker.record(failed=failed)
+        adaptive_timeouts.record(endpoint, took)
+        akinator_request_seconds.observe(took, endpoint=endpoint)
+        akinator_responses.inc(endpoint=endpoint, status=status)
+
+        return resp
 
     async def _get_session_info(self):
-        """Get uid and frontaddr from akinator.com/game"""
-        async with aiohttp.ClientSession() as session:
-            async with session.get("https://ru.akinator.com/game") as w:
-                match = info_regex.search(await w.text())
+        """Get uid and frontaddr from shared cache of akinator.com/game"""
+        self.uid, self.frontaddr = await session_info.get()
+
+    def _parse_response(self, response: typing.Union[bytes, str]) -> dict:
+        """Parse JSONP response of game API and keep only fields that session uses
+
+        :param response: Body of response
+        :type response: bytes, str
+        :raises ValueError: if response couldn't be parsed
+        :return: Parsed response
+        :rtype: dict
+        """
+        if isinstance(response, str):
+            response = response.encode("utf-8")
 
-        self.uid, self.frontaddr = match.groups()[0], match.groups()[1]
+        try:
+            return slim_response(parse_jsonp(response))
 
-    def _parse_response(self, response):
-        """Parse the JSON response and turn it into a Python object"""
-        if "KO - UNAUTHORIZED" in response:
-            return {"completion": "KO - UNAUTHORIZED"}
+        except (ValueError, KeyError, IndexError, TypeError):
+            if b"KO - UNAUTHORIZED" in response:
+                return {"completion": "KO - UNAUTHORIZED"}
 
-        return json.loads(",".join(response.split("(")[1::])[:-1])
+            raise ValueError("Response of game API couldn't be parsed")
 
-    async def start_game(self, **kwargs):
-        """Get session info from game API"""
+    @traced("akinator.start_game")
+    async def start_game(self, retry_stale_info: bool = True, **kwargs):
+        """Get session info from game API. Session is pinned to the healthiest server
+
+        :param retry_stale_info: if True, then session info rejected by game API is fetched again
+            and session is started once more
+        :type retry_stale_info: bool, optional
+        """
         self.timestamp = time.time()
+        self.server = endpoint_pool.choose()
         await self._get_session_info()
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                    config.NEW_SESSION_URL.format(
-                        config.uri,
-                        self.timestamp,
-                        config.server,
-                        config.AKINATOR_CHILD_MODE,
-                        self.uid,
-                        self.frontaddr,
-                        soft_constraint,
-                        question_filter,
-                    ),
-                    headers=config.HEADERS,
-            ) as w:
-                resp = self._parse_response(await w.text())
+        try:
+            resp = await self._request(
+                config.NEW_SESSION_URL.format(
+                    config.uri,
+                    self.timestamp,
+                    self.server,
+                    config.AKINATOR_CHILD_MODE,
+                    self.uid,
+                    self.frontaddr,
+                    soft_constraint,
+                    question_filter,
+                ),
+            )
+
+        except ValueError:
+            # Response couldn't be parsed, most probably session info is outdated
+            session_info.invalidate()
+            raise
 
         if resp["completion"] == "OK":
             self._update(resp, True)
 
             return resp["completion"]
 
-        return raise_connection_error(resp["completion"])
+        status_code = raise_connection_error(resp["completion"])
+        if status_code == "AkiTimedOut":
+            # Session info was rejected by game API. It's cached, so fresh one most probably works
+            session_info.invalidate()
+            if retry_stale_info:
+                return await self.start_game(retry_stale_info=False, **kwargs)
+
+        return status_code
 
+    @traced("akinator.answer")
     async def answer(self, ans):
         """Send `answer` request to game API"""
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                config.ANSWER_URL.format(
-                    config.uri,
-                    self.timestamp,
-                    config.server,
-                    config.AKINATOR_CHILD_MODE,
-                    self.session,
-                    self.signature,
-                    self.step,
-                    ans,
-                    self.frontaddr,
-                    question_filter,
-                ),
-                headers=config.HEADERS,
-            ) as w:
-                resp = self._parse_response(await w.text())
+        resp = await self._request(
+            config.ANSWER_URL.format(
+                config.uri,
+                self.timestamp,
+                self.server,
+                config.AKINATOR_CHILD_MODE,
+                self.session,
+                self.signature,
+                self.step,
+                ans,
+                self.frontaddr,
+                question_filter,
+            ),
+        )
 
         if resp["completion"] == "OK":
             self._update(resp)
@@ -110,25 +505,23 @@ class Akinator(AsyncAkinator):
 
         return raise_connection_error(resp["completion"])
 
+    @traced("akinator.back")
     async def back(self):
         """Send `back` request to game API"""
         if self.step == 0:
             return "CantGoBackAnyFurther"
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                config.BACK_URL.format(
-                    config.server,
-                    self.timestamp,
-                    config.AKINATOR_CHILD_MODE,
-                    self.session,
-                    self.signature,
-                    self.step,
-                    question_filter,
-                ),
-                headers=config.HEADERS,
-            ) as w:
-                resp = self._parse_response(await w.text())
+        resp = await self._request(
+            config.BACK_URL.format(
+                self.server,
+                self.timestamp,
+                config.AKINATOR_CHILD_MODE,
+                self.session,
+                self.signature,
+                self.step,
+                question_filter,
+            ),
+        )
 
         if resp["completion"] == "OK":
             self._update(resp)
@@ -137,68 +530,55 @@ class Akinator(AsyncAkinator):
 
         return raise_connection_error(resp["completion"])
 
+    @traced("akinator.win")
     async def win(self):
         """Send `win` request to game API"""
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                config.WIN_URL.format(
-                    config.server,
-                    self.timestamp,
-                    config.AKINATOR_CHILD_MODE,
-                    self.session,
-                    self.signature,
-                    self.step,
-                ),
-                headers=config.HEADERS,
-            ) as w:
-                resp = self._parse_response(await w.text())
-
-        if resp["completion"] == "OK":
-            self.first_guess = resp["parameters"]["elements"][0]["element"]
-
-            return resp["completion"]
+        status_code, guess = await self.fetch_guess()
+        if guess:
+            self.first_guess = guess
 
-        return raise_connection_error(resp["completion"])
+        return status_code
 
-    def dump_session(self):
-        """Serialize session information to JSON
+    @traced("akinator.fetch_guess")
+    async def fetch_guess(self) -> typing.Tuple[str, typing.Optional[dict]]:
+        """Send `win` request to game API without changing session
 
-        :return: JSON formatted string that contains session information
-        :rtype: str
+        :return: Status code and first guess, if status code is OK
+        :rtype: tuple(str, dict)
         """
-        dump = {
-            "timestamp": self.timestamp,
-            "session": self.session,
-            "signature": self.signature,
-            "step": self.step,
-            "frontaddr": self.frontaddr,
-            "progression": self.progression,
-            "question": self.question,
-            "is_ended": self.is_ended,
-            "last_guess": self.last_guess,
-        }
+        resp = await self._request(
+            config.WIN_URL.format(
+                self.server,
+                self.timestamp,
+                config.AKINATOR_CHILD_MODE,
+                self.session,
+                self.signature,
+                self.step,
+            ),
+            hedge=True,
+        )
 
-        if self.first_guess:
-            dump["first_guess_name"] = self.first_guess.get("name", "")
-            dump["first_guess_description"] = self.first_guess.get("description", "")
-            dump["first_guess_absolute_picture_path"] = self.first_guess.get("absolute_picture_path", "")
-
-        else:
-            dump["first_guess_name"] = ""
-            dump["first_guess_description"] = ""
-            dump["first_guess_absolute_picture_path"] = ""
+        if resp["completion"] == "OK":
+            return resp["completion"], resp["parameters"]["elements"][0]["element"]
 
-        return json.dumps(dump)
+        return raise_connection_error(resp["completion"]), None
 
-    def load_session(self, dump):
-        """Load session information from json dump
+    def load_session(self, dump: typing.Union[bytes, str]):
+        """Load session information from JSON dump, that sessions were stored as before hashes
 
-        :param dump: JSON serialized information that used to fill session object
-        :type dump: str
+        :param dump: Serialized information that used to fill session object
+        :type dump: bytes, str
         """
-        loaded = json.loads(dump)
+        self._load_json_session(json.loads(dump))
+
+    def _load_json_session(self, loaded: dict):
+        """Load session information from JSON dump of previous versions
 
+        :param loaded: Deserialized JSON dump
+        :type loaded: dict
+        """
         self.timestamp = loaded["timestamp"]
+        self.server = loaded.get("server") or config.server
         self.session = loaded["session"]
         self.signature = loaded["signature"]
         self.step = int(loaded["step"])
@@ -0,0 +1,273 @@
+import asyncio
+import collections
+import time
+import traceback
+import typing
+
+from aioredis.commands import Redis
+
+from jinbot import config
+from jinbot.akinator import Akinator, SessionConflict
+
+
+class LRUCache:
+    """Bounded in-process cache. Least recently used item is evicted when capacity is reached
+
+    :param capacity: Maximal amount of items
+    :type capacity: int
+    :param ttl: Seconds after that item is considered expired
+    :type ttl: float
+    """
+
+    def __init__(self, capacity: int, ttl: float):
+        self.capacity = capacity
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._items = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key: typing.Hashable) -> typing.Any:
+        """Return item and mark it as recently used
+
+        :param key: Key of item
+        :type key: typing.Hashable
+        :return: Item or None if it's not cached or expired
+        """
+        cached = self._items.get(key)
+        if cached is None:
+            self.misses += 1
+
+            return None
+
+        expires, value = cached
+        if expires < time.monotonic():
+            del self._items[key]
+            self.expirations += 1
+            self.misses += 1
+
+            return None
+
+        self._items.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def set(self, key: typing.Hashable, value: typing.Any):
+        """Cache item, evict least recently used items if capacity is reached
+
+        :param key: Key of item
+        :type key: typing.Hashable
+        :param value: Item
+        """
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+
+        while len(self._items) > self.capacity:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: typing.Hashable) -> typing.Any:
+        """Remove item from cache
+
+        :param key: Key of item
+        :type key: typing.Hashable
+        :return: Item or None if it's not cached
+        """
+        cached = self._items.pop(key, None)
+
+        return cached[1] if cached else None
+
+    def values(self) -> typing.Iterator:
+        """Iterate over cached items, expired ones included"""
+        return (value for _, value in self._items.values())
+
+    def stats(self) -> dict:
+        """Cache counters"""
+        requests = self.hits + self.misses
+
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / requests, 4) if requests else 0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SessionCache:
+    """Cache of live sessions in front of DB with write-behind
+
+    | Saved sessions are written to DB by background flush every `flush_interval` seconds,
+      so several updates of one session in the window become one write.
+    | DB stays source of truth for restarts and other replicas: with session lock, changed session is written
+      by `flush_session` before lock is released, and cached copy is checked against version in DB.
+
+    :param writer: Coroutine function that writes session to DB
+    :type writer: typing.Callable
+    :param capacity: Maximal amount of cached sessions
+    :type capacity: int, optional
+    :param ttl: Seconds after that cached session is loaded from DB again
+    :type ttl: float, optional
+    :param flush_interval: Seconds between writes of changed sessions
+    :type flush_interval: float, optional
+    """
+
+    def __init__(
+        self,
+        writer: typing.Callable[..., typing.Awaitable],
+        capacity: int = config.SESSION_CACHE_CAPACITY,
+        ttl: float = config.SESSION_CACHE_TTL,
+        flush_interval: float = config.SESSION_CACHE_FLUSH_INTERVAL,
+    ):
+        self.writer = writer
+        self.flush_interval = flush_interval
+
+        self.flushes = 0
+        self.writes = 0
+        self.failed_writes = 0
+        self.conflicts = 0
+
+        self._sessions = LRUCache(capacity=capacity, ttl=ttl)
+        # Sessions that are waiting for write. Kept even if they were evicted from cache
+        self._pending = {}
+        self._redis = None
+        self._task = None
+
+    @property
+    def enabled(self) -> bool:
+        """Cache is used only after it was started"""
+        return self._redis is not None
+
+    def start(self, redis: Redis):
+        """Start background flush of changed sessions
+
+        :param redis: Connection to DB object
+        :type redis: Redis
+        """
+        if config.SESSION_CACHE_ENABLED and self._task is None:
+            self._redis = redis
+            self._task = asyncio.ensure_future(self._flush_forever())
+
+    async def stop(self):
+        """Stop background flush and write all changed sessions"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+        self._task = None
+        if self._redis is not None:
+            await self.flush()
+
+        self._redis = None
+
+    def get(self, session_id: str) -> typing.Optional[Akinator]:
+        """Return cached session
+
+        :param session_id: Unique ID that used as a key for Session object in DB
+        :type session_id: str
+        :return: Session object or None if not cached
+        :rtype: Akinator, optional
+        """
+        return self._sessions.get(session_id)
+
+    def put(self, session_id: str, session: Akinator):
+        """Cache session and schedule its write to DB
+
+        :param session_id: Unique ID that used as a key for Session object in DB
+        :type session_id: str
+        :param session: Session object with all attributes loaded
+        :type session: Akinator
+        """
+        self._sessions.set(session_id, session)
+        self._pending[session_id] = session
+
+    def cache(self, session_id: str, session: Akinator):
+        """Cache session that was just loaded from DB
+
+        :param session_id: Unique ID that used as a key for Session object in DB
+        :type session_id: str
+        :param session: Session object with all attributes loaded
+        :type session: Akinator
+        """
+        self._sessions.set(session_id, session)
+
+    def discard(self, session_id: str):
+        """Remove session from cache, e.g. if it was written to DB bypassing cache
+
+        :param session_id: Unique ID that used as a key for Session object in DB
+        :type session_id: str
+        """
+        self._sessions.pop(session_id)
+        self._pending.pop(session_id, None)
+
+    async def flush_session(self, session_id: str):
+        """Write session now if it's changed, e.g. before its lock is released
+
+        :param session_id: Unique ID that used as a key for Session object in DB
+        :type session_id: str
+        :raises SessionConflict: if session was written by another holder
+        """
+        session = self._pending.pop(session_id, None)
+        if session is not None:
+            await self._write(session_id, session)
+
+    def sessions(self) -> typing.Iterator[Akinator]:
+        """Iterate over cached sessions"""
+        return self._sessions.values()
+
+    async def flush(self):
+        """Write all changed sessions to DB"""
+        pending, self._pending = self._pending, {}
+        self.flushes += 1
+
+        await asyncio.gather(
+            *(self._write(session_id, session) for session_id, session in pending.items()), return_exceptions=True
+        )
+
+    async def _write(self, session_id: str, session: Akinator):
+        """Write session to DB
+
+        :raises SessionConflict: if session was written by another holder. Cached copy is dropped
+        """
+        try:
+            await self.writer(session_id=session_id, session=session, redis=self._redis)
+            self.writes += 1
+
+        except SessionConflict:
+            # Cached copy is stale, next update loads session from DB
+            self.conflicts += 1
+            self._sessions.pop(session_id)
+            raise
+
+        except Exception:
+            # Try again on the next flush, unless session was saved again meanwhile
+            self.failed_writes += 1
+            self._pending.setdefault(session_id, session)
+            traceback.print_exc()
+
+    def stats(self) -> dict:
+        """Cache counters"""
+        return {
+            **self._sessions.stats(),
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "writes": self.writes,
+            "failed_writes": self.failed_writes,
+            "conflicts": self.conflicts,
+        }
+
+    async def _flush_forever(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
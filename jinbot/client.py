@@ -0,0 +1,57 @@
+import typing
+
+import aiohttp
+
+from jinbot import config
+
+
+# *** Globals
+session: typing.Optional[aiohttp.ClientSession] = None
+# Globals ***
+
+
+async def init_client() -> aiohttp.ClientSession:
+    """Create process-wide HTTP client with keep-alive connection pool and DNS cache
+
+    :return: Shared HTTP client
+    :rtype: aiohttp.ClientSession
+    """
+    global session
+
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=config.HTTP_CONNECTION_LIMIT,
+            limit_per_host=config.HTTP_CONNECTION_LIMIT_PER_HOST,
+            ttl_dns_cache=config.HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=config.HTTP_KEEPALIVE_TIMEOUT,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=config.HTTP_TIMEOUT_TOTAL,
+            connect=config.HTTP_TIMEOUT_CONNECT,
+            sock_read=config.HTTP_TIMEOUT_READ,
+        )
+        session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    return session
+
+
+async def get_client() -> aiohttp.ClientSession:
+    """Return shared HTTP client, create it if it was not initialized yet
+
+    :return: Shared HTTP client
+    :rtype: aiohttp.ClientSession
+    """
+    if session is None or session.closed:
+        return await init_client()
+
+    return session
+
+
+async def close_client():
+    """Close shared HTTP client and all pooled connections"""
+    global session
+
+    if session is not None and not session.closed:
+        await session.close()
+
+    session = None
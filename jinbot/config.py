@@ -1,39 +1,13 @@
-import requests
-import json
-import re
+import os
 
 
 # *** Globals
-server_regex = re.compile(
-    '[{"translated_theme_name":"[\s\S]*","urlWs":"https:\\\/\\\/srv[0-9]+\.akinator\.com:[0-9]+\\\/ws","subject_id":"[0-9]+"}]'
-)
-
-
-def auto_get_region():
-    """Automatically get the `uri` and `server` from akinator.com for the specified language and theme"""
-
-    uri_ = "ru.akinator.com"
-
-    response = requests.get("https://" + uri_)
-    match = server_regex.search(response.text)
-
-    parsed = json.loads(match.group().split("'arrUrlThemesToPlay', ")[-1])
-
-    return {
-        "uri": uri_,
-        "server": next((i for i in parsed if i["subject_id"] == "1"), None)[
-            "urlWs"
-        ],
-    }
-
-
-def init_akinator():
-    """Initialize global variables, that contain Akinator `uri` and `server` information"""
-    global uri, server
-    region_info = auto_get_region()
-    if region_info:
-        uri, server = region_info["uri"], region_info["server"]
-
+# Akinator `uri` and default `server`. Updated by `jinbot.region.RegionResolver`
+# Scheme and URI could be overridden by environment, e.g. to point the bot at `simulator`
+AKINATOR_SCHEME = os.getenv("AKINATOR_SCHEME", "https")
+AKINATOR_URI = os.getenv("AKINATOR_URI", "ru.akinator.com")
+uri = AKINATOR_URI
+server = None
 # Globals ***
 
 
@@ -155,6 +129,7 @@ TEXT_DEFEATED_CONTINUE = f"{TEXT_DEFEATED}\n" \
 TEXT_SESSION_EXPIRED = "Тебя слишком долго не было, и я забыл твои ответы 😞\n"
 TEXT_SERVER_DOWN = "Бот приболел и ему нужно немного отдохнуть 🤒\n"
 TEXT_ANSWER_ERROR = "Произошла ошибка, попробуй ещё раз 🤒\n"
+TEXT_BUSY = "Сейчас слишком много игроков, попробуй ещё раз через минуту ⏳\n"
 # --- Message texts
 # Game settings ***
 
@@ -168,6 +143,47 @@ SESSION_MAX_STEPS_FIRST = 40  # First checkpoint when suggested defeat
 SESSION_MAX_STEPS_SECOND = 60  # Second checkpoint when suggested defeat
 SESSION_PROGRESS_DEFEAT = 60  # Defeat if step is equal either to first checkpoint or second
 SESSION_MAXIMUM_PROGRESSION = 98  # If progression more or equal and guess is repeating then Defeated
+
+# Speculative guess prefetch. Prefetched guess is one step older than the one that would be requested on victory
+SESSION_SPECULATIVE_WIN = False
+SESSION_PROGRESS_SPECULATIVE_WIN = 80  # Progression after that guess and its image are prefetched
+SESSION_SPECULATIVE_WIN_TTL = 60 * 5  # Seconds while prefetched guess could be used
+SESSION_SPECULATIVE_WIN_CAPACITY = 10000  # Maximal amount of prefetched guesses
+
+# Pool of started sessions ---
+SESSION_POOL_SIZE = 10  # Maximal amount of ready sessions. 0 disables pool
+SESSION_POOL_TARGET = 5  # Refill starts when amount of ready sessions is less than target
+SESSION_POOL_MAX_AGE = 60 * 5  # Seconds before ready session is dropped, so it's not expired by game API
+SESSION_POOL_REFILL_INTERVAL = 30  # Seconds between periodic refills
+SESSION_POOL_REFILL_CONCURRENCY = 3  # Amount of sessions that are started simultaneously
+# --- Pool of started sessions
+
+# Session lock, so replicas don't interleave updates of one game ---
+# Long polling bot runs as one replica, where chat lanes already serialize updates. Enable it for several replicas:
+# then cached session is checked against DB and written on every update, so session cache doesn't save DB writes
+SESSION_LOCK_ENABLED = False
+SESSION_LOCK_LEASE = 30  # Seconds before lock of crashed holder expires. Holder extends it every third of lease
+SESSION_LOCK_WAIT = 10  # Maximal amount of seconds to wait for locked session
+SESSION_LOCK_RETRY_DELAY = 0.05  # First delay in seconds between attempts to lock session
+SESSION_LOCK_RETRY_DELAY_MAX = 0.5  # Maximal delay in seconds between attempts to lock session
+# --- Session lock
+
+# In-process cache of sessions with write-behind ---
+# Changes are written to DB within flush interval, so several updates of one game are coalesced into one write.
+# With session lock, changes are written before lock is released
+# and cached session is used only if its version matches DB, so replicas don't see or write stale games
+SESSION_CACHE_ENABLED = True
+SESSION_CACHE_CAPACITY = 10000  # Maximal amount of cached sessions
+SESSION_CACHE_TTL = 60 * 10  # Seconds after that cached session is loaded from DB again
+SESSION_CACHE_FLUSH_INTERVAL = 1  # Seconds between writes of changed sessions to DB
+# --- In-process cache of sessions
+
+# Admission control of incoming updates. Excess updates are answered with TEXT_BUSY ---
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "200"))  # Games that are handled simultaneously
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", "1000"))  # Updates that wait for a free slot
+ADMISSION_MAX_WAIT = 10  # Seconds that update waits for a free slot
+LANE_MAX_DEPTH = 5  # Updates of one chat that are running or waiting. 0 disables limit
+# --- Admission control of incoming updates
 # Session settings ***
 
 
@@ -176,11 +192,69 @@ AKINATOR_CHILD_MODE = "false"
 AKINATOR_MAX_STEPS = 80
 
 # URLs for the API requests
-NEW_SESSION_URL = "https://{}/new_session?callback=jQuery331023608747682107778_{}&urlApiWs={}&partner=1&childMod={}&player=website-desktop&uid_ext_session={}&frontaddr={}&constraint=ETAT<>'AV'&soft_constraint={}&question_filter={}"
-ANSWER_URL = "https://{}/answer_api?callback=jQuery331023608747682107778_{}&urlApiWs={}&childMod={}&session={}&signature={}&step={}&answer={}&frontaddr={}&question_filter={}"
+GAME_URL = os.getenv("AKINATOR_GAME_URL", f"{AKINATOR_SCHEME}://{AKINATOR_URI}/game")
+NEW_SESSION_URL = AKINATOR_SCHEME + "://{}/new_session?callback=jQuery331023608747682107778_{}&urlApiWs={}&partner=1&childMod={}&player=website-desktop&uid_ext_session={}&frontaddr={}&constraint=ETAT<>'AV'&soft_constraint={}&question_filter={}"
+ANSWER_URL = AKINATOR_SCHEME + "://{}/answer_api?callback=jQuery331023608747682107778_{}&urlApiWs={}&childMod={}&session={}&signature={}&step={}&answer={}&frontaddr={}&question_filter={}"
 BACK_URL = "{}/cancel_answer?callback=jQuery331023608747682107778_{}&childMod={}&session={}&signature={}&step={}&answer=-1&question_filter={}"
 WIN_URL = "{}/list?callback=jQuery331023608747682107778_{}&childMod={}&session={}&signature={}&step={}"
 
+# Session info (uid and frontaddr) cache ---
+SESSION_INFO_TTL = 60 * 10  # Seconds while cached session info is used by new sessions
+SESSION_INFO_REFRESH_INTERVAL = 60 * 5  # Seconds between background refreshes
+# --- Session info (uid and frontaddr) cache
+
+# Region resolving settings ---
+REGION_REFRESH_COOLDOWN = 30  # Minimal amount of seconds between region refreshes
+ENDPOINT_EWMA_ALPHA = 0.2  # Weight of the last request in moving averages of server latency and error rate
+ENDPOINT_ERROR_PENALTY = 15  # Seconds added to latency score of server that always fails, like a timed out request
+ENDPOINT_ERROR_HALF_LIFE = 60  # Seconds after that influence of server errors is halved
+# --- Region resolving settings
+
+# Shared HTTP client settings ---
+HTTP_CONNECTION_LIMIT = 100  # Maximal amount of simultaneous connections
+HTTP_CONNECTION_LIMIT_PER_HOST = 30  # Maximal amount of simultaneous connections to the same host
+HTTP_DNS_CACHE_TTL = 60 * 5  # Seconds
+HTTP_KEEPALIVE_TIMEOUT = 60  # Seconds to keep idle connection open
+HTTP_TIMEOUT_TOTAL = 15  # Seconds
+HTTP_TIMEOUT_CONNECT = 5  # Seconds
+HTTP_TIMEOUT_READ = 10  # Seconds
+# --- Shared HTTP client settings
+
+# Resilience of game API requests ---
+AKINATOR_TIMEOUT_PERCENTILE = 0.99  # Percentile of recent latencies of endpoint that its timeout is based on
+AKINATOR_TIMEOUT_MULTIPLIER = 3  # Timeout is this many times longer than the percentile
+AKINATOR_TIMEOUT_MIN = 1  # Seconds
+AKINATOR_TIMEOUT_MAX = HTTP_TIMEOUT_TOTAL  # Seconds, also used until enough latencies are observed
+AKINATOR_LATENCY_WINDOW = 200  # Recent latencies kept for every endpoint
+AKINATOR_LATENCY_MIN_SAMPLES = 20  # Latencies needed before timeouts and hedge delays are adapted
+AKINATOR_HEDGE_ENABLED = True  # Send second request if idempotent one, e.g. `win` or game page, is slow
+AKINATOR_HEDGE_PERCENTILE = 0.95  # Second request is sent when the first one is slower than this percentile
+AKINATOR_HEDGE_DELAY = 1  # Seconds before second request until enough latencies are observed
+AKINATOR_RETRIES = 1  # Retries of failed answer or session start
+AKINATOR_RETRY_DELAY = 0.5  # Seconds before first retry, doubled for every next one and jittered
+AKINATOR_RETRY_DELAY_MAX = 4  # Seconds
+AKINATOR_BREAKER_THRESHOLD = 10  # Consecutive failures after that game API is considered down
+AKINATOR_BREAKER_RESET = 10  # Seconds between probe requests while game API is considered down
+# --- Resilience of game API requests
+
+# Guess image cache settings ---
+IMAGE_CACHE_CAPACITY = 1000  # Maximal amount of images cached in process
+IMAGE_CACHE_TTL = 60 * 60  # Seconds while image is cached in process
+IMAGE_CACHE_EXPIRE_TIME = 60 * 60 * 24 * 7  # Seconds while image is cached in DB. 7 Days
+IMAGE_UPLOAD_PEER_ID = 0  # Peer that images are uploaded for. 0 uploads to messages album of community, so one attachment is sent to any chat
+IMAGE_REJECTED_ERROR_CODES = (100,)  # VK error codes after that cached image is uploaded again
+IMAGE_MAX_SIZE = 1024 * 1024 * 5  # Maximal size of image in bytes that is uploaded as is. 5 MB
+IMAGE_CHUNK_SIZE = 1024 * 64  # Size of chunks in bytes that image is streamed by
+IMAGE_DOWNSCALE = True  # Downscale images larger than maximal size. Needs Pillow
+IMAGE_DOWNSCALE_MAX_SOURCE_SIZE = 1024 * 1024 * 20  # Maximal size of image in bytes that could be downscaled. 20 MB
+IMAGE_DOWNSCALE_DIMENSION = 1280  # Maximal width and height of downscaled image
+IMAGE_DOWNSCALE_QUALITY = 85  # JPEG quality of downscaled image
+IMAGE_WORKERS = 8  # Amount of images that are delivered simultaneously in background
+IMAGE_QUEUE_SIZE = 200  # Maximal amount of images waiting for delivery. New ones are dropped if it's full
+VICTORY_IMAGE_DEFERRED = True  # Send victory text at once and image as a follow-up message
+VICTORY_IMAGE_DEADLINE = 20  # Seconds after victory message when image is not sent anymore
+# --- Guess image cache settings
+
 # HTTP headers to use for the requests
 HEADERS = {
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8",
@@ -198,7 +272,7 @@ HEADERS = {
 # *** Admin settings
 # Admin command texts ---
 ADMIN_COMMAND_PREFIX = "//"
-ADMIN_UNKNOWN_COMMAND_TEXT = "Команда должна начинаться с redis или notify\n\n" \
+ADMIN_UNKNOWN_COMMAND_TEXT = "Команда должна начинаться с redis, notify, stats, jobs, status или cancel\n\n" \
                              "Например:\n\n" \
                              "Очистить БД\n" \
                              "//redis.flushall()\n\n" \
@@ -209,14 +283,26 @@ ADMIN_UNKNOWN_COMMAND_TEXT = "Команда должна начинаться 
                              "filter - all, unread, unanswered, important\n\n" \
                              "max_users - Количество пользователей, которым отправится сообщение\n\n" \
                              "min_age - Минимальная давность последнего сообщения пользователя в секундах\n\n" \
-                             "earlier - Если 1, то отправить только тем у кого последнее собщение старше min_age. Если 0, то моложе"
-
-ADMIN_COMMAND_START_TEXT = "Команда \"{command}\" запущена..."
+                             "earlier - Если 1, то отправить только тем у кого последнее собщение старше min_age. Если 0, то моложе\n\n" \
+                             "Получить статистику\n" \
+                             "//stats\n\n" \
+                             "Список задач, статус и отмена задачи\n" \
+                             "//jobs\n" \
+                             "//status {id}\n" \
+                             "//cancel {id}"
+
+ADMIN_COMMAND_START_TEXT = "Команда \"{command}\" запущена, задача {id}"
 ADMIN_COMMAND_END_TEXT = "Команда \"{command}\" завершена"
+ADMIN_COMMAND_STATS_TEXT = "{name}: {value}"
+ADMIN_COMMAND_JOB_TEXT = "Задача {id} \"{name}\": {status}, {duration} сек."
+ADMIN_COMMAND_JOB_NOT_FOUND_TEXT = "Задача {id} не найдена или уже завершена"
+ADMIN_COMMAND_JOB_CANCELLED_TEXT = "Задача {id} отменена"
+ADMIN_COMMAND_NO_JOBS_TEXT = "Задач нет"
+ADMIN_COMMAND_BROADCAST_PROGRESS_TEXT = "Рассылка {id} ({status}): просмотрено диалогов {offset}, " \
+                                        "отправлено {sent}, ошибок {failed}"
 # --- Admin command texts
 
 # Admin command timeouts ---
-ADMIN_TIMEOUT_NOTIFY = 2  # Seconds
 ADMIN_TIMEOUT_API = 5  # Seconds
 # --- Admin command timeouts
 
@@ -233,9 +319,51 @@ ADMIN_COMMAND_SEND_MESSAGE_RESTART_MIN_AGE = 60 * 2  # 2 Minutes
 ADMIN_COMMAND_SEND_MESSAGE_RESTART_ENDED_TEXT = "Бот перезапустился, ещё пару секунд и будет готов 🥳"  # Restart message text
 ADMIN_COMMAND_SEND_MESSAGE_RESTART_EARLIER = 0  # 0 Younger than min age, 1 Older
 # --- After startup message settings
+
+# Admin jobs settings ---
+ADMIN_JOBS_CONCURRENCY = 2  # Jobs that run simultaneously, the rest wait in queue
+ADMIN_JOBS_HISTORY = 20  # Finished jobs that are kept for status queries
+# --- Admin jobs settings
+
+# Broadcast settings ---
+BROADCAST_PAGE_SIZE = 200  # Conversations fetched by one request. VK allows up to 200
+BROADCAST_CHUNK_SIZE = 100  # Users of one `messages.send` call. VK allows up to 100
+BROADCAST_MAX_ERRORS = 5  # Consecutive failed fetches or sends after that broadcast is stopped
+BROADCAST_REPORT_INTERVAL = 30  # Seconds between progress reports to admin chat
+BROADCAST_EXPIRE_TIME = 60 * 60 * 24 * 7  # 7 Days, progress of broadcast is kept in DB
+# --- Broadcast settings
 # Admin settings ***
 
 
+# *** VK API settings
+# Outbox of sent messages ---
+VK_API_RATE_LIMIT = 15  # Requests per second made by outbox. VK allows 20 for group token, rest is left for other calls
+VK_EXECUTE_BATCH_SIZE = 25  # Messages sent by one `execute` request. VK allows up to 25 API calls
+VK_OUTBOX_SENDERS = 4  # Requests that are sent simultaneously
+VK_RATE_LIMIT_ERROR_CODES = (6,)  # Too many requests per second
+VK_RATE_LIMIT_RETRIES = 3  # Retries of request that exceeded rate limit
+VK_RATE_LIMIT_RETRY_DELAY = 0.5  # Seconds before first retry, doubled for every next one
+VK_BACKGROUND_RESERVE = 5  # Tokens that background requests, e.g. broadcasts, leave for replies of players
+VK_BACKGROUND_YIELD_DELAY = 0.05  # Seconds between checks whether replies of players are sent
+# --- Outbox of sent messages
+# VK API settings ***
+
+
+# *** Metrics settings
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"  # Serve metrics in Prometheus text format
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")  # Only local scrapers by default
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9110"))  # http://host:port/metrics. Not 9100 of node_exporter
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Upper bounds in seconds
+# Metrics settings ***
+
+
+# *** Tracing settings
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))  # Share of messages that are traced, 0 disables
+TRACE_MAX_SPANS = 200  # Spans recorded by one trace, rest are dropped
+TRACE_LOGGER = "jinbot.trace"  # Logger that traces are written to as JSON lines
+# Tracing settings ***
+
+
 # *** Other settings
 DEBUG = False
 VK_GROUP_ID = "bot_jin"
@@ -8,7 +8,11 @@ from vkbottle import Message
 
 from jinbot import config
 from jinbot.akinator import Akinator
+from jinbot.images import image_workers
 from jinbot.managers import AbstractStrategy
+from jinbot.prefetch import guess_prefetcher
+from jinbot.resilience import backoff_delay
+from jinbot.tracing import annotate, traced
 from jinbot.utils import (
     save_session,
     create_and_save_session,
@@ -36,6 +40,14 @@ class Game:
     :type session_id: str
     """
 
+    # Session attributes that are loaded from DB by handlers. First guess is fetched by `win` when needed
+    ANSWER_FIELDS = (
+        "timestamp", "server", "session", "signature", "step", "frontaddr",
+        "progression", "question", "is_ended", "last_guess",
+    )
+    BACK_FIELDS = ("timestamp", "server", "session", "signature", "step", "progression", "question", "is_ended")
+    CONTINUE_FIELDS = ("step", "progression", "question", "is_ended")
+
     def __init__(
         self,
         bot,
@@ -126,14 +138,38 @@ class Game:
         )
 
     async def send_victory_message(self, guess: dict, can_continue: bool = True):
-        """Send victory message and image of guess"""
+        """Send victory message and image of guess
+
+        | If `config.VICTORY_IMAGE_DEFERRED`, then text is sent at once
+          and image is sent by background worker as a follow-up message
+        """
         if can_continue:
             message = config.TEXT_VICTORY
 
         else:
             message = config.TEXT_VICTORY_WO_CONTINUE
 
-        if guess.get("absolute_picture_path", None):
+        if guess.get("absolute_picture_path", None) and config.VICTORY_IMAGE_DEFERRED:
+            await self.manager.send_message(
+                bot=self.bot,
+                msg=self.msg,
+                text=message.format(
+                    name=guess["name"], description=guess["description"]
+                ),
+            )
+
+            deadline = asyncio.get_event_loop().time() + config.VICTORY_IMAGE_DEADLINE
+            image_workers.submit(
+                lambda: self.manager.send_image(
+                    bot=self.bot,
+                    msg=self.msg,
+                    url=guess["absolute_picture_path"],
+                    deadline=deadline,
+                ),
+                deadline=deadline,
+            )
+
+        elif guess.get("absolute_picture_path", None):
             # Guess without image
             await self.manager.send_image(
                 bot=self.bot,
@@ -214,13 +250,33 @@ class Game:
 
         return False
 
+    @traced("game.handle_guessed")
     async def handle_guessed(self):
         """Handle possible victory case
 
         | If guess is not repeating, then send victory message.
         | If guess is repeating, then if there is other possible guesses send next step, send defeat message otherwise.
         """
-        status_code = await self.session.win()
+        guess = await guess_prefetcher.take(self.session_id, self.session.step)
+        if guess:
+            # Guess was prefetched on the previous step
+            self.session.first_guess = guess
+            status_code = "OK"
+
+        else:
+            try:
+                status_code = await self.session.win()
+
+            except (ValueError, JSONDecodeError, ClientConnectionError, asyncio.TimeoutError):
+                # Answer is already accepted and step is changed, so it's not sent again.
+                # Game goes on from the new question, and guess is requested after the next answer
+                await save_session(
+                    session_id=self.session_id, session=self.session, redis=self.redis,
+                )
+                await self.send_step(prefix_text=config.TEXT_ANSWER_ERROR)
+
+                return
+
         caught_exception = await self.handle_exception(status_code=status_code)
 
         if not caught_exception:
@@ -259,52 +315,75 @@ class Game:
                     self.session.first_guess, can_continue=self.can_continue()
                 )
 
-    async def continue_game(self, answer: str, first_try: bool = True):
+    def prefetch_guess(self):
+        """Request guess and its image in background if progression is close to victory"""
+        if not config.SESSION_SPECULATIVE_WIN or self.session.progression < config.SESSION_PROGRESS_SPECULATIVE_WIN:
+            return
+
+        def prepare_image(guess: dict):
+            if guess.get("absolute_picture_path", None):
+                image_workers.submit(
+                    lambda: self.manager.prepare_image(
+                        bot=self.bot, msg=self.msg, url=guess["absolute_picture_path"]
+                    )
+                )
+
+        guess_prefetcher.prefetch(self.session_id, self.session, on_guess=prepare_image)
+
+    @traced("game.continue_game")
+    async def continue_game(self, answer: str, attempt: int = 0):
         """Not completed. Continue to play
 
         :param answer: Text of users answer
         :type answer: str
-        :param first_try: If True, then in case of error run `self.continue_game` again, restart game otherwise
-        :type first_try: bool, optional
+        :param attempt: Failed attempts before this one. If answer failed, `self.continue_game` is run again
+            with backoff until `config.AKINATOR_RETRIES` are used, game is restarted otherwise
+        :type attempt: int, optional
         """
         try:
             # Continue. Not defeated game
             status_code = await self.session.answer(answer)
-            caught_exception = await self.handle_exception(status_code=status_code)
 
-            if not caught_exception:
-                if self.is_victory():
-                    # Victory case. Could be repeating
-                    await self.handle_guessed()
+        except (ValueError, JSONDecodeError, ClientConnectionError, asyncio.TimeoutError):
+            # Step is not changed, so the same answer could be sent again
+            if attempt < config.AKINATOR_RETRIES:
+                # Wait a little, try again
+                await asyncio.sleep(backoff_delay(attempt))
+                await self.continue_game(answer=answer, attempt=attempt + 1)
 
-                else:
-                    self.session.is_ended = self.is_defeat()
-                    if self.session.is_ended:
-                        # Defeated game
-                        await self.send_defeated_message(
-                            can_continue=self.can_continue()
-                        )
+            else:
+                # Error occurred. Create and send step with error message
+                await self.create_and_start(prefix_text=config.TEXT_ANSWER_ERROR)
 
-                    else:
-                        # Not guessed yet. Send next question to user
-                        await self.send_step()
+            return
 
-                    # Save session in DB after user answered to question
-                    await save_session(
-                        session_id=self.session_id,
-                        session=self.session,
-                        redis=self.redis,
-                    )
+        caught_exception = await self.handle_exception(status_code=status_code)
 
-        except (ValueError, JSONDecodeError, ClientConnectionError):
-            if first_try:
-                # Wait a little, try again
-                await asyncio.sleep(0.5)
-                await self.continue_game(answer=answer, first_try=False)
+        if not caught_exception:
+            if self.is_victory():
+                # Victory case. Could be repeating
+                await self.handle_guessed()
 
             else:
-                # Error occurred. Create and send step with error message
-                await self.create_and_start(prefix_text=config.TEXT_ANSWER_ERROR)
+                guess_prefetcher.discard(self.session_id)
+                self.session.is_ended = self.is_defeat()
+                if self.session.is_ended:
+                    # Defeated game
+                    await self.send_defeated_message(
+                        can_continue=self.can_continue()
+                    )
+
+                else:
+                    # Not guessed yet. Send next question to user
+                    self.prefetch_guess()
+                    await self.send_step()
+
+                # Save session in DB after user answered to question
+                await save_session(
+                    session_id=self.session_id,
+                    session=self.session,
+                    redis=self.redis,
+                )
 
     async def handle_answer(self, answer: str):
         """Pass given answer to the game API if it's not ended, send steps otherwise"""
@@ -399,12 +478,14 @@ class Game:
             await manager.send_message(bot=bot, msg=msg, text=config.TEXT_SERVER_DOWN)
 
     @staticmethod
+    @traced("game.factory_game")
     async def factory_game(
         bot,
         manager: typing.Type[AbstractStrategy],
         msg: Message,
         redis: Redis,
         chat_id: str,
+        fields: typing.Optional[typing.Iterable[str]] = None,
     ):
         """Factory method that returns Game object
 
@@ -416,15 +497,18 @@ class Game:
         :param redis: Connection to DB object
         :type redis: Redis
         :param chat_id: Unique id of chat
+        :param fields: Session attributes that are needed by handler, all attributes if None
+        :type fields: list, optional
         :return: Game object or None if some error occurred
         :rtype: Game, None
         """
         session_id = get_object_key(manager, "session", chat_id)
         created, session = await get_or_create_session(
-            session_id=session_id, redis=redis
+            session_id=session_id, redis=redis, fields=fields
         )
 
         if session:
+            annotate(step=session.step)
             game = Game(
                 bot=bot,
                 manager=manager,
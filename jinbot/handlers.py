@@ -0,0 +1,137 @@
+import traceback
+import typing
+
+from aioredis.commands import Redis
+from vkbottle import Bot, Message
+
+from jinbot import config
+from jinbot.admission import admission_control, Overloaded
+from jinbot.akinator import SessionConflict
+from jinbot.core import Game
+from jinbot.lanes import chat_lanes, LaneFull
+from jinbot.metrics import handler_seconds
+from jinbot.tracing import start_trace
+from jinbot.managers import VKStrategy
+from jinbot.utils import get_object_key, session_cache, SessionLock, SessionLockTimeout
+
+
+async def serialized(
+    bot: Bot, redis: Redis, msg: Message, handler: typing.Callable[[Bot, Redis, Message], typing.Awaitable]
+):
+    """Run handler in the lane of chat and under session lock, so updates of one game don't interleave
+
+    | Game is handled only within admission limits, excess updates are answered with `config.TEXT_BUSY`.
+    | Unknown commands don't touch the game, so they are answered at once, bypassing lanes and admission
+
+    :param bot: VkBot object
+    :type bot: Bot
+    :param redis: Connection to DB object
+    :type redis: Redis
+    :param msg: Users message object
+    :type msg: Message
+    :param handler: One of handlers of this module
+    :type handler: typing.Callable
+    """
+    session_id = get_object_key(VKStrategy, "session", str(msg.chat_id))
+
+    async def locked():
+        try:
+            async with admission_control:
+                if not config.SESSION_LOCK_ENABLED:
+                    await handler(bot, redis, msg)
+
+                    return
+
+                async with SessionLock(session_id=session_id, redis=redis):
+                    try:
+                        await handler(bot, redis, msg)
+
+                    finally:
+                        # Other replica could take the game as soon as lock is released
+                        try:
+                            await session_cache.flush_session(session_id)
+
+                        except SessionConflict:
+                            # Reply is already sent, so conflict is only logged. Cached copy is dropped by cache
+                            traceback.print_exc()
+
+        except (SessionLockTimeout, SessionConflict):
+            # Another replica holds the game too long, or changed it after lease of this one expired
+            await VKStrategy.send_message(bot=bot, msg=msg, text=config.TEXT_ANSWER_ERROR)
+
+        except Overloaded:
+            await VKStrategy.send_message(bot=bot, msg=msg, text=config.TEXT_BUSY)
+
+    with handler_seconds.time(handler=handler.__name__), start_trace(handler.__name__, chat_id=str(msg.chat_id)):
+        if handler is handle_answer and msg.text not in config.ANSWERS:
+            # Unknown command
+            await handle_answer(bot, redis, msg)
+
+            return
+
+        try:
+            await chat_lanes.run(session_id, msg.text, locked)
+
+        except LaneFull:
+            await VKStrategy.send_message(bot=bot, msg=msg, text=config.TEXT_BUSY)
+
+
+async def handle_back(bot: Bot, redis: Redis, msg: Message):
+    game = await Game.factory_game(
+        bot=bot,
+        manager=VKStrategy,
+        msg=msg,
+        redis=redis,
+        chat_id=str(msg.chat_id),
+        fields=Game.BACK_FIELDS,
+    )
+    if game:
+        await game.handle_back()
+    else:
+        await VKStrategy.send_message(bot=bot, msg=msg, text=config.TEXT_SERVER_DOWN)
+
+
+async def handle_continue(bot: Bot, redis: Redis, msg: Message):
+    game = await Game.factory_game(
+        bot=bot,
+        manager=VKStrategy,
+        msg=msg,
+        redis=redis,
+        chat_id=str(msg.chat_id),
+        fields=Game.CONTINUE_FIELDS,
+    )
+    if game:
+        await game.handle_continue()
+
+    else:
+        await VKStrategy.send_message(bot=bot, msg=msg, text=config.TEXT_SERVER_DOWN)
+
+
+async def handle_restart(bot: Bot, redis: Redis, msg: Message):
+    await Game.handle_restart(
+        bot=bot, manager=VKStrategy, msg=msg, redis=redis, chat_id=str(msg.chat_id)
+    )
+
+
+async def handle_answer(bot: Bot, redis: Redis, msg: Message):
+    answer = config.ANSWERS.get(msg.text, None)
+    if answer:
+        # Known answer
+        game = await Game.factory_game(
+            bot=bot,
+            manager=VKStrategy,
+            msg=msg,
+            redis=redis,
+            chat_id=str(msg.chat_id),
+            fields=Game.ANSWER_FIELDS,
+        )
+
+        if game:
+            await game.handle_answer(answer=answer)
+
+        else:
+            await VKStrategy.send_message(bot=bot, msg=msg, text=config.TEXT_SERVER_DOWN)
+
+    else:
+        # Unknown answer
+        await VKStrategy.send_message(bot=bot, msg=msg, text=config.TEXT_UNKNOWN_COMMAND)
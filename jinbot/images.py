@@ -0,0 +1,170 @@
+import asyncio
+import io
+import typing
+
+from aiohttp import StreamReader
+from aioredis.commands import Redis
+
+from jinbot import config
+from jinbot.cache import LRUCache
+from jinbot.workers import WorkerPool
+
+try:
+    from PIL import Image
+except ImportError:
+    # Pillow is optional. Without it oversized images are not sent
+    Image = None
+
+
+def can_downscale() -> bool:
+    """Oversized images are downscaled only if it's enabled and Pillow is installed"""
+    return config.IMAGE_DOWNSCALE and Image is not None
+
+
+async def iter_image(content: StreamReader, max_size: int) -> typing.AsyncIterator[bytes]:
+    """Pass image through by chunks, so it's never buffered completely
+
+    :param content: Body of image response
+    :type content: StreamReader
+    :param max_size: Maximal size of image in bytes
+    :type max_size: int
+    :raises ValueError: if image is larger than `max_size`
+    """
+    size = 0
+    async for chunk in content.iter_chunked(config.IMAGE_CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_size:
+            raise ValueError("Image is too large")
+
+        yield chunk
+
+
+async def read_image(content: StreamReader, max_size: int) -> bytes:
+    """Read image completely
+
+    :param content: Body of image response
+    :type content: StreamReader
+    :param max_size: Maximal size of image in bytes
+    :type max_size: int
+    :raises ValueError: if image is larger than `max_size`
+    :return: Image
+    :rtype: bytes
+    """
+    return b"".join([chunk async for chunk in iter_image(content, max_size)])
+
+
+def _downscale_image(data: bytes) -> bytes:
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail((config.IMAGE_DOWNSCALE_DIMENSION, config.IMAGE_DOWNSCALE_DIMENSION))
+        output = io.BytesIO()
+        image.convert("RGB").save(output, format="JPEG", quality=config.IMAGE_DOWNSCALE_QUALITY)
+
+    return output.getvalue()
+
+
+async def downscale_image(data: bytes) -> bytes:
+    """Downscale image to `config.IMAGE_DOWNSCALE_DIMENSION` in thread, so event loop is not blocked
+
+    :param data: Image
+    :type data: bytes
+    :return: JPEG image
+    :rtype: bytes
+    """
+    return await asyncio.get_event_loop().run_in_executor(None, _downscale_image, data)
+
+
+class ImageCache:
+    """Two-tier cache of uploaded guess images: in-process LRU in front of DB
+
+    | Maps key of image, e.g. built from picture URL, to attachment string of messenger
+
+    :param capacity: Maximal amount of images in process
+    :type capacity: int, optional
+    :param ttl: Seconds while image is kept in process
+    :type ttl: float, optional
+    :param expire: Seconds while image is kept in DB
+    :type expire: int, optional
+    """
+
+    def __init__(
+        self,
+        capacity: int = config.IMAGE_CACHE_CAPACITY,
+        ttl: float = config.IMAGE_CACHE_TTL,
+        expire: int = config.IMAGE_CACHE_EXPIRE_TIME,
+    ):
+        self.expire = expire
+
+        self.db_hits = 0
+        self.db_misses = 0
+        self.invalidations = 0
+
+        self._images = LRUCache(capacity=capacity, ttl=ttl)
+        self._redis = None
+
+    def start(self, redis: Redis):
+        """Use DB as second tier
+
+        :param redis: Connection to DB object
+        :type redis: Redis
+        """
+        self._redis = redis
+
+    async def get(self, key: str) -> typing.Optional[str]:
+        """Find attachment in process, then in DB
+
+        :param key: Key of image
+        :type key: str
+        :return: Attachment string or None if image is not cached
+        :rtype: str, optional
+        """
+        image = self._images.get(key)
+        if image or self._redis is None:
+            return image
+
+        image = await self._redis.get(key, encoding="utf-8")
+        if image:
+            self.db_hits += 1
+            self._images.set(key, image)
+
+        else:
+            self.db_misses += 1
+
+        return image
+
+    async def set(self, key: str, image: str):
+        """Cache attachment in process and in DB
+
+        :param key: Key of image
+        :type key: str
+        :param image: Attachment string
+        :type image: str
+        """
+        self._images.set(key, image)
+        if self._redis is not None:
+            await self._redis.set(key, image, expire=self.expire)
+
+    async def invalidate(self, key: str):
+        """Remove attachment that was rejected by messenger
+
+        :param key: Key of image
+        :type key: str
+        """
+        self.invalidations += 1
+        self._images.pop(key)
+        if self._redis is not None:
+            await self._redis.delete(key)
+
+    def stats(self) -> dict:
+        """Cache counters"""
+        return {
+            **self._images.stats(),
+            "db_hits": self.db_hits,
+            "db_misses": self.db_misses,
+            "invalidations": self.invalidations,
+        }
+
+
+# *** Globals
+image_cache = ImageCache()
+image_workers = WorkerPool(workers=config.IMAGE_WORKERS, queue_size=config.IMAGE_QUEUE_SIZE)
+# Globals ***
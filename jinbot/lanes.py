@@ -0,0 +1,105 @@
+import asyncio
+import typing
+
+from jinbot import config
+
+
+class LaneFull(Exception):
+    """Chat has too many running and waiting updates"""
+
+
+class Lane:
+    """Queue of work for one chat
+
+    :param lock: Lock that lets only one update of chat run at the moment
+    :type lock: asyncio.Lock
+    :param pending: Inputs that are running or waiting for the lock
+    :type pending: set
+    """
+    __slots__ = ("lock", "pending")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = set()
+
+
+class ChatLanes:
+    """Execution lanes that serialize updates of one chat, while different chats run in parallel
+
+    | Input that is equal to the running or waiting input of the same chat is collapsed.
+    | Input of chat that already has `max_depth` pending inputs is rejected.
+    | Lane is removed as soon as it has no pending inputs, so memory is bounded by amount of active chats.
+    
+    :param max_depth: Maximal amount of pending inputs of one chat, 0 if unlimited
+    :type max_depth: int, optional
+    """
+
+    def __init__(self, max_depth: int = config.LANE_MAX_DEPTH):
+        self.max_depth = max_depth
+        self._lanes = {}
+
+        self.executed = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._lanes)
+
+    async def run(
+        self, key: str, payload: typing.Hashable, handler: typing.Callable[[], typing.Awaitable]
+    ) -> bool:
+        """Run handler in the lane of chat
+
+        :param key: Unique key of chat
+        :type key: str
+        :param payload: Input of handler, used to find duplicates
+        :type payload: typing.Hashable
+        :param handler: Function without arguments that returns awaitable
+        :type handler: typing.Callable
+        :raises LaneFull: if chat has `max_depth` pending inputs
+        :return: True if handler was executed, False if input was collapsed
+        :rtype: bool
+        """
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = Lane()
+
+        if payload in lane.pending:
+            # Same input is already in flight
+            self.coalesced += 1
+
+            return False
+
+        if self.max_depth and len(lane.pending) >= self.max_depth:
+            self.rejected += 1
+
+            raise LaneFull(key)
+
+        lane.pending.add(payload)
+        try:
+            async with lane.lock:
+                await handler()
+
+        finally:
+            lane.pending.discard(payload)
+            if not lane.pending and self._lanes.get(key) is lane:
+                del self._lanes[key]
+
+        self.executed += 1
+
+        return True
+
+    def stats(self) -> dict:
+        """Lanes counters"""
+        return {
+            "active": len(self._lanes),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "max_depth": self.max_depth,
+        }
+
+
+# *** Globals
+chat_lanes = ChatLanes()
+# Globals ***
@@ -1,11 +1,19 @@
 from abc import ABC, abstractmethod
-from io import BytesIO
+import asyncio
+import random
 import typing
 
-import aiohttp
+from aiohttp import ClientError, MultipartWriter
 from vkbottle import Message, Bot
 from vkbottle.utils.exceptions import VKError
 
+from jinbot import config
+from jinbot.client import get_client
+from jinbot.images import image_cache, can_downscale, downscale_image, iter_image, read_image
+from jinbot.metrics import vk_send_seconds, vk_send_failures
+from jinbot.tracing import traced
+from jinbot.utils import get_object_key
+
 
 class AbstractStrategy(ABC):
     # String that used as a prefix for key in DB
@@ -24,7 +32,21 @@ class AbstractStrategy(ABC):
 
     @staticmethod
     @abstractmethod
-    def send_image(bot, msg, url: str = "", text: str = ""):
+    def enqueue_message(bot, msg, text: str = "", attachment: str = None):
+        """
+        :param bot: Object that aggregates API related functions
+        :param msg: Users message object
+        :param text: Text of the message that needed to be sent to user
+        :type text: str
+        :param attachment: Attachment of the message, e.g. uploaded image
+        :type attachment: str, optional
+        :return: Awaitable that is done when message is sent
+        """
+        ...
+
+    @staticmethod
+    @abstractmethod
+    def send_image(bot, msg, url: str = "", text: str = "", deadline: float = None):
         """
         :param bot: Object that aggregates API related functions
         :param msg: Users message object
@@ -32,6 +54,19 @@ class AbstractStrategy(ABC):
         :type url: str
         :param text: Text of the message that needed to be sent to user
         :type text: str
+        :param deadline: Event loop time after that image is not sent
+        :type deadline: float, optional
+        """
+        ...
+
+    @staticmethod
+    @abstractmethod
+    def prepare_image(bot, msg, url: str = ""):
+        """
+        :param bot: Object that aggregates API related functions
+        :param msg: Users message object
+        :param url: URL path to the image that will be probably sent to user, so it could be cached beforehand
+        :type url: str
         """
         ...
 
@@ -40,43 +75,182 @@ class VKStrategy(AbstractStrategy):
     prefix = "VK"
 
     @staticmethod
-    async def get_or_create_image(bot: Bot, peer_id: int, url: str) -> typing.Optional[str]:
+    @traced("vk.upload_photo")
+    async def upload_photo(
+        bot: Bot, peer_id: int, photo: typing.Union[bytes, typing.AsyncIterator[bytes]], content_type: str
+    ) -> str:
         """
-        Try to find image-url cached in DB, make request and cache otherwise
+        Upload photo to VK messages upload server
 
         :param bot: VkBot object
         :type bot: Bot
-        :param peer_id: ID of user, that will get this image
+        :param peer_id: ID of peer, that photo is uploaded for. 0 uploads to messages album of community
+        :type peer_id: int
+        :param photo: Photo or stream of its chunks
+        :type photo: bytes, typing.AsyncIterator
+        :param content_type: MIME type of photo
+        :type content_type: str
+        :return: VK attachment string of photo
+        :rtype: str
+        """
+        server = await bot.api.request("photos.getMessagesUploadServer", {"peer_id": peer_id})
+
+        with MultipartWriter("form-data") as form:
+            part = form.append(photo, {"Content-Type": content_type})
+            part.set_content_disposition("form-data", name="photo", filename="image.jpg")
+
+            client = await get_client()
+            async with client.post(server["upload_url"], data=form) as resp:
+                uploaded = await resp.json(content_type=None)
+
+        saved = (await bot.api.request("photos.saveMessagesPhoto", uploaded))[0]
+        image = f"photo{saved['owner_id']}_{saved['id']}"
+        if saved.get("access_key"):
+            image += f"_{saved['access_key']}"
+
+        return image
+
+    @staticmethod
+    @traced("vk.upload_image")
+    async def upload_image(bot: Bot, peer_id: int, url: str) -> typing.Optional[str]:
+        """
+        Stream image from URL to VK without buffering it
+
+        | Images larger than `config.IMAGE_MAX_SIZE` are downscaled if it's possible, skipped otherwise
+
+        :param bot: VkBot object
+        :type bot: Bot
+        :param peer_id: ID of peer, that image is uploaded for
         :type peer_id: int
-        :param redis: Connection to DB object
-        :type redis: Redis
         :param url: URL of image
         :type url: str
-        :return: VK url of image
+        :return: VK attachment string of image
         :rtype: str, optional
         """
         try:
-            async with aiohttp.ClientSession() as sess:
-                async with sess.get(url) as resp:
-                    fp = BytesIO(await resp.read())
-                    setattr(fp, "name", "image.png")
-                    image = await bot.uploader.upload_message_photo(fp, peer_id=peer_id)
-                    fp.close()
-
-                    return image
-        except VKError:
+            client = await get_client()
+            async with client.get(url) as resp:
+                if resp.status != 200 or not resp.content_type.startswith("image/"):
+                    return None
+
+                if resp.content_length and resp.content_length > config.IMAGE_MAX_SIZE:
+                    if not can_downscale():
+                        return None
+
+                    # Oversized image. It's downscaled once, because result is cached
+                    image = await read_image(resp.content, config.IMAGE_DOWNSCALE_MAX_SOURCE_SIZE)
+                    photo, content_type = await downscale_image(image), "image/jpeg"
+
+                else:
+                    photo, content_type = iter_image(resp.content, config.IMAGE_MAX_SIZE), resp.content_type
+
+                return await VKStrategy.upload_photo(bot=bot, peer_id=peer_id, photo=photo, content_type=content_type)
+
+        except (VKError, ClientError, asyncio.TimeoutError, ValueError, KeyError, IndexError, OSError):
             return None
 
     @staticmethod
+    async def get_or_create_image(bot: Bot, url: str, refresh: bool = False) -> typing.Optional[str]:
+        """
+        Try to find image cached in process or DB, upload and cache otherwise
+
+        | Image is uploaded for `config.IMAGE_UPLOAD_PEER_ID`, by default to messages album of community,
+          so one attachment is sent to any chat and cached once
+
+        :param bot: VkBot object
+        :type bot: Bot
+        :param url: URL of image
+        :type url: str
+        :param refresh: if True, then upload image even if it's cached
+        :type refresh: bool, optional
+        :return: VK attachment string of image
+        :rtype: str, optional
+        """
+        key = get_object_key(VKStrategy, "image", url)
+        if not refresh:
+            image = await image_cache.get(key)
+            if image:
+                return image
+
+        image = await VKStrategy.upload_image(bot=bot, peer_id=config.IMAGE_UPLOAD_PEER_ID, url=url)
+        if image:
+            await image_cache.set(key, image)
+
+        return image
+
+    @staticmethod
+    async def prepare_image(bot: Bot, msg: Message, url: str):
+        """Upload image to VK and cache it, so it's ready when guess is sent"""
+        await VKStrategy.get_or_create_image(bot=bot, url=url)
+
+    @staticmethod
+    def enqueue_message(bot: Bot, msg: Message, text: str = "", attachment: str = None) -> typing.Awaitable:
+        """
+        Put message in outbox of bot, so it's sent by batch within API rate limit
+
+        | Message is sent directly if bot has no running outbox
+
+        :param bot: VkBot object
+        :type bot: Bot
+        :param msg: Users message object
+        :type msg: Message
+        :param text: Text of the message
+        :type text: str, optional
+        :param attachment: VK attachment string
+        :type attachment: str, optional
+        :return: Awaitable with result of `messages.send`. Raises VKError if message was not sent
+        :rtype: typing.Awaitable
+        """
+        params = {"message": text} if text else {}
+        if attachment:
+            params["attachment"] = attachment
+
+        outbox = getattr(bot, "outbox", None)
+        if outbox is None or not outbox.running:
+            return msg(**params)
+
+        return outbox.put({"peer_id": msg.peer_id, "random_id": random.getrandbits(31), **params})
+
+    @staticmethod
+    async def measure_send(kind: str, sending: typing.Awaitable) -> typing.Any:
+        """
+        Await sending of message and record its latency and failure in metrics
+
+        :param kind: Label of sent message, `message` or `attachment`
+        :type kind: str
+        :param sending: Awaitable returned by `enqueue_message`
+        :type sending: typing.Awaitable
+        :return: Result of `messages.send`
+        :rtype: typing.Any
+        """
+        with vk_send_seconds.time(kind=kind):
+            try:
+                return await sending
+
+            except VKError as exc:
+                vk_send_failures.inc(kind=kind, code=exc.error_code)
+                raise
+
+    @staticmethod
+    @traced("vk.send_message")
     async def send_message(bot: Bot, msg: Message, text: str):
         """Send message to user"""
         try:
-            await msg(text)
+            await VKStrategy.measure_send("message", VKStrategy.enqueue_message(bot=bot, msg=msg, text=text))
         except VKError:
             pass
 
     @staticmethod
-    async def send_image(bot: Bot, msg: Message, url: str, text: str = None):
+    @traced("vk.send_attachment")
+    async def send_attachment(bot: Bot, msg: Message, image: str, text: str = None):
+        """Send uploaded image with optional text to user"""
+        await VKStrategy.measure_send(
+            "attachment", VKStrategy.enqueue_message(bot=bot, msg=msg, text=text, attachment=image)
+        )
+
+    @staticmethod
+    @traced("vk.send_image")
+    async def send_image(bot: Bot, msg: Message, url: str, text: str = None, deadline: float = None):
         """
         Get image by url, upload it to VK and send to user
 
@@ -88,15 +262,33 @@ class VKStrategy(AbstractStrategy):
         :type url: str
         :param text: Text of users message
         :type text: str, optional
+        :param deadline: Event loop time after that image is not sent. It's still cached for next time
+        :type deadline: float, optional
         """
-        image = await VKStrategy.get_or_create_image(bot=bot, peer_id=msg.peer_id, url=url)
-        if image:
-            try:
-                if text:
-                    await msg(message=text, attachment=image)
+        image = await VKStrategy.get_or_create_image(bot=bot, url=url)
+        if deadline is not None and asyncio.get_event_loop().time() > deadline:
+            return
 
-                else:
-                    await msg(attachment=image)
+        if not image:
+            # Image is not available. Send text only
+            if text:
+                await VKStrategy.send_message(bot=bot, msg=msg, text=text)
+
+            return
+
+        try:
+            await VKStrategy.send_attachment(bot=bot, msg=msg, image=image, text=text)
+
+        except VKError as exc:
+            if exc.error_code not in config.IMAGE_REJECTED_ERROR_CODES:
+                return
+
+            # Cached image was rejected, e.g. it was deleted. Upload it again
+            await image_cache.invalidate(get_object_key(VKStrategy, "image", url))
+            image = await VKStrategy.get_or_create_image(bot=bot, url=url, refresh=True)
 
-            except VKError:
-                pass
+            if image:
+                try:
+                    await VKStrategy.send_attachment(bot=bot, msg=msg, image=image, text=text)
+                except VKError:
+                    pass
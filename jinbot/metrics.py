@@ -0,0 +1,261 @@
+import contextlib
+import time
+import traceback
+import typing
+
+from aiohttp import web
+
+from jinbot import config
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_sample(name: str, labels: typing.Dict[str, str], value: float) -> str:
+    """Line of Prometheus text format"""
+    if labels:
+        name += "{" + ",".join(f'{label}="{escape_label(str(text))}"' for label, text in labels.items()) + "}"
+
+    return f"{name} {value}"
+
+
+class Metric:
+    """Base of metrics with optional labels
+
+    :param name: Name of metric
+    :type name: str
+    :param documentation: Help text of metric
+    :type documentation: str
+    :param labels: Names of labels
+    :type labels: tuple, optional
+    """
+
+    type = NotImplemented
+
+    def __init__(self, name: str, documentation: str, labels: typing.Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def samples(self) -> typing.Iterator[typing.Tuple[str, typing.Dict[str, str], float]]:
+        """Name suffix, labels and value of every sample"""
+        for key, value in self._values.items():
+            yield "", dict(zip(self.labels, key)), value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        """Increase counter of given labels"""
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Gauge that is set directly or computed by function on every collect
+
+    :param function: Function without arguments that returns value of gauge without labels
+    :type function: typing.Callable, optional
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: typing.Sequence[str] = (),
+        function: typing.Callable[[], float] = None,
+    ):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def samples(self) -> typing.Iterator[typing.Tuple[str, typing.Dict[str, str], float]]:
+        if self.function is not None:
+            yield "", {}, self.function()
+
+        yield from super().samples()
+
+
+class Histogram(Metric):
+    """Histogram with cumulative buckets
+
+    :param buckets: Upper bounds of buckets in ascending order
+    :type buckets: tuple, optional
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: typing.Sequence[str] = (),
+        buckets: typing.Sequence[float] = config.METRICS_LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        """Add observed value, e.g. seconds of request"""
+        key = self._key(labels)
+        counts = self._values.get(key)
+        if counts is None:
+            # Count of every bucket, sum and count of all values
+            counts = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+
+        counts[-2] += value
+        counts[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe seconds that block took"""
+        started = time.monotonic()
+        try:
+            yield
+
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def samples(self) -> typing.Iterator[typing.Tuple[str, typing.Dict[str, str], float]]:
+        for key, counts in self._values.items():
+            labels = dict(zip(self.labels, key))
+            for bound, count in zip(self.buckets, counts):
+                yield "_bucket", {**labels, "le": str(bound)}, count
+
+            yield "_bucket", {**labels, "le": "+Inf"}, counts[-1]
+            yield "_sum", labels, counts[-2]
+            yield "_count", labels, counts[-1]
+
+
+class Registry:
+    """Collection of metrics and stats of components, rendered in Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = []
+        self._stats = {}
+
+    def add(self, metric: Metric) -> Metric:
+        """Register metric
+
+        :param metric: Metric object
+        :type metric: Metric
+        :return: The same metric
+        :rtype: Metric
+        """
+        self._metrics.append(metric)
+
+        return metric
+
+    def add_stats(self, component: str, stats: typing.Callable[[], dict]):
+        """Export numeric counters of component, e.g. `session_cache.stats`, as `jinbot_{component}_{name}`
+
+        :param component: Name of component
+        :type component: str
+        :param stats: Function that returns dict of counters
+        :type stats: typing.Callable
+        """
+        self._stats[component] = stats
+
+    def render(self) -> str:
+        """All metrics in Prometheus text format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(format_sample(metric.name + suffix, labels, value) for suffix, labels, value in metric.samples())
+
+        for component, stats in self._stats.items():
+            try:
+                counters = stats()
+
+            except Exception:
+                traceback.print_exc()
+                continue
+
+            for name, value in counters.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# TYPE jinbot_{component}_{name} untyped")
+                    lines.append(format_sample(f"jinbot_{component}_{name}", {}, value))
+
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Local HTTP server of `/metrics` endpoint
+
+    :param registry: Rendered metrics
+    :type registry: Registry
+    """
+
+    def __init__(self, registry: Registry):
+        self.registry = registry
+
+        self._runner = None
+
+    async def start(self, host: str = config.METRICS_HOST, port: int = config.METRICS_PORT):
+        """Start serving metrics
+
+        :param host: Interface to listen on
+        :type host: str, optional
+        :param port: Port to listen on
+        :type port: int, optional
+        """
+        if self._runner is not None:
+            return
+
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+        self._runner = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8")
+
+
+# *** Globals
+registry = Registry()
+metrics_server = MetricsServer(registry)
+
+handler_seconds = registry.add(
+    Histogram("jinbot_handler_seconds", "Time of message handling, lane and lock wait included", labels=("handler",))
+)
+akinator_request_seconds = registry.add(
+    Histogram("jinbot_akinator_request_seconds", "Time of game API requests", labels=("endpoint",))
+)
+akinator_responses = registry.add(
+    Counter("jinbot_akinator_responses_total", "Game API responses by status code", labels=("endpoint", "status"))
+)
+redis_seconds = registry.add(
+    Histogram("jinbot_redis_seconds", "Time of session reads and writes in DB", labels=("operation",))
+)
+save_session_seconds = registry.add(
+    Histogram("jinbot_save_session_seconds", "Time that handler waits for session to be saved, in cache or DB")
+)
+vk_send_seconds = registry.add(Histogram("jinbot_vk_send_seconds", "Time of sending messages to VK", labels=("kind",)))
+vk_send_failures = registry.add(
+    Counter("jinbot_vk_send_failures_total", "Messages that VK failed to send", labels=("kind", "code"))
+)
+# Globals ***
@@ -0,0 +1,152 @@
+import asyncio
+import collections
+import time
+import traceback
+import typing
+from concurrent import futures
+from json.decoder import JSONDecodeError
+
+from aiohttp import ClientConnectionError
+
+from jinbot import config
+from jinbot.akinator import Akinator
+
+
+class SessionPool:
+    """Pool of already started sessions, so new game doesn't wait for game API
+
+    :param size: Maximal amount of ready sessions
+    :type size: int, optional
+    :param target: Refill starts when amount of ready sessions is less than target
+    :type target: int, optional
+    :param max_age: Seconds after that ready session is dropped, because game API could expire it
+    :type max_age: int, optional
+    """
+
+    def __init__(
+        self,
+        size: int = config.SESSION_POOL_SIZE,
+        target: int = config.SESSION_POOL_TARGET,
+        max_age: int = config.SESSION_POOL_MAX_AGE,
+    ):
+        self.size = size
+        self.target = min(target, size)
+        self.max_age = max_age
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.failed = 0
+
+        self._sessions = collections.deque()
+        self._refill_needed = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def start(self):
+        """Start background refill of the pool"""
+        if self.size > 0 and self._task is None:
+            self._refill_needed = asyncio.Event()
+            self._task = asyncio.ensure_future(self._refill_forever())
+
+    async def stop(self):
+        """Stop background refill and drop ready sessions"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+        self._task = None
+        self._sessions.clear()
+
+    def take(self) -> typing.Optional[Akinator]:
+        """Take ready session from the pool
+
+        :return: Started session or None if pool is empty
+        :rtype: Akinator, optional
+        """
+        self._drop_expired()
+
+        session = self._sessions.popleft() if self._sessions else None
+        if session:
+            self.hits += 1
+
+        else:
+            self.misses += 1
+
+        if self._refill_needed is not None and len(self._sessions) < self.target:
+            self._refill_needed.set()
+
+        return session
+
+    def stats(self) -> dict:
+        """Pool counters"""
+        return {
+            "size": len(self._sessions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "failed": self.failed,
+        }
+
+    def _drop_expired(self):
+        """Drop sessions that are older than `self.max_age`. Oldest sessions are in the beginning"""
+        deadline = time.time() - self.max_age
+        while self._sessions and self._sessions[0].timestamp < deadline:
+            self._sessions.popleft()
+            self.expired += 1
+
+    async def _start_session(self) -> typing.Optional[Akinator]:
+        """Start new session, None if game API is not available"""
+        try:
+            session = Akinator()
+            if await session.start_game() == "OK":
+                return session
+
+        except (ValueError, JSONDecodeError, AttributeError, ClientConnectionError, futures.TimeoutError, asyncio.TimeoutError):
+            pass
+
+        self.failed += 1
+
+        return None
+
+    async def _refill(self):
+        """Fill the pool up to `self.size`"""
+        self._drop_expired()
+
+        while len(self._sessions) < self.size:
+            amount = min(self.size - len(self._sessions), config.SESSION_POOL_REFILL_CONCURRENCY)
+            sessions = await asyncio.gather(*(self._start_session() for _ in range(amount)))
+            started = [session for session in sessions if session]
+            self._sessions.extend(started)
+
+            if len(started) < amount:
+                # Game API is not available. Try on the next round
+                break
+
+    async def _refill_forever(self):
+        """Refill the pool when it was drained below target or periodically to replace expired sessions"""
+        while True:
+            self._refill_needed.clear()
+            try:
+                await self._refill()
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception:
+                traceback.print_exc()
+
+            try:
+                await asyncio.wait_for(self._refill_needed.wait(), timeout=config.SESSION_POOL_REFILL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+
+# *** Globals
+session_pool = SessionPool()
+# Globals ***
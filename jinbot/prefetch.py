@@ -0,0 +1,116 @@
+import asyncio
+import typing
+
+from aiohttp import ClientError
+
+from jinbot import config
+from jinbot.akinator import Akinator
+from jinbot.cache import LRUCache
+
+
+class GuessPrefetcher:
+    """Speculative `win` requests for sessions that are close to victory
+
+    | Guess is requested in background right after answer, and used if the next answer leads to victory.
+    | Guess is one step older than the one that `win` would return, so prefetch is optional.
+
+    :param capacity: Maximal amount of prefetched guesses
+    :type capacity: int, optional
+    :param ttl: Seconds while prefetched guess could be used
+    :type ttl: float, optional
+    """
+
+    def __init__(
+        self,
+        capacity: int = config.SESSION_SPECULATIVE_WIN_CAPACITY,
+        ttl: float = config.SESSION_SPECULATIVE_WIN_TTL,
+    ):
+        self.started = 0
+        self.used = 0
+        self.discarded = 0
+
+        self._guesses = LRUCache(capacity=capacity, ttl=ttl)
+
+    def prefetch(
+        self,
+        session_id: str,
+        session: Akinator,
+        on_guess: typing.Optional[typing.Callable[[dict], typing.Any]] = None,
+    ):
+        """Request guess of session in background
+
+        :param session_id: Unique ID that used as a key for Session object in DB
+        :type session_id: str
+        :param session: Session object
+        :type session: Akinator
+        :param on_guess: Function that is called with guess when it's fetched, e.g. to prepare its image
+        :type on_guess: typing.Callable, optional
+        """
+        self.started += 1
+        task = asyncio.ensure_future(self._fetch(session, on_guess))
+        self._guesses.set(session_id, (session.step, task))
+
+    async def take(self, session_id: str, step: int) -> typing.Optional[dict]:
+        """Return guess that was prefetched on the previous step
+
+        :param session_id: Unique ID that used as a key for Session object in DB
+        :type session_id: str
+        :param step: Current step of session
+        :type step: int
+        :return: Guess or None if it's not prefetched
+        :rtype: dict, optional
+        """
+        prefetched = self._guesses.pop(session_id)
+        if not prefetched:
+            return None
+
+        prefetched_step, task = prefetched
+        if prefetched_step != step - 1:
+            # Session was changed by other requests, e.g. went back
+            self.discarded += 1
+
+            return None
+
+        guess = await task
+        if guess:
+            self.used += 1
+
+        return guess
+
+    def discard(self, session_id: str):
+        """Forget guess, e.g. when answer didn't lead to victory
+
+        :param session_id: Unique ID that used as a key for Session object in DB
+        :type session_id: str
+        """
+        if self._guesses.pop(session_id):
+            self.discarded += 1
+
+    def stats(self) -> dict:
+        """Prefetch counters"""
+        return {
+            "started": self.started,
+            "used": self.used,
+            "discarded": self.discarded,
+            "size": len(self._guesses),
+        }
+
+    @staticmethod
+    async def _fetch(
+        session: Akinator, on_guess: typing.Optional[typing.Callable[[dict], typing.Any]]
+    ) -> typing.Optional[dict]:
+        try:
+            _, guess = await session.fetch_guess()
+
+        except (ValueError, ClientError, asyncio.TimeoutError):
+            return None
+
+        if guess and on_guess:
+            on_guess(guess)
+
+        return guess
+
+
+# *** Globals
+guess_prefetcher = GuessPrefetcher()
+# Globals ***
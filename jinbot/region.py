@@ -0,0 +1,223 @@
+import asyncio
+import json
+import re
+import time
+import traceback
+import typing
+
+from jinbot import config
+from jinbot.client import get_client
+
+
+server_regex = re.compile(
+    '[{"translated_theme_name":"[\s\S]*","urlWs":"https?:\\\/\\\/[^"]+\\\/ws","subject_id":"[0-9]+"}]'
+)
+
+
+def parse_region(uri: str, page: str) -> typing.Optional[dict]:
+    """Find servers of characters theme on the akinator.com page
+
+    :param uri: Akinator domain that page was requested from
+    :type uri: str
+    :param page: HTML of akinator.com page
+    :type page: str
+    :return: `uri`, first `server` and all candidate `servers` or None if server is not found
+    :rtype: dict, optional
+    """
+    match = server_regex.search(page)
+    if not match:
+        return None
+
+    parsed = json.loads(match.group().split("'arrUrlThemesToPlay', ")[-1])
+    servers = [i["urlWs"] for i in parsed if i["subject_id"] == "1"]
+    if not servers:
+        return None
+
+    return {"uri": uri, "server": servers[0], "servers": servers}
+
+
+class Endpoint:
+    """Game API server and its health statistics
+
+    :param url: URL of server
+    :type url: str
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.last_error = 0
+
+    def record(self, latency: float, failed: bool):
+        """Update moving averages of latency and error rate
+
+        :param latency: Seconds that request took, at least its timeout if it failed
+        :type latency: float
+        :param failed: True if request failed
+        :type failed: bool
+        """
+        alpha = config.ENDPOINT_EWMA_ALPHA
+
+        self.requests += 1
+        self.latency = latency if self.requests == 1 else (1 - alpha) * self.latency + alpha * latency
+        self.error_rate = (1 - alpha) * self.error_rate + alpha * int(failed)
+
+        if failed:
+            self.errors += 1
+            self.last_error = time.time()
+
+    def score(self) -> float:
+        """Lower is healthier. Error rate fades out, so failed server gets traffic again after a while
+
+        | Penalty is added, not multiplied by latency, so server that fails fast doesn't look healthy
+        """
+        fading = 0.5 ** ((time.time() - self.last_error) / config.ENDPOINT_ERROR_HALF_LIFE)
+
+        return self.latency + config.ENDPOINT_ERROR_PENALTY * self.error_rate * fading
+
+
+class EndpointPool:
+    """All known game API servers. New sessions are routed to the healthiest one"""
+
+    def __init__(self):
+        self._endpoints = {}
+
+    def __len__(self):
+        return len(self._endpoints)
+
+    def update(self, urls: typing.List[str]):
+        """Remember new candidate servers, already known ones keep their statistics
+
+        :param urls: URLs of servers
+        :type urls: list
+        """
+        for url in urls:
+            if url not in self._endpoints:
+                self._endpoints[url] = Endpoint(url)
+
+    def choose(self) -> typing.Optional[str]:
+        """Return URL of the healthiest server, `config.server` if there is no known servers
+
+        :return: URL of server
+        :rtype: str, optional
+        """
+        if not self._endpoints:
+            return config.server
+
+        return min(self._endpoints.values(), key=Endpoint.score).url
+
+    def record(self, url: str, latency: float, failed: bool):
+        """Record result of request to server
+
+        :param url: URL of server
+        :type url: str
+        :param latency: Seconds that request took, at least its timeout if it failed
+        :type latency: float
+        :param failed: True if request failed
+        :type failed: bool
+        """
+        endpoint = self._endpoints.get(url)
+        if endpoint:
+            endpoint.record(latency=latency, failed=failed)
+
+    def stats(self) -> dict:
+        """Latency and error rate of every server"""
+        return {
+            endpoint.url: f"latency={endpoint.latency * 1000:.0f}ms "
+                          f"error_rate={endpoint.error_rate:.2f} "
+                          f"requests={endpoint.requests} "
+                          f"errors={endpoint.errors}"
+            for endpoint in self._endpoints.values()
+        }
+
+
+class RegionResolver:
+    """Asynchronous resolver of Akinator `uri` and `server`
+
+    | Concurrent refreshes are coalesced into one request, and refreshes are not repeated during cooldown.
+    | Last known-good `config.uri` and `config.server` are kept until new ones are resolved.
+
+    :param cooldown: Minimal amount of seconds between two requests to akinator.com
+    :type cooldown: int, optional
+    """
+
+    def __init__(self, cooldown: int = config.REGION_REFRESH_COOLDOWN):
+        self.cooldown = cooldown
+
+        self.refreshes = 0
+        self.failures = 0
+
+        self._last_attempt = 0
+        self._refreshing = None
+
+    async def refresh(self, force: bool = False) -> dict:
+        """Resolve region or join already running resolve
+
+        :param force: if True, then ignore cooldown
+        :type force: bool, optional
+        :return: Current `uri` and `server`
+        :rtype: dict
+        """
+        if self._refreshing is None:
+            if not force and time.time() - self._last_attempt < self.cooldown:
+                return {"uri": config.uri, "server": config.server}
+
+            self._last_attempt = time.time()
+            self._refreshing = asyncio.ensure_future(self._resolve())
+            self._refreshing.add_done_callback(self._resolved)
+
+        return await asyncio.shield(self._refreshing)
+
+    def request_refresh(self):
+        """Schedule refresh without waiting for it"""
+        asyncio.ensure_future(self._refresh_quietly())
+
+    def _resolved(self, _):
+        self._refreshing = None
+
+    async def _refresh_quietly(self):
+        try:
+            await self.refresh()
+
+        except Exception:
+            traceback.print_exc()
+
+    async def _resolve(self) -> dict:
+        """Request akinator.com and update `config.uri` and `config.server` if region is found"""
+        self.refreshes += 1
+        uri = config.AKINATOR_URI
+
+        try:
+            client = await get_client()
+            async with client.get(f"{config.AKINATOR_SCHEME}://{uri}") as response:
+                region_info = parse_region(uri, await response.text())
+
+        except Exception:
+            self.failures += 1
+            raise
+
+        if region_info:
+            config.uri, config.server = region_info["uri"], region_info["server"]
+            endpoint_pool.update(region_info["servers"])
+
+        else:
+            self.failures += 1
+
+        return {"uri": config.uri, "server": config.server}
+
+    def stats(self) -> dict:
+        """Resolver counters"""
+        return {
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+        }
+
+
+# *** Globals
+endpoint_pool = EndpointPool()
+region_resolver = RegionResolver()
+# Globals ***
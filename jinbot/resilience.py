@@ -0,0 +1,231 @@
+import asyncio
+import collections
+import random
+import time
+import typing
+
+from jinbot import config
+
+
+def backoff_delay(
+    attempt: int, base: float = config.AKINATOR_RETRY_DELAY, maximum: float = config.AKINATOR_RETRY_DELAY_MAX
+) -> float:
+    """Seconds to wait before retry: doubled for every attempt and jittered, so retries of many chats spread out
+
+    :param attempt: Number of failed attempts before this one, starting from 0
+    :type attempt: int
+    :param base: Seconds before the first retry
+    :type base: float, optional
+    :param maximum: Maximal seconds without jitter
+    :type maximum: float, optional
+    :return: Seconds
+    :rtype: float
+    """
+    return min(base * 2 ** attempt, maximum) * random.uniform(0.5, 1.5)
+
+
+class LatencyWindow:
+    """Recent latencies of one endpoint with cached percentiles
+
+    :param size: Amount of latencies kept
+    :type size: int, optional
+    """
+
+    __slots__ = ("_latencies", "_sorted", "_stale")
+
+    def __init__(self, size: int = config.AKINATOR_LATENCY_WINDOW):
+        self._latencies = collections.deque(maxlen=size)
+        self._sorted = None
+        self._stale = 0
+
+    def __len__(self):
+        return len(self._latencies)
+
+    def record(self, latency: float):
+        self._latencies.append(latency)
+        self._stale += 1
+        # Percentiles are recomputed after a tenth of window is replaced
+        if self._stale >= max(1, self._latencies.maxlen // 10):
+            self._sorted = None
+
+    def percentile(self, q: float) -> float:
+        """Nearest-rank percentile of recent latencies, 0 if there is none"""
+        if self._sorted is None:
+            self._sorted = sorted(self._latencies)
+            self._stale = 0
+
+        if not self._sorted:
+            return 0
+
+        return self._sorted[min(len(self._sorted) - 1, int(q * len(self._sorted)))]
+
+
+class AdaptiveTimeouts:
+    """Timeouts and hedge delays of game API endpoints derived from their observed latencies
+
+    | Until `config.AKINATOR_LATENCY_MIN_SAMPLES` latencies are observed, static defaults are used
+    """
+
+    def __init__(self):
+        self._windows = {}
+
+    def record(self, endpoint: str, latency: float):
+        """Record latency of completed request
+
+        | Timed out request is recorded with its timeout, so timeout rises when endpoint slows down
+
+        :param endpoint: Name of endpoint, e.g. `answer_api`
+        :type endpoint: str
+        :param latency: Seconds that request took, or its timeout if it timed out
+        :type latency: float
+        """
+        window = self._windows.get(endpoint)
+        if window is None:
+            window = self._windows[endpoint] = LatencyWindow()
+
+        window.record(latency)
+
+    def timeout(self, endpoint: str) -> float:
+        """Seconds after that request to endpoint is abandoned"""
+        window = self._windows.get(endpoint)
+        if window is None or len(window) < config.AKINATOR_LATENCY_MIN_SAMPLES:
+            return config.AKINATOR_TIMEOUT_MAX
+
+        timeout = window.percentile(config.AKINATOR_TIMEOUT_PERCENTILE) * config.AKINATOR_TIMEOUT_MULTIPLIER
+
+        return min(max(timeout, config.AKINATOR_TIMEOUT_MIN), config.AKINATOR_TIMEOUT_MAX)
+
+    def hedge_delay(self, endpoint: str) -> float:
+        """Seconds after that second request to endpoint is sent"""
+        window = self._windows.get(endpoint)
+        if window is None or len(window) < config.AKINATOR_LATENCY_MIN_SAMPLES:
+            return config.AKINATOR_HEDGE_DELAY
+
+        return window.percentile(config.AKINATOR_HEDGE_PERCENTILE)
+
+    def stats(self) -> dict:
+        """Current timeout of every endpoint in milliseconds"""
+        return {f"{endpoint}_timeout_ms": round(self.timeout(endpoint) * 1000) for endpoint in self._windows}
+
+
+class CircuitBreaker:
+    """Fails fast while game API is down instead of queueing requests that are doomed to time out
+
+    | Breaker opens after `threshold` consecutive failures. While it's open, one probe request is let through
+      every `reset` seconds, and the first success closes it. `probing` is True after probe is let through,
+      so probe could be sent with the maximal timeout instead of the one adapted to failures.
+
+    :param threshold: Consecutive failures that open the breaker
+    :type threshold: int, optional
+    :param reset: Seconds between probe requests while breaker is open
+    :type reset: float, optional
+    """
+
+    def __init__(
+        self, threshold: int = config.AKINATOR_BREAKER_THRESHOLD, reset: float = config.AKINATOR_BREAKER_RESET
+    ):
+        self.threshold = threshold
+        self.reset = reset
+
+        self.failures = 0
+        self.opens = 0
+        self.rejected = 0
+        self.probing = False
+
+        self._opened = 0
+
+    @property
+    def open(self) -> bool:
+        return self.failures >= self.threshold
+
+    def allow(self) -> bool:
+        """True if request could be sent"""
+        self.probing = False
+        if not self.open:
+            return True
+
+        now = time.monotonic()
+        if now - self._opened >= self.reset:
+            self._opened = now
+            self.probing = True
+
+            return True
+
+        self.rejected += 1
+
+        return False
+
+    def record(self, failed: bool):
+        """Record result of request
+
+        :param failed: True if game API failed to answer
+        :type failed: bool
+        """
+        if not failed:
+            self.failures = 0
+
+            return
+
+        self.failures += 1
+        if self.failures == self.threshold:
+            self.opens += 1
+
+        if self.open:
+            self._opened = time.monotonic()
+
+    def stats(self) -> dict:
+        """Breaker counters"""
+        return {
+            "open": int(self.open),
+            "failures": self.failures,
+            "opens": self.opens,
+            "rejected": self.rejected,
+        }
+
+
+async def hedged(call: typing.Callable[[], typing.Awaitable], delay: float) -> typing.Any:
+    """Await idempotent call, and if it's slower than `delay`, race it with the second one
+
+    | The first successful result is returned and the other request is cancelled.
+      Failure of one request is ignored while the other one is still running
+
+    :param call: Function without arguments that returns awaitable
+    :type call: typing.Callable
+    :param delay: Seconds before the second request
+    :type delay: float
+    :return: Result of call
+    :rtype: typing.Any
+    """
+    pending = {asyncio.ensure_future(call())}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return done.pop().result()
+
+        hedge_stats["sent"] += 1
+        hedge = asyncio.ensure_future(call())
+        pending.add(hedge)
+
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        hedge_stats["won"] += 1
+
+                    return task.result()
+
+            if not pending:
+                return done.pop().result()
+
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+# *** Globals
+adaptive_timeouts = AdaptiveTimeouts()
+game_api_breaker = CircuitBreaker()
+# Second requests that were sent and that answered first
+hedge_stats = {"sent": 0, "won": 0}
+# Globals ***
@@ -0,0 +1,162 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import random
+import sys
+import time
+import typing
+
+from jinbot import config
+
+
+class Trace:
+    """Spans of one users message
+
+    :param name: Name of handler
+    :type name: str
+    :param attributes: Attributes of trace, e.g. chat id. Current step is copied to every next span
+    :type attributes: dict
+    """
+
+    __slots__ = ("trace_id", "name", "attributes", "started", "spans", "finished")
+
+    def __init__(self, name: str, attributes: dict):
+        self.trace_id = f"{random.getrandbits(64):016x}"
+        self.name = name
+        self.attributes = attributes
+        self.started = time.monotonic()
+        self.spans = []
+        self.finished = False
+
+    def offset(self) -> float:
+        """Milliseconds since trace was started"""
+        return round((time.monotonic() - self.started) * 1000, 3)
+
+    def export(self, error: typing.Optional[str] = None) -> dict:
+        exported = {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            **self.attributes,
+            "duration_ms": self.offset(),
+            "spans": self.spans,
+        }
+        if error:
+            exported["error"] = error
+
+        return exported
+
+
+@contextlib.contextmanager
+def start_trace(name: str, sample_rate: float = config.TRACE_SAMPLE_RATE, **attributes):
+    """Trace the block if it's sampled. Trace is written to log as one JSON line when block exits
+
+    | Spans are recorded only inside of sampled trace, so unsampled messages cost one context lookup per span
+
+    :param name: Name of handler
+    :type name: str
+    :param sample_rate: Probability that trace is recorded
+    :type sample_rate: float, optional
+    :param attributes: Attributes of trace, e.g. chat id
+    """
+    if _trace.get() is not None or not sample_rate or random.random() >= sample_rate:
+        yield None
+
+    else:
+        trace = Trace(name, attributes)
+        trace_token, parent_token = _trace.set(trace), _parent.set(None)
+        error = None
+        try:
+            yield trace
+
+        except BaseException as exc:
+            error = type(exc).__name__
+            raise
+
+        finally:
+            _trace.reset(trace_token)
+            _parent.reset(parent_token)
+            trace.finished = True
+            logger.info(json.dumps(trace.export(error), ensure_ascii=False, default=str))
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """Record time of the block as span of the current trace
+
+    :param name: Name of span, e.g. `akinator.answer`
+    :type name: str
+    :param attributes: Attributes of span
+    """
+    trace = _trace.get()
+    if trace is None or trace.finished or len(trace.spans) >= config.TRACE_MAX_SPANS:
+        # Not sampled, or span of background work that outlived its message
+        yield
+
+    else:
+        record = {"name": name, "parent": _parent.get(), "start_ms": trace.offset(), **attributes}
+        if "step" in trace.attributes:
+            record["step"] = trace.attributes["step"]
+
+        token = _parent.set(len(trace.spans))
+        trace.spans.append(record)
+        try:
+            yield
+
+        except BaseException as exc:
+            record["error"] = type(exc).__name__
+            raise
+
+        finally:
+            record["duration_ms"] = round(trace.offset() - record["start_ms"], 3)
+            _parent.reset(token)
+
+
+def traced(name: str):
+    """Record every call of coroutine function as span
+
+    :param name: Name of span
+    :type name: str
+    """
+
+    def decorator(function: typing.Callable[..., typing.Awaitable]):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            if _trace.get() is None:
+                return await function(*args, **kwargs)
+
+            with span(name):
+                return await function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def annotate(**attributes):
+    """Update attributes of the current trace, e.g. step of the game"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+
+def setup_logging():
+    """Write traces to stdout, unless their logger is already configured"""
+    if logger.handlers:
+        return
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+# *** Globals
+logger = logging.getLogger(config.TRACE_LOGGER)
+
+_trace = contextvars.ContextVar("trace", default=None)
+# Index of the innermost open span, so spans are nested
+_parent = contextvars.ContextVar("parent_span", default=None)
+# Globals ***
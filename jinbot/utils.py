@@ -1,19 +1,171 @@
 import asyncio
+import random
+import time
+import traceback
 import typing
+import uuid
 from concurrent import futures
 from json.decoder import JSONDecodeError
 
 from aiohttp import ClientConnectionError
 from aioredis.commands import Redis
-
-from jinbot.akinator import Akinator
+from aioredis.errors import ReplyError
+
+from jinbot.akinator import Akinator, SessionConflict, SESSION_VERSION_TAG, get_session_tags
+from jinbot.cache import SessionCache
+from jinbot.metrics import registry, redis_seconds, save_session_seconds, Gauge
+from jinbot.tracing import span, traced
+from jinbot.pool import session_pool
+from jinbot.region import region_resolver
+from jinbot.resilience import backoff_delay
 from jinbot import config
 
 
+# Delete lock only if it's still owned by the same holder
+UNLOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Extend lease of lock only if it's still held by the same holder. KEYS: lock. ARGV: token, lease milliseconds
+EXTEND_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Write session hash only if its version is still the one that session was loaded with, "*" skips the check.
+# KEYS: session. ARGV: expected version, expire seconds, "1" to replace whole hash, then field and value pairs.
+# Returns new version, or nil if hash was written by another holder
+WRITE_SESSION_SCRIPT = """
+local version = false
+if redis.call("type", KEYS[1]).ok == "hash" then
+    version = redis.call("hget", KEYS[1], "v")
+end
+if ARGV[1] ~= "*" and (version or "") ~= ARGV[1] then
+    return false
+end
+if ARGV[3] == "1" then
+    redis.call("del", KEYS[1])
+end
+if #ARGV > 3 then
+    version = (tonumber(version) or 0) + 1
+    redis.call("hmset", KEYS[1], "v", version, unpack(ARGV, 4))
+end
+redis.call("expire", KEYS[1], ARGV[2])
+return tostring(version or "")
+"""
+
+
+class SessionLockTimeout(Exception):
+    """Session is locked by another holder longer than `config.SESSION_LOCK_WAIT`"""
+
+
+class SessionLock:
+    """Short Redis lease lock of session, so bot replicas don't interleave updates of the same game
+
+    | Lock expires after `lease` seconds, so crashed holder doesn't block session forever.
+      While holder is alive, lease is extended every third of it, so slow handler keeps the lock.
+    | Conflicts are retried with jittered backoff until `wait` seconds are passed.
+
+    :param session_id: Unique ID that used as a key for Session object in DB
+    :type session_id: str
+    :param redis: Connection to DB object
+    :type redis: Redis
+    :param lease: Seconds before lock is released automatically
+    :type lease: float, optional
+    :param wait: Maximal amount of seconds to wait for the lock
+    :type wait: float, optional
+    """
+
+    # Contention counters shared by all locks
+    stats = {
+        "acquired": 0,
+        "contended": 0,
+        "timeouts": 0,
+        "lost": 0,
+        "renewed": 0,
+        "conflicts": 0,
+        "wait_seconds": 0.0,
+    }
+
+    def __init__(
+        self,
+        session_id: str,
+        redis: Redis,
+        lease: float = config.SESSION_LOCK_LEASE,
+        wait: float = config.SESSION_LOCK_WAIT,
+    ):
+        self.key = "||".join([session_id, "lock"])
+        self.redis = redis
+        self.lease = lease
+        self.wait = wait
+        self.token = uuid.uuid4().hex
+        self._renewal = None
+
+    @traced("redis.session_lock")
+    async def __aenter__(self):
+        started = time.monotonic()
+        delay = config.SESSION_LOCK_RETRY_DELAY
+
+        while True:
+            acquired = await self.redis.set(
+                self.key, self.token, pexpire=int(self.lease * 1000), exist=self.redis.SET_IF_NOT_EXIST
+            )
+            if acquired:
+                SessionLock.stats["acquired"] += 1
+                SessionLock.stats["wait_seconds"] += time.monotonic() - started
+                self._renewal = asyncio.ensure_future(self._renew_forever())
+
+                return self
+
+            SessionLock.stats["contended"] += 1
+            if time.monotonic() - started + delay > self.wait:
+                SessionLock.stats["timeouts"] += 1
+                SessionLock.stats["wait_seconds"] += time.monotonic() - started
+
+                raise SessionLockTimeout(self.key)
+
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, config.SESSION_LOCK_RETRY_DELAY_MAX)
+
+    async def __aexit__(self, *exc_info):
+        self._renewal.cancel()
+        released = await self.redis.eval(UNLOCK_SCRIPT, keys=[self.key], args=[self.token])
+        if not released:
+            # Lease expired before holder finished, someone else could have changed session
+            SessionLock.stats["lost"] += 1
+
+    async def _renew_forever(self):
+        """Extend lease until lock is released. Stop if lock was lost, e.g. DB was unavailable longer than lease"""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+
+            try:
+                renewed = await self.redis.eval(
+                    EXTEND_SCRIPT, keys=[self.key], args=[self.token, int(self.lease * 1000)]
+                )
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception:
+                # Next attempt is made before lease expires
+                traceback.print_exc()
+                continue
+
+            if not renewed:
+                return
+
+            SessionLock.stats["renewed"] += 1
+
+
 def update_region():
-    """Update region related `uri` and `server` """
-    region_info = config.auto_get_region()
-    config.uri, config.server = region_info["uri"], region_info["server"]
+    """Schedule update of region related `uri` and `server`, last known ones are used meanwhile"""
+    region_resolver.request_refresh()
 
 
 def get_object_key(manager, *object_path: str) -> str:
@@ -29,41 +181,54 @@ def get_object_key(manager, *object_path: str) -> str:
 
 
 async def create_session(
-    first_try: bool = True, is_ended: int = 0
+    attempt: int = 0, is_ended: int = 0
 ) -> typing.Optional[Akinator]:
-    """Create session object and start it
+    """Take started session from the pool, create session object and start it if pool is empty
 
-    :param first_try: if True, then in case of Error try again, dont try otherwise
-    :type first_try: bool, optional
+    :param attempt: Failed attempts before this one. In case of Error try again with backoff
+        until `config.AKINATOR_RETRIES` are used
+    :type attempt: int, optional
     :param is_ended: if True, then cant continue game
     :type is_ended: int, optional
     :return: Session object
     :rtype: Akinator, optional
     """
+    session = session_pool.take()
+    if session:
+        session.is_ended = is_ended
+
+        return session
+
     try:
         session = Akinator(is_ended=is_ended)
         status_code = await session.start_game()
 
         if status_code != "OK":
-            # Server error. Try to update region
-            update_region()
+            if status_code != "AkiTimedOut":
+                # Server error. Try to update region. Rejected session info is not related to region
+                update_region()
 
             return None
 
         return session
 
-    except (JSONDecodeError, AttributeError, ClientConnectionError, futures.TimeoutError):
-        if first_try:
+    except (ValueError, JSONDecodeError, AttributeError, ClientConnectionError, futures.TimeoutError, asyncio.TimeoutError):
+        if attempt < config.AKINATOR_RETRIES:
             # Some problem with Akinator API. Wait a little and try again
-            await asyncio.sleep(0.5)
+            await asyncio.sleep(backoff_delay(attempt))
 
-            return await create_session(first_try=False)
+            return await create_session(attempt=attempt + 1, is_ended=is_ended)
 
         return None
 
 
-async def save_session(session_id: str, session: Akinator, redis: Redis) -> Akinator:
-    """Dump session object and save it in DB
+async def write_session(session_id: str, session: Akinator, redis: Redis) -> Akinator:
+    """Write session object to DB as hash
+
+    | Session that is already stored as hash gets only its changed fields written.
+    | New session or session migrated from previous dump format is written completely.
+    | Loaded session is written only if hash was not written by anyone else since it was loaded,
+      e.g. by replica that took the session lock after lease of this one expired.
 
     :param session_id: Unique ID that used as a key for Session object in DB
     :type session_id: str
@@ -71,15 +236,93 @@ async def save_session(session_id: str, session: Akinator, redis: Redis) -> Akin
     :type session: Akinator
     :param redis: Connection to DB object
     :type redis: Redis
+    :raises SessionConflict: if hash was written by another holder after session was loaded
     :return: Session object
     :rtype: Akinator
     """
-    session_dump = session.dump_session()
-    await redis.set(session_id, session_dump, expire=config.SESSION_EXPIRE_TIME)
+    fields = session.dump_fields(dirty_only=session.stored)
+    args = [
+        "*" if session.version is None else session.version,
+        config.SESSION_EXPIRE_TIME,
+        "0" if session.stored else "1",
+    ]
+    for field, value in fields.items():
+        args.extend((field, value))
+
+    # Forget changes before write, so changes made during write are not lost
+    stored = session.stored
+    session.stored = True
+    saved = session.clean()
+
+    try:
+        with redis_seconds.time(operation="write"), span("redis.write"):
+            version = await redis.eval(WRITE_SESSION_SCRIPT, keys=[session_id], args=args)
+
+    except Exception:
+        session.restore_saved(saved)
+        session.stored = stored
+        raise
+
+    if version is None:
+        SessionLock.stats["conflicts"] += 1
+        raise SessionConflict(session_id)
+
+    session.version = version.decode("utf-8")
 
     return session
 
 
+def count_cached_games(ended: bool) -> int:
+    """Games in session cache of this process, that are ended or not
+
+    | It's not a total of all replicas or DB: sessions leave cache after `config.SESSION_CACHE_TTL`
+    """
+    return sum(1 for session in session_cache.sessions() if bool(session.is_ended) == ended)
+
+
+# *** Globals
+session_cache = SessionCache(writer=write_session)
+registry.add(
+    Gauge(
+        "jinbot_cached_games_active",
+        "Games in progress in session cache of this process",
+        function=lambda: count_cached_games(False),
+    )
+)
+registry.add(
+    Gauge(
+        "jinbot_cached_games_ended",
+        "Ended games in session cache of this process",
+        function=lambda: count_cached_games(True),
+    )
+)
+# Globals ***
+
+
+async def save_session(session_id: str, session: Akinator, redis: Redis) -> Akinator:
+    """Save session object. It's cached and written to DB in background if session cache is enabled
+
+    :param session_id: Unique ID that used as a key for Session object in DB
+    :type session_id: str
+    :param session: Session object
+    :type session: Akinator
+    :param redis: Connection to DB object
+    :type redis: Redis
+    :return: Session object
+    :rtype: Akinator
+    """
+    # Write timing of DB measures background flush if session is cached, so saving itself is timed separately
+    with save_session_seconds.time():
+        if session_cache.enabled and not session.partial:
+            session_cache.put(session_id, session)
+
+            return session
+
+        session_cache.discard(session_id)
+
+        return await write_session(session_id=session_id, session=session, redis=redis)
+
+
 async def create_and_save_session(
     session_id: str, redis: Redis, is_ended: int = 0
 ) -> typing.Tuple[bool, typing.Optional[Akinator]]:
@@ -103,8 +346,77 @@ async def create_and_save_session(
     return False, None
 
 
+async def load_session(
+    session_id: str, redis: Redis, fields: typing.Optional[typing.Iterable[str]] = None
+) -> typing.Optional[Akinator]:
+    """Load Session object from DB
+
+    :param session_id: Unique ID that used as a key for Session object in DB
+    :type session_id: str
+    :param redis: Connection to DB object
+    :type redis: Redis
+    :param fields: Session attributes that are needed, all attributes if None
+    :type fields: list, optional
+    :return: Session object or None if not founded
+    :rtype: Akinator, optional
+    """
+    tags = get_session_tags(fields)
+
+    try:
+        with redis_seconds.time(operation="load"), span("redis.load"):
+            values = await redis.hmget(session_id, *tags)
+
+    except ReplyError as exc:
+        if not str(exc).startswith("WRONGTYPE"):
+            raise
+
+        # Session saved by previous versions as a single dump. It's rewritten as hash on next save
+        with redis_seconds.time(operation="load_dump"), span("redis.load_dump"):
+            session_dump = await redis.get(session_id)
+        if not session_dump:
+            return None
+
+        session = Akinator()
+        session.load_session(session_dump)
+
+        return session
+
+    loaded = {tag: value for tag, value in zip(tags, values) if value is not None}
+    if not loaded:
+        return None
+
+    session = Akinator()
+    session.load_fields(loaded)
+    session.partial = fields is not None
+
+    return session
+
+
+async def is_cached_version(session_id: str, session: Akinator, redis: Redis) -> bool:
+    """Check that cached session has the same version as session in DB
+
+    :param session_id: Unique ID that used as a key for Session object in DB
+    :type session_id: str
+    :param session: Cached session object
+    :type session: Akinator
+    :param redis: Connection to DB object
+    :type redis: Redis
+    :return: True if session in DB was not written by anyone else
+    :rtype: bool
+    """
+    try:
+        with redis_seconds.time(operation="version"), span("redis.version"):
+            version = await redis.hget(session_id, SESSION_VERSION_TAG)
+
+    except ReplyError:
+        # Session in DB is stored in previous dump format
+        return False
+
+    return (version or b"").decode("utf-8") == (session.version or "")
+
+
 async def get_or_create_session(
-    session_id: str, redis: Redis
+    session_id: str, redis: Redis, fields: typing.Optional[typing.Iterable[str]] = None
 ) -> typing.Tuple[bool, typing.Optional[Akinator]]:
     """Find Session object in DB, create if not founded
 
@@ -112,16 +424,32 @@ async def get_or_create_session(
     :type session_id: str
     :param redis: Connection to DB object
     :type redis: Redis
+    :param fields: Session attributes that are needed by handler, all attributes if None
+    :type fields: list, optional
     :return: `True` if created, `False` if existed and Session object
     :rtype: tuple(bool, Akinator)
     """
-    session_dump = await redis.get(session_id, encoding="utf-8")
+    if session_cache.enabled:
+        session = session_cache.get(session_id)
+        if session and config.SESSION_LOCK_ENABLED and not await is_cached_version(session_id, session, redis):
+            # Changed by another replica since it was cached
+            session_cache.discard(session_id)
+            session = None
 
-    if session_dump:
-        # Founded. Load object
-        session = Akinator()
-        session.load_session(session_dump)
+        if session:
+            # Founded in cache
+            return False, session
+
+        # Load complete session, so it could be cached
+        session = await load_session(session_id=session_id, redis=redis)
+        if session:
+            session_cache.cache(session_id, session)
 
+    else:
+        session = await load_session(session_id=session_id, redis=redis, fields=fields)
+
+    if session:
+        # Founded
         return False, session
 
     # Not founded. Create
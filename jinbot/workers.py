@@ -0,0 +1,101 @@
+import asyncio
+import traceback
+import typing
+
+
+class WorkerPool:
+    """Bounded pool of background workers, separate from handlers
+
+    | Jobs that waited in queue longer than their deadline are dropped without running
+
+    :param workers: Amount of jobs that run simultaneously
+    :type workers: int
+    :param queue_size: Maximal amount of waiting jobs. New jobs are dropped if queue is full
+    :type queue_size: int
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+        self.dropped = 0
+
+        self._queue = None
+        self._tasks = []
+
+    def start(self):
+        """Start workers"""
+        if not self._tasks:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stop workers, waiting jobs are dropped"""
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def submit(self, job: typing.Callable[[], typing.Awaitable], deadline: float = None) -> bool:
+        """Put job in queue
+
+        :param job: Function without arguments that returns awaitable
+        :type job: typing.Callable
+        :param deadline: Event loop time after that job is not started
+        :type deadline: float, optional
+        :return: True if job is queued, False if pool is not started or queue is full
+        :rtype: bool
+        """
+        if self._queue is None:
+            self.dropped += 1
+
+            return False
+
+        try:
+            self._queue.put_nowait((job, deadline))
+
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+            return False
+
+        return True
+
+    def stats(self) -> dict:
+        """Pool counters"""
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "completed": self.completed,
+            "failed": self.failed,
+            "expired": self.expired,
+            "dropped": self.dropped,
+        }
+
+    async def _work(self):
+        loop = asyncio.get_event_loop()
+
+        while True:
+            job, deadline = await self._queue.get()
+
+            try:
+                if deadline is not None and loop.time() > deadline:
+                    self.expired += 1
+
+                else:
+                    await job()
+                    self.completed += 1
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception:
+                self.failed += 1
+                traceback.print_exc()
+
+            finally:
+                self._queue.task_done()
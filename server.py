@@ -1,20 +1,43 @@
 import os
 import traceback
 import asyncio
+import functools
 
 import aioredis
-from vkbottle import Bot, Message, PhotoUploader
+from vkbottle import Bot, Message
 from vkbottle.framework.framework.rule import ChatActionRule
 from vkbottle.types import GroupJoin
 from vkbottle.utils.exceptions import VKError
 
-from jinbot import config
-from jinbot.core import Game
+from jinbot import config, handlers
+from jinbot.admission import admission_control
+from jinbot.akinator import session_info
+from jinbot.client import init_client, close_client
+from jinbot.images import image_cache, image_workers
+from jinbot.lanes import chat_lanes
 from jinbot.managers import VKStrategy
+from jinbot.metrics import registry, metrics_server
+from jinbot.pool import session_pool
+from jinbot.region import region_resolver
+from jinbot.resilience import adaptive_timeouts, game_api_breaker, hedge_stats
+from jinbot.tracing import setup_logging
+from jinbot.utils import session_cache, SessionLock
 
 from vkapi.utils import remove_admin_prefix
 from vkapi.rules import CommandFromAdmin
-from vkapi.core import handle_admin_notify, handle_admin_redis, after_startup
+from vkapi.core import (
+    handle_admin_notify,
+    handle_admin_redis,
+    handle_admin_stats,
+    handle_admin_jobs,
+    handle_admin_status,
+    handle_admin_cancel,
+    after_startup,
+    run_broadcast,
+)
+from vkapi.broadcast import find_unfinished_broadcasts
+from vkapi.jobs import admin_jobs
+from vkapi.outbox import Outbox
 
 
 group_token = os.getenv("VK_KEY")
@@ -22,11 +45,10 @@ loop = asyncio.get_event_loop()
 
 bot = Bot(group_token, loop=loop, debug=config.DEBUG)
 bot.group_id = Bot.get_id_by_token(token=group_token, loop=loop)
+bot.outbox = Outbox(api=bot.api)
 
 redis = bot.loop.run_until_complete(aioredis.create_redis_pool(f"redis://{config.REDIS_HOST}", password=os.getenv("REDIS_KEY")))
-
-uploader = PhotoUploader(bot.api, generate_attachment_strings=True)
-setattr(bot, "uploader", uploader)
+bot.loop.run_until_complete(init_client())
 
 # Get admin list
 managers = bot.loop.run_until_complete(bot.api.groups.get_members(group_id=bot.group_id, filter="managers"))
@@ -41,7 +63,19 @@ async def handle_admin_command(msg: Message):
         await handle_admin_redis(redis=redis, msg=msg, command=command)
 
     elif command.startswith("notify"):
-        await handle_admin_notify(bot=bot, msg=msg, command=command)
+        await handle_admin_notify(bot=bot, redis=redis, msg=msg, command=command)
+
+    elif command.startswith("stats"):
+        await handle_admin_stats(bot=bot, msg=msg)
+
+    elif command.startswith("jobs"):
+        await handle_admin_jobs(msg=msg)
+
+    elif command.startswith("status"):
+        await handle_admin_status(msg=msg, command=command)
+
+    elif command.startswith("cancel"):
+        await handle_admin_cancel(msg=msg, command=command)
 
     else:
         await msg(config.ADMIN_UNKNOWN_COMMAND_TEXT)
@@ -88,61 +122,81 @@ async def handle_invite(msg: Message):
 
 @bot.on.message_handler(text=config.ANSWER_BACK)
 async def handle_back(msg: Message):
-    game = await Game.factory_game(
-        bot=bot, manager=VKStrategy, msg=msg, redis=redis, chat_id=str(msg.chat_id)
-    )
-    if game:
-        await game.handle_back()
-    else:
-        await msg(config.TEXT_SERVER_DOWN)
+    await handlers.serialized(bot=bot, redis=redis, msg=msg, handler=handlers.handle_back)
 
 
 @bot.on.message_handler(text=config.ANSWER_CONTINUE)
 async def handle_continue(msg: Message):
-    game = await Game.factory_game(
-        bot=bot, manager=VKStrategy, msg=msg, redis=redis, chat_id=str(msg.chat_id)
-    )
-    if game:
-        await game.handle_continue()
-
-    else:
-        await msg(config.TEXT_SERVER_DOWN)
+    await handlers.serialized(bot=bot, redis=redis, msg=msg, handler=handlers.handle_continue)
 
 
 @bot.on.message_handler(text=config.ANSWER_RESTART)
 async def handle_restart(msg: Message):
-    await Game.handle_restart(
-        bot=bot, manager=VKStrategy, msg=msg, redis=redis, chat_id=str(msg.chat_id)
-    )
+    await handlers.serialized(bot=bot, redis=redis, msg=msg, handler=handlers.handle_restart)
 
 
 @bot.on.message_handler()
 async def handle_answer(msg: Message):
-    answer = config.ANSWERS.get(msg.text, None)
-    if answer:
-        # Known answer
-        game = await Game.factory_game(
-            bot=bot, manager=VKStrategy, msg=msg, redis=redis, chat_id=str(msg.chat_id)
-        )
+    await handlers.serialized(bot=bot, redis=redis, msg=msg, handler=handlers.handle_answer)
 
-        if game:
-            await game.handle_answer(answer=answer)
 
-        else:
-            await msg(config.TEXT_SERVER_DOWN)
-
-    else:
-        # Unknown answer
-        await VKStrategy.send_message(bot=bot, msg=msg, text=config.TEXT_UNKNOWN_COMMAND)
+async def shutdown():
+    """Write cached sessions and release shared connections"""
+    # Interrupted broadcasts keep their progress and are resumed after restart
+    await admin_jobs.stop()
+    await session_cache.stop()
+    await image_workers.stop()
+    await bot.outbox.stop()
+    await metrics_server.stop()
+    await session_pool.stop()
+    await session_info.stop()
+    await close_client()
+    redis.close()
+    await redis.wait_closed()
 
 
 if __name__ == "__main__":
     # Initialize akinator global vars
-    config.init_akinator()
+    bot.loop.run_until_complete(region_resolver.refresh(force=True))
+    session_info.start()
+    session_pool.start()
+    session_cache.start(redis=redis)
+    image_cache.start(redis=redis)
+    image_workers.start()
+    bot.outbox.start()
+    if config.TRACE_SAMPLE_RATE:
+        setup_logging()
+    if config.METRICS_ENABLED:
+        for component, stats in (
+            ("session_pool", session_pool.stats),
+            ("lanes", chat_lanes.stats),
+            ("admission", admission_control.stats),
+            ("game_api_breaker", game_api_breaker.stats),
+            ("game_api_timeouts", adaptive_timeouts.stats),
+            ("game_api_hedges", lambda: hedge_stats),
+            ("session_lock", lambda: SessionLock.stats),
+            ("session_cache", session_cache.stats),
+            ("image_cache", image_cache.stats),
+            ("image_workers", image_workers.stats),
+            ("outbox", bot.outbox.stats),
+            ("admin_jobs", admin_jobs.stats),
+        ):
+            registry.add_stats(component, stats)
+        bot.loop.run_until_complete(metrics_server.start())
+    for broadcast in bot.loop.run_until_complete(find_unfinished_broadcasts(bot=bot, redis=redis)):
+        admin_jobs.submit(
+            name=f"resume-{broadcast.broadcast_id}",
+            run=functools.partial(run_broadcast, broadcast),
+        )
 
-    if config.DEBUG:
-        bot.run_polling()
+    try:
+        if config.DEBUG:
+            bot.run_polling()
 
-    else:
-        bot.loop.create_task(after_startup(bot=bot))
-        bot.run_polling()
+        else:
+            admin_jobs.submit(name="after_startup", run=functools.partial(after_startup, bot))
+            bot.run_polling()
+
+    finally:
+        if not bot.loop.is_closed():
+            bot.loop.run_until_complete(shutdown())
@@ -0,0 +1,10 @@
+"""Local stand-ins of akinator.com game API and Redis for offline load testing
+
+Usage: python -m simulator [--port 8500] [--latency 0.05] [--error-rate 0.01] [--curve logistic]
+
+Point the bot at it with environment variables::
+
+    AKINATOR_SCHEME=http AKINATOR_URI=127.0.0.1:8500 python server.py
+"""
+from simulator.fake_redis import FakeRedis
+from simulator.app import Settings, Simulator, make_app, INJECTED_ERRORS, PROGRESSION_CURVES
@@ -0,0 +1,42 @@
+import argparse
+
+from aiohttp import web
+
+from simulator.app import Settings, make_app, INJECTED_ERRORS, PROGRESSION_CURVES
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m simulator", description="Local stand-in of akinator.com game API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8500)
+    parser.add_argument("--latency", type=float, default=0, help="Seconds added to every API response")
+    parser.add_argument("--jitter", type=float, default=0, help="Maximal random seconds added to latency")
+    parser.add_argument("--error-rate", type=float, default=0, help="Probability of injected error")
+    parser.add_argument(
+        "--errors",
+        nargs="+",
+        default=list(INJECTED_ERRORS),
+        choices=INJECTED_ERRORS,
+        help="Injected errors, chosen randomly",
+    )
+    parser.add_argument("--curve", default="logistic", choices=sorted(PROGRESSION_CURVES))
+    parser.add_argument("--max-steps", type=int, default=80)
+    parser.add_argument("--servers", type=int, default=1, help="Amount of game servers on the start page")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    settings = Settings(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        errors=args.errors,
+        curve=args.curve,
+        max_steps=args.max_steps,
+        servers=args.servers,
+        seed=args.seed,
+    )
+    web.run_app(make_app(settings), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
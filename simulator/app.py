@@ -0,0 +1,331 @@
+import asyncio
+import collections
+import json
+import math
+import random
+import typing
+
+from aiohttp import web
+
+# Errors of game API that could be injected
+INJECTED_ERRORS = ("KO - SERVER DOWN", "KO - TIMEOUT", "WARN - NO QUESTION")
+
+ANSWERS = [
+    {"answer": "Да"},
+    {"answer": "Нет"},
+    {"answer": "Я не знаю"},
+    {"answer": "Возможно, частично"},
+    {"answer": "Скорее нет, не совсем"},
+]
+
+# Smallest valid PNG, 1x1 transparent pixel. Served as picture of every guess
+PICTURE = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+
+def logistic_curve(rng: random.Random) -> typing.Callable[[int], float]:
+    """Progression grows slowly, then quickly, then saturates. Midpoint is between 10 and 35 steps"""
+    midpoint = rng.uniform(10, 35)
+
+    return lambda step: 100 / (1 + math.exp(-(step - midpoint) / 3))
+
+
+def linear_curve(rng: random.Random) -> typing.Callable[[int], float]:
+    """Progression grows by 2.5-5 percents every step"""
+    rate = rng.uniform(2.5, 5)
+
+    return lambda step: min(100.0, step * rate)
+
+
+def stuck_curve(rng: random.Random) -> typing.Callable[[int], float]:
+    """Progression never reaches victory, so game ends by defeat"""
+    rate = rng.uniform(1, 3)
+
+    return lambda step: min(70.0, step * rate)
+
+
+# Name: function that gets random generator of session and returns progression by step
+PROGRESSION_CURVES = {
+    "logistic": logistic_curve,
+    "linear": linear_curve,
+    "stuck": stuck_curve,
+}
+
+
+class Settings:
+    """Behaviour of simulated game API
+
+    :param latency: Seconds added to every API response
+    :type latency: float, optional
+    :param jitter: Maximal random seconds added to latency
+    :type jitter: float, optional
+    :param error_rate: Probability of injected error in API response
+    :type error_rate: float, optional
+    :param errors: Injected errors, chosen randomly. e.g. `KO - SERVER DOWN`, `KO - TIMEOUT`, `WARN - NO QUESTION`
+    :type errors: list, optional
+    :param curve: Name of progression curve from `PROGRESSION_CURVES`
+    :type curve: str, optional
+    :param max_steps: Step after that there is no questions
+    :type max_steps: int, optional
+    :param servers: Amount of game servers on the start page
+    :type servers: int, optional
+    :param seed: Seed of random generators, so runs are reproducible
+    :type seed: int, optional
+    """
+
+    def __init__(
+        self,
+        latency: float = 0,
+        jitter: float = 0,
+        error_rate: float = 0,
+        errors: typing.Sequence[str] = INJECTED_ERRORS,
+        curve: str = "logistic",
+        max_steps: int = 80,
+        servers: int = 1,
+        seed: int = 0,
+    ):
+        if curve not in PROGRESSION_CURVES:
+            raise ValueError(f"Unknown progression curve {curve}")
+
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.errors = list(errors)
+        self.curve = curve
+        self.max_steps = max_steps
+        self.servers = servers
+        self.seed = seed
+
+
+class Game:
+    """Simulated game session. Progression depends only on session ID, step and seed
+
+    :param session: Session ID
+    :type session: int
+    :param signature: Session signature
+    :type signature: int
+    :param settings: Simulator settings
+    :type settings: Settings
+    """
+
+    def __init__(self, session: int, signature: int, settings: Settings):
+        self.session = session
+        self.signature = signature
+        self.step = 0
+
+        rng = random.Random(f"{settings.seed}:{session}")
+        self.progression = PROGRESSION_CURVES[settings.curve](rng)
+        self.character = rng.randrange(1, 100000)
+
+    def step_information(self) -> dict:
+        return {
+            "question": f"Вопрос {self.step + 1} о персонаже?",
+            "answers": ANSWERS,
+            "step": str(self.step),
+            "progression": f"{self.progression(self.step):.5f}",
+            "questionid": str(self.step + 1),
+            "infogain": "0.5",
+        }
+
+
+class Simulator:
+    """Local stand-in of akinator.com game API
+
+    | Serves start page with servers, `/game` page with session info and JSONP endpoints:
+      `new_session` and `answer_api` on the site, `cancel_answer` and `list` on every server
+
+    :param settings: Simulator settings
+    :type settings: Settings
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.games = {}
+        # Requests by endpoint and injected errors by endpoint, served on `/stats`
+        self.requests = collections.Counter()
+        self.injected = collections.Counter()
+
+        self._rng = random.Random(settings.seed)
+        self._last_session = 0
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/", self.handle_start_page)
+        app.router.add_get("/game", self.handle_game_page)
+        app.router.add_get("/new_session", self.handle_new_session)
+        app.router.add_get("/answer_api", self.handle_answer)
+        app.router.add_get("/stats", self.handle_stats)
+        app.router.add_get("/photos/{character}.png", self.handle_picture)
+        for server in range(1, self.settings.servers + 1):
+            app.router.add_get(f"/srv{server}/ws/cancel_answer", self.handle_cancel_answer)
+            app.router.add_get(f"/srv{server}/ws/list", self.handle_list)
+
+        return app
+
+    async def handle_start_page(self, request: web.Request) -> web.Response:
+        # Same escaping as on akinator.com, so `jinbot.region.server_regex` matches
+        themes = json.dumps(
+            [
+                {
+                    "translated_theme_name": "Персонажи",
+                    "urlWs": f"{request.scheme}://{request.host}/srv{server}/ws",
+                    "subject_id": "1",
+                }
+                for server in range(1, self.settings.servers + 1)
+            ],
+            ensure_ascii=False,
+        ).replace("/", "\\/").replace(", ", ",").replace(": ", ":")
+
+        return web.Response(
+            text=f"<html><script>oBridge.push('arrUrlThemesToPlay', {themes});</script></html>", content_type="text/html"
+        )
+
+    async def handle_game_page(self, request: web.Request) -> web.Response:
+        error = await self._simulate("game")
+        if error:
+            # Page without session info, like the one that is served while game API is down
+            return web.Response(text="<html></html>", content_type="text/html")
+
+        return web.Response(
+            text=f"<html><script>\n"
+                 f"    var uid_ext_session = 'simulator-{self._rng.randrange(10 ** 8)}';\n"
+                 f"    var frontaddr = 'MTI3LjAuMC4x';\n"
+                 f"</script></html>",
+            content_type="text/html",
+        )
+
+    async def handle_new_session(self, request: web.Request) -> web.Response:
+        error = await self._simulate("new_session")
+        if error:
+            return self._jsonp(request, {"completion": error})
+
+        self._last_session += 1
+        game = Game(session=self._last_session, signature=self._rng.randrange(10 ** 9), settings=self.settings)
+        self.games[game.session] = game
+
+        return self._jsonp(
+            request,
+            {
+                "completion": "OK",
+                "parameters": {
+                    "identification": {
+                        "channel": 0,
+                        "session": str(game.session),
+                        "signature": str(game.signature),
+                        "challenge_auth": "simulator",
+                    },
+                    "step_information": game.step_information(),
+                },
+            },
+        )
+
+    async def handle_answer(self, request: web.Request) -> web.Response:
+        return await self._move(request, "answer_api", 1)
+
+    async def handle_cancel_answer(self, request: web.Request) -> web.Response:
+        return await self._move(request, "cancel_answer", -1)
+
+    async def handle_list(self, request: web.Request) -> web.Response:
+        error = await self._simulate("list")
+        game = self._find_game(request)
+        if error or game is None:
+            return self._jsonp(request, {"completion": error or "KO - TIMEOUT"})
+
+        return self._jsonp(
+            request,
+            {
+                "completion": "OK",
+                "parameters": {
+                    "elements": [
+                        {
+                            "element": {
+                                "id": str(game.character),
+                                "name": f"Персонаж {game.character}",
+                                "description": "Персонаж из симулятора",
+                                "absolute_picture_path": f"{request.scheme}://{request.host}/photos/{game.character}.png",
+                                "proba": f"{game.progression(game.step) / 100:.5f}",
+                            }
+                        }
+                    ],
+                    "NbObjetsPertinents": "1",
+                },
+            },
+        )
+
+    async def handle_picture(self, request: web.Request) -> web.Response:
+        self.requests["picture"] += 1
+
+        return web.Response(body=PICTURE, content_type="image/png")
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {"games": len(self.games), "requests": dict(self.requests), "injected": dict(self.injected)}
+        )
+
+    async def _move(self, request: web.Request, endpoint: str, delta: int) -> web.Response:
+        """Move game one step forward or back"""
+        error = await self._simulate(endpoint)
+        game = self._find_game(request)
+        if error or game is None:
+            return self._jsonp(request, {"completion": error or "KO - TIMEOUT"})
+
+        if game.step + delta >= self.settings.max_steps:
+            return self._jsonp(request, {"completion": "WARN - NO QUESTION"})
+
+        game.step = max(0, game.step + delta)
+
+        return self._jsonp(request, {"completion": "OK", "parameters": game.step_information()})
+
+    def _find_game(self, request: web.Request) -> typing.Optional[Game]:
+        """Game of request or None if session or signature is wrong, like expired session of game API"""
+        try:
+            game = self.games.get(int(request.query["session"]))
+            if game is not None and game.signature == int(request.query["signature"]):
+                return game
+
+        except (KeyError, ValueError):
+            pass
+
+        return None
+
+    async def _simulate(self, endpoint: str) -> typing.Optional[str]:
+        """Wait for simulated latency and choose injected error
+
+        :return: Injected error or None
+        :rtype: str, optional
+        """
+        self.requests[endpoint] += 1
+
+        delay = self.settings.latency + self._rng.uniform(0, self.settings.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if self.settings.errors and self._rng.random() < self.settings.error_rate:
+            self.injected[endpoint] += 1
+
+            return self._rng.choice(self.settings.errors)
+
+        return None
+
+    @staticmethod
+    def _jsonp(request: web.Request, body: dict) -> web.Response:
+        callback = request.query.get("callback", "callback")
+
+        return web.Response(text=f"{callback}({json.dumps(body, ensure_ascii=False)})", content_type="text/javascript")
+
+
+def make_app(settings: Settings = None) -> web.Application:
+    """Create aiohttp application of simulator
+
+    :param settings: Simulator settings
+    :type settings: Settings, optional
+    :return: Application
+    :rtype: web.Application
+    """
+    simulator = Simulator(settings or Settings())
+    app = simulator.make_app()
+    app["simulator"] = simulator
+
+    return app
@@ -0,0 +1,220 @@
+import collections
+import time
+import typing
+
+from aioredis.errors import ReplyError
+
+
+def encode(value: typing.Any) -> bytes:
+    """Encode value the same way as Redis client does"""
+    if isinstance(value, bytes):
+        return value
+
+    if isinstance(value, str):
+        return value.encode("utf-8")
+
+    return repr(value).encode("utf-8")
+
+
+def decode(value: typing.Optional[bytes], encoding: typing.Optional[str]) -> typing.Any:
+    if value is None or encoding is None:
+        return value
+
+    return value.decode(encoding)
+
+
+class FakeTransaction:
+    """Commands queued by `FakeRedis.multi_exec` and executed at once"""
+
+    def __init__(self, redis: "FakeRedis"):
+        self._redis = redis
+        self._commands = []
+
+    def __getattr__(self, name: str):
+        command = getattr(self._redis, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+
+        return queue
+
+    async def execute(self) -> list:
+        self._redis.round_trips += 1
+
+        return [await command(*args, _counted=True, **kwargs) for command, args, kwargs in self._commands]
+
+
+class FakeRedis:
+    """In-memory stand-in of `aioredis` 1.3 connection with commands that the bot uses
+
+    | Counts commands and round trips, so benchmarks could report DB load per message.
+      `eval` supports only compare-and-delete and compare-and-extend scripts of session lock
+      and conditional write of session hash
+    """
+
+    SET_IF_NOT_EXIST = "SET_IF_NOT_EXIST"
+
+    def __init__(self):
+        self.commands = collections.Counter()
+        self.round_trips = 0
+
+        self._data = {}
+        self._expires = {}
+
+    @property
+    def total_commands(self) -> int:
+        return sum(self.commands.values())
+
+    def multi_exec(self) -> FakeTransaction:
+        return FakeTransaction(self)
+
+    async def get(self, key: str, encoding: str = None, _counted: bool = False):
+        self._count("get", _counted)
+
+        return decode(self._get(key), encoding)
+
+    async def set(
+        self, key: str, value, expire: int = 0, pexpire: int = 0, exist: str = None, _counted: bool = False
+    ) -> bool:
+        self._count("set", _counted)
+        if exist == self.SET_IF_NOT_EXIST and self._get(key) is not None:
+            return False
+
+        self._data[key] = encode(value)
+        self._expire(key, expire or pexpire / 1000)
+
+        return True
+
+    async def delete(self, *keys: str, _counted: bool = False) -> int:
+        self._count("delete", _counted)
+
+        return sum(self._delete(key) for key in keys)
+
+    async def expire(self, key: str, timeout: int, _counted: bool = False) -> bool:
+        self._count("expire", _counted)
+        if self._get(key) is None:
+            return False
+
+        self._expire(key, timeout)
+
+        return True
+
+    async def incr(self, key: str, _counted: bool = False) -> int:
+        self._count("incr", _counted)
+        value = int(self._get(key) or 0) + 1
+        self._data[key] = encode(value)
+
+        return value
+
+    async def hmset_dict(self, key: str, *args, _counted: bool = False, **kwargs):
+        self._count("hmset_dict", _counted)
+        values = dict(*args, **kwargs)
+        self._data.setdefault(key, {}).update({field: encode(value) for field, value in values.items()})
+
+    async def hget(self, key: str, field: str, encoding: str = None, _counted: bool = False):
+        self._count("hget", _counted)
+        values = self._get(key) or {}
+        if not isinstance(values, dict):
+            raise ReplyError("WRONGTYPE Operation against a key holding the wrong kind of value")
+
+        return decode(values.get(field), encoding)
+
+    async def hmget(self, key: str, *fields: str, encoding: str = None, _counted: bool = False) -> list:
+        self._count("hmget", _counted)
+        values = self._get(key) or {}
+        if not isinstance(values, dict):
+            raise ReplyError("WRONGTYPE Operation against a key holding the wrong kind of value")
+
+        return [decode(values.get(field), encoding) for field in fields]
+
+    async def hgetall(self, key: str, encoding: str = None, _counted: bool = False) -> dict:
+        self._count("hgetall", _counted)
+
+        return {field: decode(value, encoding) for field, value in (self._get(key) or {}).items()}
+
+    async def sadd(self, key: str, *members, _counted: bool = False) -> int:
+        self._count("sadd", _counted)
+        values = self._data.setdefault(key, set())
+        added = {encode(member) for member in members} - values
+        values.update(added)
+
+        return len(added)
+
+    async def srem(self, key: str, *members, _counted: bool = False) -> int:
+        self._count("srem", _counted)
+        values = self._get(key) or set()
+        removed = {encode(member) for member in members} & values
+        values.difference_update(removed)
+
+        return len(removed)
+
+    async def smembers(self, key: str, encoding: str = None, _counted: bool = False) -> list:
+        self._count("smembers", _counted)
+
+        return [decode(member, encoding) for member in self._get(key) or ()]
+
+    async def eval(self, script: str, keys: list = (), args: list = (), _counted: bool = False):
+        self._count("eval", _counted)
+        if "hmset" in script:
+            return self._write_session(keys[0], *args)
+
+        if self._get(keys[0]) != encode(args[0]):
+            return 0
+
+        if "pexpire" in script:
+            # Lease of lock is extended
+            self._expire(keys[0], int(args[1]) / 1000)
+
+            return 1
+
+        return self._delete(keys[0])
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+    def _write_session(self, key: str, expected: str, expire: int, replace: str, *fields) -> typing.Optional[bytes]:
+        """Same as `jinbot.utils.WRITE_SESSION_SCRIPT`"""
+        values = self._get(key)
+        version = values.get("v") if isinstance(values, dict) else None
+        if expected != "*" and (version or b"") != encode(expected):
+            return None
+
+        if replace == "1":
+            self._delete(key)
+
+        if fields:
+            version = encode(int(version or 0) + 1)
+            self._data.setdefault(key, {}).update(
+                {"v": version, **{field: encode(value) for field, value in zip(fields[::2], fields[1::2])}}
+            )
+
+        self._expire(key, int(expire))
+
+        return version or b""
+
+    def _count(self, command: str, counted: bool):
+        self.commands[command] += 1
+        if not counted:
+            self.round_trips += 1
+
+    def _get(self, key: str):
+        expires = self._expires.get(key)
+        if expires is not None and expires < time.monotonic():
+            self._delete(key)
+
+        return self._data.get(key)
+
+    def _delete(self, key: str) -> int:
+        self._expires.pop(key, None)
+
+        return int(self._data.pop(key, None) is not None)
+
+    def _expire(self, key: str, timeout: float):
+        if timeout:
+            self._expires[key] = time.monotonic() + timeout
+
+        else:
+            self._expires.pop(key, None)
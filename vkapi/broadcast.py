@@ -0,0 +1,367 @@
+import asyncio
+import time
+import traceback
+import typing
+import zlib
+
+from aiohttp import ClientError
+from aioredis.commands import Redis
+from vkbottle.utils.exceptions import VKError
+
+from jinbot import config
+from jinbot.managers import VKStrategy
+from jinbot.utils import get_object_key
+from vkapi.outbox import build_execute_code
+from vkapi.utils import extract_users
+
+# Set of IDs of broadcasts that are not finished yet
+ACTIVE_BROADCASTS_KEY = get_object_key(VKStrategy, "broadcasts")
+# Counter of broadcast IDs
+BROADCAST_ID_KEY = get_object_key(VKStrategy, "broadcast_id")
+# Errors of API requests that are retried until `config.BROADCAST_MAX_ERRORS` consecutive ones
+RETRIED_ERRORS = (VKError, ValueError, ClientError, asyncio.TimeoutError)
+
+
+def get_broadcast_key(broadcast_id: str) -> str:
+    """Key of broadcast progress in DB"""
+    return get_object_key(VKStrategy, "broadcast", broadcast_id)
+
+
+class Broadcast:
+    """Message that is sent to a group of users
+
+    | Conversations are fetched by one task while users of fetched pages are sent by another one
+      with `execute` batches, so fetching and sending overlap. All requests are made within rate limit of bot outbox
+      and yield to replies of players.
+    | If connection to DB is given, progress is kept there after every batch, so broadcast is resumed
+      from the last sent page after restart. Random ID of every send depends on its position,
+      so VK drops duplicates of the batch that was being sent at crash
+
+    :param bot: VK bot object
+    :param redis: Connection to DB object. Progress is not kept if it's None
+    :type redis: Redis, optional
+    :param broadcast_id: Unique ID of broadcast
+    :type broadcast_id: str
+    :param message: Message text
+    :type message: str
+    :param message_filter: Message filter. e.g. `all`, `unread`, `important`, `unanswered`
+    :type message_filter: str
+    :param min_age: Minimal age of last message to consider user for sending
+    :type min_age: int
+    :param max_users: Maximal number of users
+    :type max_users: int, float
+    :param earlier: if 1, then send messages to users with earlier last_message, later otherwise
+    :type earlier: int, optional
+    :param peer_id: ID of admin chat that gets progress reports
+    :type peer_id: int, optional
+    :param started: Timestamp of broadcast beginning, that age of last messages is counted from
+    :type started: float, optional
+    """
+
+    def __init__(
+        self,
+        bot,
+        redis: typing.Optional[Redis],
+        broadcast_id: str,
+        message: str,
+        message_filter: str,
+        min_age: int,
+        max_users: typing.Union[int, float],
+        earlier: int = 1,
+        peer_id: int = None,
+        started: float = None,
+    ):
+        self.bot = bot
+        self.redis = redis
+        self.broadcast_id = broadcast_id
+        self.message = message
+        self.message_filter = message_filter
+        self.min_age = min_age
+        self.max_users = max_users
+        self.earlier = earlier
+        self.peer_id = peer_id
+        self.started = started or time.time()
+
+        # Amount of conversations that were fetched and sent
+        self.offset = 0
+        # Amount of users that got message or failed to get it
+        self.sent = 0
+        self.failed = 0
+        self.status = "running"
+        self.cancelled = False
+        # Consecutive failed batches
+        self._send_errors = 0
+
+    @classmethod
+    async def create(cls, bot, redis: typing.Optional[Redis], **params) -> "Broadcast":
+        """Create new broadcast and keep it in DB, so it's resumed after restart
+
+        :param bot: VK bot object
+        :param redis: Connection to DB object. Broadcast is not kept if it's None
+        :type redis: Redis, optional
+        :param params: Params of broadcast except ID
+        :return: Broadcast object
+        :rtype: Broadcast
+        """
+        if redis is None:
+            return cls(bot=bot, redis=None, broadcast_id="local", **params)
+
+        broadcast = cls(bot=bot, redis=redis, broadcast_id=str(await redis.incr(BROADCAST_ID_KEY)), **params)
+        await broadcast.save()
+        await redis.sadd(ACTIVE_BROADCASTS_KEY, broadcast.broadcast_id)
+
+        return broadcast
+
+    @classmethod
+    async def load(cls, bot, redis: Redis, broadcast_id: str) -> typing.Optional["Broadcast"]:
+        """Load broadcast from DB
+
+        :param bot: VK bot object
+        :param redis: Connection to DB object
+        :type redis: Redis
+        :param broadcast_id: Unique ID of broadcast
+        :type broadcast_id: str
+        :return: Broadcast object or None if it's not found
+        :rtype: Broadcast, optional
+        """
+        values = await redis.hgetall(get_broadcast_key(broadcast_id), encoding="utf-8")
+        if not values:
+            return None
+
+        broadcast = cls(
+            bot=bot,
+            redis=redis,
+            broadcast_id=broadcast_id,
+            message=values["message"],
+            message_filter=values["filter"],
+            min_age=int(values["min_age"]),
+            max_users=float(values["max_users"]),
+            earlier=int(values["earlier"]),
+            peer_id=int(values["peer_id"]) if values.get("peer_id") else None,
+            started=float(values["started"]),
+        )
+        broadcast.offset = int(values["offset"])
+        broadcast.sent = int(values["sent"])
+        broadcast.failed = int(values["failed"])
+        broadcast.status = values["status"]
+
+        return broadcast
+
+    async def save(self):
+        """Keep broadcast and its progress in DB"""
+        if self.redis is None:
+            return
+
+        key = get_broadcast_key(self.broadcast_id)
+        transaction = self.redis.multi_exec()
+        transaction.hmset_dict(
+            key,
+            message=self.message,
+            filter=self.message_filter,
+            min_age=self.min_age,
+            max_users=str(self.max_users),
+            earlier=self.earlier,
+            peer_id=self.peer_id or "",
+            started=self.started,
+            offset=self.offset,
+            sent=self.sent,
+            failed=self.failed,
+            status=self.status,
+        )
+        transaction.expire(key, config.BROADCAST_EXPIRE_TIME)
+        await transaction.execute()
+
+    def progress_text(self) -> str:
+        """Progress of broadcast for admin chat"""
+        return config.ADMIN_COMMAND_BROADCAST_PROGRESS_TEXT.format(
+            id=self.broadcast_id, status=self.status, offset=self.offset, sent=self.sent, failed=self.failed
+        )
+
+    async def report(self):
+        """Send progress to admin chat"""
+        if self.peer_id is None or not self.bot.outbox.running:
+            return
+
+        try:
+            await self.bot.outbox.put(
+                {"peer_id": self.peer_id, "message": self.progress_text(), "random_id": self.bot.extension.random_id()}
+            )
+        except VKError:
+            traceback.print_exc()
+
+    def cancel(self):
+        """Mark broadcast as cancelled by admin, so it's not resumed. Task that runs it should be cancelled too"""
+        self.cancelled = True
+
+    async def run(self):
+        """Send message to all users from current offset. Failed requests are retried up to `config.BROADCAST_MAX_ERRORS` times"""
+        pages = asyncio.Queue()
+        fetcher = asyncio.ensure_future(self._fetch(pages))
+        reporter = asyncio.ensure_future(self._report_forever())
+
+        try:
+            await self._send(pages)
+            # Reraise error of fetching, if any
+            await fetcher
+            self.status = "done"
+
+        except asyncio.CancelledError:
+            # Broadcast that was interrupted by shutdown stays running, so it's resumed after restart
+            if self.cancelled:
+                self.status = "cancelled"
+
+            raise
+
+        except Exception:
+            # Progress is saved and reported in `finally`, error is reported by runner of broadcast
+            self.status = "failed"
+            raise
+
+        finally:
+            fetcher.cancel()
+            reporter.cancel()
+            await self.save()
+            if self.redis is not None and self.status != "running":
+                await self.redis.srem(ACTIVE_BROADCASTS_KEY, self.broadcast_id)
+
+            await self.report()
+
+    async def _fetch(self, pages: asyncio.Queue):
+        """Put users of every page of conversations in queue. None is put at the end"""
+        offset = self.offset
+        errors = 0
+
+        try:
+            while offset < self.max_users:
+                try:
+                    conversations = await self.bot.outbox.limited(
+                        lambda: self.bot.api.messages.get_conversations(
+                            offset=offset,
+                            count=config.BROADCAST_PAGE_SIZE,
+                            filter=self.message_filter,
+                            extended=0,
+                            group_id=self.bot.group_id,
+                        ),
+                        background=True,
+                    )
+
+                except RETRIED_ERRORS:
+                    errors += 1
+                    if errors >= config.BROADCAST_MAX_ERRORS:
+                        raise
+
+                    traceback.print_exc()
+                    await asyncio.sleep(config.ADMIN_TIMEOUT_API)
+                    continue
+
+                errors = 0
+                if not conversations.items:
+                    break
+
+                offset += len(conversations.items)
+                pages.put_nowait((offset, extract_users(conversations.items, self.min_age, self.started, self.earlier)))
+
+        finally:
+            pages.put_nowait(None)
+
+    async def _send(self, pages: asyncio.Queue):
+        """Send users of fetched pages by batches. Progress is saved after every batch"""
+        calls = []
+        offset = self.offset
+        # Users that were already put in calls, including users sent before resume
+        users = self.sent + self.failed
+
+        while True:
+            page = await pages.get()
+            if page is not None:
+                page_offset, user_ids = page
+                if users + len(user_ids) > self.max_users:
+                    user_ids = user_ids[: max(0, int(self.max_users - users))]
+
+                users += len(user_ids)
+
+                for start in range(0, len(user_ids), config.BROADCAST_CHUNK_SIZE):
+                    # Persisted start time makes ID unique across restarts and reused broadcast IDs,
+                    # while resumed broadcast repeats the same ID, so VK drops already sent messages
+                    random_id = zlib.crc32(f"{self.broadcast_id}:{self.started!r}:{offset}:{start}".encode())
+                    calls.append(
+                        {
+                            "user_ids": ",".join(map(str, user_ids[start : start + config.BROADCAST_CHUNK_SIZE])),
+                            "message": self.message,
+                            "random_id": random_id & 0x7FFFFFFF,
+                        }
+                    )
+
+                offset = page_offset
+
+            if page is None or len(calls) >= config.VK_EXECUTE_BATCH_SIZE or pages.empty():
+                # Send everything fetched so far, then next pages are likely fetched already
+                for start in range(0, len(calls), config.VK_EXECUTE_BATCH_SIZE):
+                    await self._send_batch(calls[start : start + config.VK_EXECUTE_BATCH_SIZE])
+
+                calls = []
+                self.offset = offset
+                await self.save()
+
+            if page is None:
+                return
+
+    async def _send_batch(self, calls: typing.List[dict]):
+        """Send calls of `messages.send` by one `execute` request and count results
+
+        | Users of failed request are counted as failed and broadcast goes on,
+          unless `config.BROADCAST_MAX_ERRORS` requests in a row failed
+        """
+        try:
+            results = await self.bot.outbox.request(
+                "execute", {"code": build_execute_code("messages.send", calls)}, background=True
+            )
+            self._send_errors = 0
+
+        except RETRIED_ERRORS:
+            self._send_errors += 1
+            if self._send_errors >= config.BROADCAST_MAX_ERRORS:
+                raise
+
+            traceback.print_exc()
+            results = [False] * len(calls)
+            await asyncio.sleep(config.ADMIN_TIMEOUT_API)
+
+        for params, result in zip(calls, results):
+            if isinstance(result, list):
+                # Result of every user, it contains error if message was not sent
+                failed = sum(1 for user in result if isinstance(user, dict) and "error" in user)
+                self.failed += failed
+                self.sent += len(result) - failed
+
+            elif result:
+                self.sent += params["user_ids"].count(",") + 1
+
+            else:
+                self.failed += params["user_ids"].count(",") + 1
+
+    async def _report_forever(self):
+        while True:
+            await asyncio.sleep(config.BROADCAST_REPORT_INTERVAL)
+            await self.report()
+
+
+async def find_unfinished_broadcasts(bot, redis: Redis) -> typing.List[Broadcast]:
+    """Find broadcasts that were not finished before restart, so they could be resumed
+
+    :param bot: VK bot object
+    :param redis: Connection to DB object
+    :type redis: Redis
+    :return: List of Broadcast objects
+    :rtype: list
+    """
+    broadcasts = []
+    for broadcast_id in await redis.smembers(ACTIVE_BROADCASTS_KEY, encoding="utf-8"):
+        broadcast = await Broadcast.load(bot=bot, redis=redis, broadcast_id=broadcast_id)
+        if broadcast is None or broadcast.status != "running":
+            await redis.srem(ACTIVE_BROADCASTS_KEY, broadcast_id)
+
+        else:
+            broadcasts.append(broadcast)
+
+    return broadcasts
@@ -1,105 +1,47 @@
 import typing
-import time
-import asyncio
-import traceback
 
-from vkbottle.utils.exceptions import VKError
-
-from vkapi.utils import extract_params, extract_users
+from vkapi.broadcast import Broadcast
+from vkapi.jobs import Job, admin_jobs
+from vkapi.utils import extract_params
 from jinbot import config
+from jinbot.admission import admission_control
+from jinbot.images import image_cache, image_workers
+from jinbot.lanes import chat_lanes
+from jinbot.pool import session_pool
+from jinbot.prefetch import guess_prefetcher
+from jinbot.region import region_resolver, endpoint_pool
+from jinbot.resilience import adaptive_timeouts, game_api_breaker, hedge_stats
+from jinbot.utils import session_cache, SessionLock
 
 
-async def send_messages(
-        bot,
-        message: str,
-        message_filter: str,
-        min_age: int,
-        max_users: typing.Union[int, float],
-        earlier: int = 1,
-):
-    """Send message to a group of users
-
-    :param bot: VK bot object
-    :param message: Message text
-    :type message: str
-    :param message_filter: Message filter. e.g. `all`, `unread`, `important`, `unanswered`
-    :type message_filter: str
-    :param min_age: Minimal age of last message to consider user for sending
-    :type min_age: int
-    :param max_users: Maximal number of users
-    :type max_users: int, float
-    :param earlier: if 1, then send messages to users with earlier last_message, later otherwise
-    :type earlier: int, optional
-    """
-    ended = False
-    offset = 0
-    now = time.time()
-
-    while not ended:
-        try:
-            conversations = await bot.api.messages.get_conversations(
-                offset=offset,
-                count=200,
-                filter=message_filter,
-                extended=0,
-                group_id=bot.group_id,
-            )
-
-            if not conversations.items or offset >= max_users:
-                # Either `max_users` limit reached, or got no new items
-                ended = True
-
-            else:
-                await asyncio.sleep(config.ADMIN_TIMEOUT_NOTIFY)
-                offset += 200
-
-                user_ids = extract_users(conversations.items, min_age, now, earlier)
-                first_id = max_users if max_users < len(user_ids) else 100
-
-                if user_ids:
-                    await bot.api.messages.send(
-                        user_ids=user_ids[:first_id],
-                        message=message,
-                        random_id=bot.extension.random_id(),
-                    )
-
-                    if len(user_ids) > 100:
-                        # Second part of users, if exist
-                        await asyncio.sleep(config.ADMIN_TIMEOUT_NOTIFY)
-                        await bot.api.messages.send(
-                            user_ids=user_ids[first_id:],
-                            message=message,
-                            random_id=bot.extension.random_id(),
-                        )
-
-                await asyncio.sleep(config.ADMIN_TIMEOUT_NOTIFY)
-
-        except (VKError, ValueError):
-            # Some unexpected error while sending messages. Ignore
-            await asyncio.sleep(config.ADMIN_TIMEOUT_API)
-            traceback.print_exc()
+async def after_startup(bot, job: Job):
+    """Send reloading-message to last `max_users` users who was playing at the moment
 
-        except:
-            # Some exception while sending. Just ignore
-            traceback.print_exc()
-
-
-async def after_startup(bot):
-    """Send reloading-message to last `max_users` users who was playing at the moment"""
+    | Progress of this broadcast is not kept, because the next restart sends new message anyway
+    """
     max_users = config.ADMIN_COMMAND_SEND_MESSAGE_RESTART_MAX_USERS
     min_age = config.ADMIN_COMMAND_SEND_MESSAGE_RESTART_MIN_AGE
     message_filter = config.ADMIN_COMMAND_SEND_MESSAGE_RESTART_FILTER
     message = config.ADMIN_COMMAND_SEND_MESSAGE_RESTART_ENDED_TEXT
     earlier = config.ADMIN_COMMAND_SEND_MESSAGE_RESTART_EARLIER
 
-    await send_messages(
+    broadcast = await Broadcast.create(
         bot=bot,
+        redis=None,
         message=message,
         message_filter=message_filter,
         min_age=min_age,
         max_users=max_users,
         earlier=earlier,
     )
+    await run_broadcast(broadcast=broadcast, job=job)
+
+
+async def run_broadcast(broadcast: Broadcast, job: Job):
+    """Run broadcast as admin job, so its progress could be queried and it could be cancelled"""
+    job.progress = broadcast.progress_text
+    job.on_cancel = broadcast.cancel
+    await broadcast.run()
 
 
 async def handle_admin_redis(redis, command, msg):
@@ -130,7 +72,7 @@ async def handle_admin_redis(redis, command, msg):
     await msg(response)
 
 
-async def handle_admin_notify(bot, msg, command):
+async def handle_admin_notify(bot, redis, msg, command):
     """Notify command.
 
     | e.g. ```notify-all-2000-20-0 Message``` sends `Message` message
@@ -142,18 +84,93 @@ async def handle_admin_notify(bot, msg, command):
         # `command_and_text` should consist at least of 2 elements. Command and Text
         command, text, message_filter, max_users, min_age, earlier = extract_params(command_and_text)
 
-        await msg(config.ADMIN_COMMAND_START_TEXT.format(command=command))
-
-        await send_messages(
-            bot=bot,
-            message=text,
-            message_filter=message_filter,
-            min_age=min_age,
-            max_users=max_users,
-            earlier=earlier,
-        )
+        async def notify(job: Job):
+            broadcast = await Broadcast.create(
+                bot=bot,
+                redis=redis,
+                message=text,
+                message_filter=message_filter,
+                min_age=min_age,
+                max_users=max_users,
+                earlier=earlier,
+                peer_id=msg.peer_id,
+            )
+            await run_broadcast(broadcast=broadcast, job=job)
+            await msg(config.ADMIN_COMMAND_END_TEXT.format(command=command))
 
-        await msg(config.ADMIN_COMMAND_END_TEXT.format(command=command))
+        # Broadcast runs in background, so admin could query and cancel it
+        job = admin_jobs.submit(name=command, run=notify)
+        await msg(config.ADMIN_COMMAND_START_TEXT.format(command=command, id=job.job_id))
 
     else:
         await msg(config.ADMIN_UNKNOWN_COMMAND_TEXT)
+
+
+async def handle_admin_jobs(msg):
+    """Jobs command. Send status of all kept jobs"""
+    jobs = admin_jobs.jobs()
+
+    await msg("\n\n".join(job.describe() for job in jobs) if jobs else config.ADMIN_COMMAND_NO_JOBS_TEXT)
+
+
+def extract_job_id(command: str) -> typing.Optional[int]:
+    """Extract job ID from command. e.g. ```status 3```"""
+    try:
+        return int(command.split()[1])
+
+    except (IndexError, ValueError):
+        return None
+
+
+async def handle_admin_status(msg, command):
+    """Status command. e.g. ```status 3``` sends status and progress of job 3"""
+    job_id = extract_job_id(command)
+    if job_id is None:
+        await msg(config.ADMIN_UNKNOWN_COMMAND_TEXT)
+
+        return
+
+    job = admin_jobs.get(job_id)
+    await msg(job.describe() if job else config.ADMIN_COMMAND_JOB_NOT_FOUND_TEXT.format(id=job_id))
+
+
+async def handle_admin_cancel(msg, command):
+    """Cancel command. e.g. ```cancel 3``` cancels job 3"""
+    job_id = extract_job_id(command)
+    if job_id is None:
+        await msg(config.ADMIN_UNKNOWN_COMMAND_TEXT)
+
+    elif admin_jobs.cancel(job_id):
+        await msg(config.ADMIN_COMMAND_JOB_CANCELLED_TEXT.format(id=job_id))
+
+    else:
+        await msg(config.ADMIN_COMMAND_JOB_NOT_FOUND_TEXT.format(id=job_id))
+
+
+async def handle_admin_stats(bot, msg):
+    """Stats command. Send counters of internal components"""
+    stats = {
+        "session_pool": session_pool.stats(),
+        "region": region_resolver.stats(),
+        "endpoints": endpoint_pool.stats(),
+        "game_api_breaker": game_api_breaker.stats(),
+        "game_api_timeouts": adaptive_timeouts.stats(),
+        "game_api_hedges": hedge_stats,
+        "lanes": chat_lanes.stats(),
+        "admission": admission_control.stats(),
+        "session_lock": SessionLock.stats,
+        "session_cache": session_cache.stats(),
+        "image_cache": image_cache.stats(),
+        "image_workers": image_workers.stats(),
+        "guess_prefetch": guess_prefetcher.stats(),
+        "outbox": bot.outbox.stats(),
+        "admin_jobs": admin_jobs.stats(),
+    }
+
+    await msg(
+        "\n".join(
+            config.ADMIN_COMMAND_STATS_TEXT.format(name=f"{component}.{name}", value=value)
+            for component, counters in stats.items()
+            for name, value in counters.items()
+        )
+    )
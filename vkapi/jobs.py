@@ -0,0 +1,182 @@
+import asyncio
+import collections
+import time
+import traceback
+import typing
+
+from jinbot import config
+
+
+class Job:
+    """Long admin command that runs in background
+
+    :param job_id: Unique ID of job
+    :type job_id: int
+    :param name: Name of job, e.g. command that started it
+    :type name: str
+    """
+
+    def __init__(self, job_id: int, name: str):
+        self.job_id = job_id
+        self.name = name
+        self.status = "queued"
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        # Function that returns text of job progress and function that is called before job is cancelled by admin.
+        # Set by job itself
+        self.progress: typing.Optional[typing.Callable[[], str]] = None
+        self.on_cancel: typing.Optional[typing.Callable[[], None]] = None
+
+        self.task = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def describe(self) -> str:
+        """Text of job status for admin chat"""
+        finished = self.finished or time.time()
+        text = config.ADMIN_COMMAND_JOB_TEXT.format(
+            id=self.job_id,
+            name=self.name,
+            status=self.status,
+            duration=round(finished - self.started) if self.started else 0,
+        )
+        if self.progress is not None:
+            text += f"\n{self.progress()}"
+
+        return text
+
+
+class JobRunner:
+    """Runner of admin jobs with limited concurrency
+
+    | Jobs over the limit wait in queue. Finished jobs are kept for status queries until history limit is reached
+
+    :param concurrency: Amount of jobs that run simultaneously
+    :type concurrency: int, optional
+    :param history: Maximal amount of kept finished jobs
+    :type history: int, optional
+    """
+
+    def __init__(self, concurrency: int = config.ADMIN_JOBS_CONCURRENCY, history: int = config.ADMIN_JOBS_HISTORY):
+        self.concurrency = concurrency
+        self.history = history
+
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+        self._jobs = collections.OrderedDict()
+        self._last_id = 0
+        self._semaphore = None
+
+    def submit(self, name: str, run: typing.Callable[[Job], typing.Awaitable]) -> Job:
+        """Start job in background
+
+        :param name: Name of job, e.g. command that started it
+        :type name: str
+        :param run: Coroutine function that gets Job object and does the work
+        :type run: typing.Callable
+        :return: Job object
+        :rtype: Job
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        self._last_id += 1
+        job = Job(job_id=self._last_id, name=name)
+        job.task = asyncio.ensure_future(self._run(job, run))
+
+        self._jobs[job.job_id] = job
+        self._forget()
+
+        return job
+
+    def get(self, job_id: int) -> typing.Optional[Job]:
+        """Find job by ID
+
+        :param job_id: Unique ID of job
+        :type job_id: int
+        :return: Job object or None if it's not found
+        :rtype: Job, optional
+        """
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> typing.List[Job]:
+        """All kept jobs, oldest first"""
+        return list(self._jobs.values())
+
+    def cancel(self, job_id: int) -> bool:
+        """Cancel queued or running job
+
+        :param job_id: Unique ID of job
+        :type job_id: int
+        :return: True if job is cancelled, False if it's not found or finished already
+        :rtype: bool
+        """
+        job = self._jobs.get(job_id)
+        if job is None or job.done:
+            return False
+
+        if job.on_cancel is not None:
+            job.on_cancel()
+
+        job.task.cancel()
+
+        return True
+
+    async def stop(self):
+        """Cancel all jobs and wait for them. Unlike `cancel`, jobs are interrupted, so they could be resumed"""
+        tasks = [job.task for job in self._jobs.values() if not job.done]
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        """Runner counters"""
+        statuses = collections.Counter(job.status for job in self._jobs.values())
+
+        return {
+            "queued": statuses["queued"],
+            "running": statuses["running"],
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+        }
+
+    async def _run(self, job: Job, run: typing.Callable[[Job], typing.Awaitable]):
+        try:
+            async with self._semaphore:
+                job.status = "running"
+                job.started = time.time()
+                await run(job)
+
+            job.status = "done"
+            self.completed += 1
+
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            self.cancelled += 1
+
+        except Exception:
+            job.status = "failed"
+            self.failed += 1
+            traceback.print_exc()
+
+        finally:
+            job.finished = time.time()
+            self._forget()
+
+    def _forget(self):
+        """Remove the oldest finished jobs over history limit"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[: max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+
+# *** Globals
+admin_jobs = JobRunner()
+# Globals ***
@@ -0,0 +1,291 @@
+import asyncio
+import json
+import random
+import time
+import traceback
+import typing
+
+from vkbottle.utils.exceptions import VKError
+
+from jinbot import config
+
+
+class TokenBucket:
+    """Rate limiter. Allows `rate` requests per second with bursts up to `capacity`
+
+    :param rate: Amount of tokens added every second
+    :type rate: float
+    :param capacity: Maximal amount of tokens
+    :type capacity: float
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, reserve: float = 0):
+        """Wait until token is available and take it
+
+        :param reserve: Amount of tokens that should be left for other requests
+        :type reserve: float, optional
+        """
+        while True:
+            self._refill()
+            if self._tokens >= 1 + reserve:
+                self._tokens -= 1
+
+                return
+
+            await asyncio.sleep((1 + reserve - self._tokens) / self.rate)
+
+
+def build_execute_code(method: str, calls: typing.List[dict]) -> str:
+    """Build VKScript code that calls the same method with different params
+
+    :param method: API method, e.g. `messages.send`
+    :type method: str
+    :param calls: Params of every call
+    :type calls: list
+    :return: VKScript code that returns list of results
+    :rtype: str
+    """
+    return "return [{}];".format(
+        ",".join(f"API.{method}({json.dumps(params, ensure_ascii=False)})" for params in calls)
+    )
+
+
+class Outbox:
+    """Queue of outgoing messages that are sent by `execute` batches within API rate limit
+
+    :param api: VK API object
+    :param bucket: Rate limiter of API requests
+    :type bucket: TokenBucket, optional
+    :param batch_size: Maximal amount of messages in one `execute` request
+    :type batch_size: int, optional
+    :param senders: Amount of requests that are sent simultaneously
+    :type senders: int, optional
+    """
+
+    def __init__(
+        self,
+        api,
+        bucket: TokenBucket = None,
+        batch_size: int = config.VK_EXECUTE_BATCH_SIZE,
+        senders: int = config.VK_OUTBOX_SENDERS,
+    ):
+        self.api = api
+        self.bucket = bucket or TokenBucket(rate=config.VK_API_RATE_LIMIT, capacity=config.VK_API_RATE_LIMIT)
+        self.batch_size = batch_size
+        self.senders = senders
+
+        self.sent = 0
+        self.failed = 0
+        self.batches = 0
+        self.retries = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+        self._queue = None
+        self._tasks = []
+
+    @property
+    def running(self) -> bool:
+        """Messages could be enqueued only after outbox was started"""
+        return self._queue is not None
+
+    @property
+    def pending(self) -> int:
+        """Amount of messages waiting in queue"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """Start senders"""
+        if not self._tasks:
+            self._queue = asyncio.Queue()
+            self._tasks = [asyncio.ensure_future(self._send_forever()) for _ in range(self.senders)]
+
+    async def stop(self):
+        """Send queued messages and stop senders. Messages that couldn't be sent are failed, not left pending"""
+        if self._queue is not None:
+            while not self._queue.empty():
+                await self._send_batch(self._take_batch([]))
+
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        if self._queue is not None:
+            # Messages that were enqueued while senders were stopping
+            while not self._queue.empty():
+                self._fail(self._take_batch([]), RuntimeError("Outbox is stopped"))
+
+        self._queue = None
+
+    def put(self, params: dict) -> asyncio.Future:
+        """Enqueue `messages.send` call
+
+        :param params: Params of `messages.send`
+        :type params: dict
+        :return: Future with result of call. It's set with exception, e.g. VKError, if message was not sent
+        :rtype: asyncio.Future
+        """
+        future = asyncio.get_event_loop().create_future()
+        self._queue.put_nowait((params, future, time.monotonic()))
+
+        return future
+
+    def stats(self) -> dict:
+        """Outbox counters"""
+        return {
+            "pending": self.pending,
+            "sent": self.sent,
+            "failed": self.failed,
+            "batches": self.batches,
+            "retries": self.retries,
+            "latency_avg": round(self.latency_total / self.sent, 4) if self.sent else 0,
+            "latency_max": round(self.latency_max, 4),
+        }
+
+    def _take_batch(self, batch: list) -> list:
+        """Add queued messages to batch without waiting"""
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+
+        return batch
+
+    async def _send_forever(self):
+        while True:
+            batch = self._take_batch([await self._queue.get()])
+
+            try:
+                await self._send_batch(batch)
+
+            except asyncio.CancelledError as exc:
+                self._fail(batch, exc)
+                raise
+
+            except Exception as exc:
+                # Callers wait for their messages, so none of them is left unresolved
+                self._fail(batch, exc)
+                traceback.print_exc()
+
+    async def _acquire(self, background: bool):
+        if not background:
+            await self.bucket.acquire()
+
+            return
+
+        # Background requests wait until queued messages are sent and leave reserve for the next ones
+        while self.pending:
+            await asyncio.sleep(config.VK_BACKGROUND_YIELD_DELAY)
+
+        await self.bucket.acquire(reserve=config.VK_BACKGROUND_RESERVE)
+
+    async def limited(self, call: typing.Callable[[], typing.Awaitable], background: bool = False) -> typing.Any:
+        """Make API request within rate limit of outbox. Retry it with backoff if rate limit is exceeded anyway
+
+        :param call: Function without arguments that makes API request
+        :type call: typing.Callable
+        :param background: if True, then request yields to messages of outbox, e.g. it's made by broadcast
+        :type background: bool, optional
+        :return: Result of request
+        :raises VKError: if request failed
+        """
+        delay = config.VK_RATE_LIMIT_RETRY_DELAY
+
+        for attempt in range(config.VK_RATE_LIMIT_RETRIES + 1):
+            await self._acquire(background)
+
+            try:
+                return await call()
+
+            except VKError as exc:
+                if exc.error_code not in config.VK_RATE_LIMIT_ERROR_CODES or attempt == config.VK_RATE_LIMIT_RETRIES:
+                    raise
+
+            self.retries += 1
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            delay *= 2
+
+    async def request(self, method: str, params: dict, background: bool = False) -> typing.Any:
+        """Make raw API request within rate limit of outbox
+
+        :param method: API method, e.g. `execute`
+        :type method: str
+        :param params: Params of method
+        :type params: dict
+        :param background: if True, then request yields to messages of outbox
+        :type background: bool, optional
+        :return: Result of request
+        :raises VKError: if request failed
+        """
+        return await self.limited(lambda: self.api.request(method, params), background=background)
+
+    async def _send_one(self, params: dict, future: asyncio.Future, enqueued: float):
+        try:
+            result = await self.request("messages.send", params)
+
+        except Exception as exc:
+            self._done(future, enqueued, exc=exc)
+
+        else:
+            self._done(future, enqueued, result=result)
+
+    async def _send_batch(self, batch: list):
+        """Send messages by one `execute` request. Failed messages are sent again one by one to get their errors"""
+        if len(batch) == 1:
+            await self._send_one(*batch[0])
+
+            return
+
+        self.batches += 1
+        try:
+            results = await self.request("execute", {"code": build_execute_code("messages.send", [params for params, _, _ in batch])})
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception:
+            # VK or transport error. Messages are sent again one by one, `random_id` prevents duplicates
+            results = [False] * len(batch)
+
+        retried = []
+        for (params, future, enqueued), result in zip(batch, results):
+            if result is False:
+                retried.append(self._send_one(params, future, enqueued))
+
+            else:
+                self._done(future, enqueued, result=result)
+
+        await asyncio.gather(*retried)
+
+    def _fail(self, batch: list, exc: BaseException):
+        """Set exception to every message of batch that is not sent yet"""
+        for _, future, enqueued in batch:
+            if not future.done():
+                self._done(future, enqueued, exc=exc)
+
+    def _done(self, future: asyncio.Future, enqueued: float, result: typing.Any = None, exc: Exception = None):
+        if exc is not None:
+            self.failed += 1
+            if not future.done():
+                future.set_exception(exc)
+
+            return
+
+        latency = time.monotonic() - enqueued
+        self.sent += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        if not future.done():
+            future.set_result(result)